@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Micro benchmark for the jump arrow layout of dis. Builds a synthetic listing with lots of branches in both directions
+# and compares the layout code of the baseline listing.finish() (scanning all columns for a free one per arrow and
+# drawing every column of every row) against vdb.asm.layout_arrows(). Like test.py this is run from within the tests
+# directory.
+
+import sys
+import time
+import random
+
+sys.path.insert(0,'..')
+import vdb.asm
+
+class fake_instruction:
+    def __init__( self, address ):
+        self.address = address
+        self.targets = set()
+        self.target_of = set()
+        self.jumparrows = None
+        self.arrowwidth = None
+
+def synthetic_listing( count, branches, span, seed = 4711 ):
+    rnd = random.Random(seed)
+    ret = [ fake_instruction(0x1000 + i*4) for i in range(count) ]
+    for _ in range(branches):
+        fr = rnd.randrange(count)
+        to = min(count-1,max(0,fr + rnd.randint(-span,span)))
+        ret[fr].targets.add(ret[to].address)
+        ret[to].target_of.add(ret[fr].address)
+    return ret
+
+# The arrow layout of listing.finish() before layout_arrows() existed, copied verbatim from there (with the nested
+# functions one level less indented, self.start/self.end as parameters and without the add_target() calls that belong
+# to building the targets, not to the layout). It reads vdb-asm-tree-prefer-right itself like it did back then.
+def baseline_layout( instructions, start, end, prefer_right = False ):
+    tree_prefer_right = vdb.asm.tree_prefer_right
+    tree_prefer_right.value = prefer_right
+    next_index = vdb.asm.next_index
+
+    class arrow:
+        def __init__( self, fr, to ):
+            self.fr = fr
+            self.to = to
+            self.coloridx = next_index()
+            self.lines = 0
+            self.rows = 0
+            self.done = False
+            self.merger = None
+
+        def __str__( self ):
+            return f"{self.fr:#0x} -> {self.to:#0x}, c={self.coloridx},l={self.lines},r={self.rows},d={self.done}"
+
+    def find_next( cl, ar ):
+        clen = len(cl)
+        if( tree_prefer_right.value ):
+            r = range(clen-1,-1,-1)
+        else:
+            r = range(0,clen)
+
+        for i in r:
+            if( cl[i] is None ):
+                cl[i] = ar
+                return i
+            if( cl[i].done ):
+                old = cl[i]
+                ar.merger = old
+                cl[i] = ar
+                return i
+
+        cl += [ None ]
+        cl[clen] = ar
+        return clen
+
+    def to_arrows( ins, cl, ignore_target = False  ):
+#            print("###################")
+        ret = []
+        alen = 0
+#            print("ins.address = '%x'" % ins.address )
+
+#            print("current_lines = '%s'" % current_lines )
+        ridx = 0
+        doneleft = False
+        leftarrow = None
+        remove_indices = set()
+        for cidx in range(0,len(cl)):
+            ar = cl[cidx]
+#                print("ar = '%s'" % ar )
+            if( ar is None ):
+                # No vertical line expected here, lets see if we need some horizontal
+                if( leftarrow is not None ):
+                    ret.append( ("-",leftarrow.coloridx) )
+                else:
+                    ret.append( (" ",-1) )
+            else: # c is not None here
+                if( ar.done ):
+                    remove_indices.add(cidx)
+                if( ar.rows == 0 ):
+                    # arrow starts here, so goes down
+                    # but what if there already was another?
+                    if( leftarrow is not None ):
+                        if( ar.merger ):
+                            ret.append( ("+",leftarrow.coloridx) )
+                        else:
+                            ret.append( ("T",leftarrow.coloridx) )
+                    else:
+                        if( ar.merger ):
+                            if( ar.to == ar.fr ):
+                                ret.append( ("^",ar.coloridx) )
+                            else:
+                                ret.append( ("#",ar.coloridx) )
+                        elif( ins.address in ins.targets ):
+                            ret.append( (" ",-1) )
+                        else:
+                            ret.append( ("v",ar.coloridx) )
+                        leftarrow = ar
+                else:
+                    if( ar.done ):
+                        if( leftarrow is not None ):
+                            ret.append( ("u",leftarrow.coloridx) )
+                        else:
+                            ret.append( ("^",ar.coloridx) )
+                            leftarrow = ar
+                    else:
+                        # arrow already had a start
+                        if( ar.lines == 0 ):
+                            ret.append( ("|",ar.coloridx) )
+                        else:
+                            ret.append( ("|",ar.coloridx) )
+                    ar.lines += 1
+                ar.rows += 1
+            alen += 1
+            # back to the current_line loop from here
+        if( leftarrow is not None ):
+            if( ins.address in ins.targets ):
+                ret.append( ("Q",leftarrow.coloridx) )
+            elif( leftarrow.to == ins.address ):
+                ret.append( (">",leftarrow.coloridx) )
+            else:
+                ret.append( ("<",leftarrow.coloridx) )
+            alen += 1
+        for i in remove_indices:
+            cl[i] = None
+        return ( ret, alen )
+
+    current_lines = []
+    for ins in instructions:
+#            print("INS_----------------------------------")
+#            print("ins = '%s'" % ins )
+
+        # Remove those arrows that end here, whiche are always from above. Those that start here are not yet in the
+        # list
+        for cl in current_lines:
+            if( cl is not None ):
+                # One of the arrow ends targets this instruction
+                if( cl.to == ins.address or cl.fr == ins.address ):
+                    cl.done = True
+#                        print("DONE_01 cl = '%s'" % cl )
+
+
+        # Now add the new ones
+        for tgt in ins.targets:
+            if( start <= tgt <= end ):
+                if( tgt == ins.address ):
+                    ar = arrow(ins.address,tgt)
+                    find_next( current_lines, ar )
+                    ar.done = True
+#                        print("ADD2 %s" % ar)
+                # Target is further down, add an arrow
+                elif( tgt > ins.address ):
+                    ar = arrow(ins.address,tgt)
+                    find_next( current_lines, ar )
+#                        print("ADD1 %s" % ar)
+        if( len(ins.target_of) > 0 ):
+            # We are a target of something, lets have a look if those are further down
+            for target in ins.target_of :
+                if( target > ins.address ):
+                    # yep, further down, we need a new arrow
+                    ar = arrow(target,ins.address)
+                    find_next( current_lines, ar )
+        (ins.jumparrows,ins.arrowwidth) = to_arrows(ins,current_lines)
+    return len(current_lines)
+
+def run( fun, instructions, prefer_right ):
+    vdb.asm.ix = -1
+    start = instructions[0].address
+    end = instructions[-1].address
+    ncol = fun(instructions,start,end,prefer_right)
+    return ( ncol, [ (ins.jumparrows,ins.arrowwidth) for ins in instructions ] )
+
+def bench( name, fun, instructions, rounds ):
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        run(fun,instructions,False)
+    t1 = time.perf_counter()
+    rows = rounds * len(instructions)
+    print(f"{name:<10} : {rows/(t1-t0):12.0f} rows/s")
+    return rows/(t1-t0)
+
+if __name__ == "__main__":
+    rounds = 3
+    if( len(sys.argv) > 1 ):
+        rounds = int(sys.argv[1])
+
+    for count,branches,span in [ (200,50,20), (2000,800,200), (5000,3000,2000) ]:
+        instructions = synthetic_listing(count,branches,span)
+        for prefer_right in [ False, True ]:
+            if( run(baseline_layout,instructions,prefer_right) != run(vdb.asm.layout_arrows,instructions,prefer_right) ):
+                print("Layouts disagree, benchmark is meaningless")
+                sys.exit(1)
+        print(f"{count} instructions, {branches} branches, span {span}")
+        before = bench("before",baseline_layout,instructions,rounds)
+        after  = bench("after",vdb.asm.layout_arrows,instructions,rounds)
+        print(f"speedup    : {after/before:12.2f}x")
+
+# vim: tabstop=4 shiftwidth=4 expandtab ft=python
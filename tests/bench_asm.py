@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Micro benchmark for the tokenizing of disassemble/r output. Compares the old way (regex search per line with the
+# regexes compiled on every parse and the common fields split out a second time) against vdb.asm.tokenize() over the
+# mock listings. Like test.py this is run from within the tests directory.
+
+import sys
+import re
+import glob
+import time
+
+sys.path.insert(0,'..')
+import vdb.asm
+
+def legacy_tokenize( dis ):
+    linere = re.compile(r"^(=>)*\s*(0x[0-9a-f]*)(\s*<\+([0-9]*)>:)*\s*([^<]*)(<[^+]*(.*)>)*")
+    funcre = re.compile("for function (.*):")
+    rangere = re.compile("Dump of assembler code from (0x[0-9a-f]*) to (0x[0-9a-f]*):")
+    ret = []
+    for line in dis.splitlines():
+        vline = line.split()
+        try:
+            int(vline[0],16)
+        except (ValueError,IndexError):
+            pass
+
+    for line in dis.splitlines():
+        if( len(line) == 0 ):
+            continue
+        if( re.search(funcre,line) ):
+            continue
+        if( re.search(rangere,line) ):
+            continue
+        m = re.search(linere,line)
+        if( m is None ):
+            continue
+        tokens = line.split()
+        if( m.group(1) is not None ):
+            tokens = tokens[1:]
+        addr = tokens[0].strip()
+        if( addr[-1] == ":" ):
+            addr = addr[:-1]
+            del tokens[0]
+        else:
+            offset = tokens[1].strip()[1:-2]
+            if( offset[0] == "+" ):
+                offset = offset[1:]
+            del tokens[0]
+            del tokens[0]
+        ret.append( ( vdb.util.xint(addr), tokens ) )
+    return ret
+
+def new_tokenize( dis ):
+    ret = []
+    for line in dis.splitlines():
+        tok = vdb.asm.tokenize(line)
+        if( tok is not None ):
+            ret.append( ( tok.address, tok.tokens ) )
+    return ret
+
+def bench( name, fun, listings, rounds ):
+    lines = 0
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for dis in listings:
+            fun(dis)
+            lines += dis.count("\n")
+    t1 = time.perf_counter()
+    print(f"{name:<10} : {lines/(t1-t0):12.0f} lines/s")
+    return lines/(t1-t0)
+
+if __name__ == "__main__":
+    rounds = 1000
+    if( len(sys.argv) > 1 ):
+        rounds = int(sys.argv[1])
+    listings = []
+    for fn in sorted(glob.glob("mock*.txt")):
+        with open(fn) as f:
+            listings.append(f.read())
+
+    for dis in listings:
+        if( legacy_tokenize(dis) != new_tokenize(dis) ):
+            print("Tokenizers disagree, benchmark is meaningless")
+            sys.exit(1)
+
+    before = bench("before",legacy_tokenize,listings,rounds)
+    after  = bench("after",new_tokenize,listings,rounds)
+    print(f"speedup    : {after/before:12.2f}x")
+
+# vim: tabstop=4 shiftwidth=4 expandtab ft=python
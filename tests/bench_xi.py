@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Micro benchmark for the per step register bookkeeping of xi. Compares the old way (a full vdb.register.Registers()
+# every step, diffed through get_value() and the eflags decoded every step) against the register_layout snapshot of
+# vdb.xi with the eflags only decoded when they changed. The register file is a fake amd64 like frame so this also runs
+# without gdb, a read_register() there costs next to nothing, within gdb it is the expensive part, so also compare the
+# register reads per step. Like test.py this is run from within the tests directory.
+
+import sys
+import time
+import random
+
+from itertools import chain
+
+sys.path.insert(0,'..')
+import gdb
+
+# The mock leaves these None, the classification in vdb.register needs them distinct
+gdb.TYPE_CODE_INT = 8
+gdb.TYPE_CODE_FLT = 9
+gdb.TYPE_CODE_UNION = 3
+gdb.TYPE_CODE_FLAGS = 6
+
+import vdb.arch
+import vdb.register
+import vdb.xi
+
+vdb.arch.pointer_size = 64
+vdb.arch.pc_name = "rip"
+
+class fake_type:
+    def __init__( self, code, sizeof ):
+        self.code = code
+        self.sizeof = sizeof
+
+class fake_value(int):
+    def __new__( cls, val, t ):
+        ret = int.__new__(cls,val)
+        ret.type = t
+        ret.bytes = int(val).to_bytes(t.sizeof,"little")
+        return ret
+
+class fake_descriptor:
+    def __init__( self, name, t ):
+        self.name = name
+        self.type = t
+
+    def __str__( self ):
+        return self.name
+
+class fake_group:
+    def __init__( self, name ):
+        self.name = name
+
+class fake_architecture:
+    def __init__( self, descriptors, groups ):
+        self.descriptors = descriptors
+        self.groups = groups
+
+    def name( self ):
+        return "i386:x86-64"
+
+    def register_groups( self ):
+        return [ fake_group(g) for g in self.groups ]
+
+    def registers( self, group = None ):
+        if( group is None ):
+            return self.descriptors
+        return self.groups[group]
+
+class fake_frame:
+    def __init__( self, arch, values ):
+        self.arch = arch
+        self.values = values
+        self.reads = 0
+
+    def architecture( self ):
+        return self.arch
+
+    def read_register( self, reg ):
+        self.reads += 1
+        return fake_value( self.values[reg.name], reg.type )
+
+class fake_thread:
+    num = 1
+
+def amd64_frame( ):
+    i64 = fake_type(gdb.TYPE_CODE_INT,8)
+    i32 = fake_type(gdb.TYPE_CODE_INT,4)
+    flt = fake_type(gdb.TYPE_CODE_FLT,10)
+    flg = fake_type(gdb.TYPE_CODE_FLAGS,4)
+    vec = fake_type(gdb.TYPE_CODE_UNION,16)
+    gen = [ "rax","rbx","rcx","rdx","rsi","rdi","rbp","rsp" ] + [ f"r{i}" for i in range(8,16) ] + [ "rip" ]
+    descs = [ fake_descriptor(n,i64) for n in gen ]
+    descs.append( fake_descriptor("eflags",flg) )
+    descs += [ fake_descriptor(n,i32) for n in ( "cs","ss","ds","es","fs","gs" ) ]
+    descs += [ fake_descriptor(n,i64) for n in ( "fs_base","gs_base" ) ]
+    descs += [ fake_descriptor(f"st{i}",flt) for i in range(8) ]
+    descs += [ fake_descriptor(n,i32) for n in ( "fctrl","fstat","ftag","fiseg","fioff","foseg","fooff","fop" ) ]
+    vecs = [ fake_descriptor(f"xmm{i}",vec) for i in range(16) ]
+    descs += vecs
+    descs.append( fake_descriptor("mxcsr",flg) )
+    descs += [ fake_descriptor(f"k{i}",i64) for i in range(8) ]
+    groups = {
+            "general" : descs[:len(gen)+1],
+            "vector"  : vecs,
+            "all"     : descs
+            }
+    values = { d.name : 0 for d in descs }
+    values["rip"] = 0x401000
+    values["rsp"] = 0x7ffffffde000
+    values["eflags"] = 0x246
+    values["mxcsr"] = 0x1f80
+    return fake_frame( fake_architecture(descs,groups), values )
+
+# What a single step does to the registers, the pc always moves, one or two general purpose registers change and
+# roughly every third instruction sets the flags
+def step( frame, rnd ):
+    values = frame.values
+    values["rip"] += rnd.randint(1,15)
+    for _ in range(rnd.randint(1,2)):
+        values[rnd.choice(("rax","rbx","rcx","rdx","rsi","rdi","r8","r9"))] = rnd.getrandbits(64)
+    if( rnd.random() < 0.33 ):
+        values["eflags"] ^= 1 << rnd.choice((0,2,6,7,11))
+
+# The diff_regs as it was before the register_layout
+def legacy_diff_regs( r0, r1 ):
+    ret = {}
+    for rname,rval0 in chain(r0.regs.items(),r0.rflags.items()):
+        rval1 = r1.get_value(rname)
+        rval0 = int(rval0[0])
+        rval1 = int(rval1[0])
+        if( rval0 != rval1 ):
+            if( str(rname) != "rip" ):
+                ret[str(rname)] = rval1
+    return ret
+
+def legacy_steps( frame, steps, seed ):
+    rnd = random.Random(seed)
+    ret = []
+    oldr = vdb.register.Registers()
+    for _ in range(steps):
+        step(frame,rnd)
+        r = vdb.register.Registers()
+        dr = legacy_diff_regs(oldr,r)
+        flags = r._flags("eflags",r.rflags,vdb.register.flag_info,False,False,True,None)
+        ret.append( ( dr, flags ) )
+        oldr = r
+    return ret
+
+def new_steps( frame, steps, seed ):
+    rnd = random.Random(seed)
+    ret = []
+    fullr = vdb.register.Registers()
+    layout = vdb.xi.get_layout(fullr)
+    oldr = layout.read(frame)
+    pcname = vdb.arch.get_pc_name()
+    flags = fullr._flags("eflags",fullr.rflags,vdb.register.flag_info,False,False,True,None)
+    for _ in range(steps):
+        step(frame,rnd)
+        r = layout.read(frame)
+        dr = vdb.xi.diff_regs(oldr,r,pcname)
+        if( "eflags" in dr ):
+            rflags = { d : ( v, v.type ) for d in layout.flags if ( v := frame.read_register(d) ) is not None }
+            flags = fullr._flags("eflags",rflags,vdb.register.flag_info,False,False,True,None)
+        ret.append( ( dr, flags ) )
+        oldr = r
+    return ret
+
+def bench( name, fun, steps ):
+    frame = amd64_frame()
+    gdb.selected_frame = lambda : frame
+    gdb.selected_thread = lambda : fake_thread()
+    t0 = time.perf_counter()
+    fun(frame,steps,4711)
+    t1 = time.perf_counter()
+    print(f"{name:<10} : {steps/(t1-t0):12.0f} steps/s {frame.reads/steps:8.1f} register reads/step")
+    return steps/(t1-t0)
+
+def results( fun, steps ):
+    frame = amd64_frame()
+    gdb.selected_frame = lambda : frame
+    gdb.selected_thread = lambda : fake_thread()
+    return fun(frame,steps,4711)
+
+if __name__ == "__main__":
+    steps = 20000
+    if( len(sys.argv) > 1 ):
+        steps = int(sys.argv[1])
+
+    if( results(legacy_steps,1000) != results(new_steps,1000) ):
+        print("Register diffs disagree, benchmark is meaningless")
+        sys.exit(1)
+
+    before = bench("before",legacy_steps,steps)
+    after  = bench("after",new_steps,steps)
+    print(f"speedup    : {after/before:12.2f}x")
+
+# vim: tabstop=4 shiftwidth=4 expandtab ft=python
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tests for the register flow analysis of vdb.asm on made up listings, using the gdb mock. Like test.py this is run from
+# within the tests directory, it also works with pytest.
+
+import os
+import sys
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import gdb
+import vdb.asm
+
+# The marker is within the loop, so the loop header is reached from the function entry as well as from the marker
+loop_listing = """   0x1 <+0>: ff mov $0x1,%rax
+   0x2 <+1>: ff add %rbx,%rax
+=>   0x3 <+2>: ff add $0x1,%rbx
+   0x4 <+3>: ff cmp $0x10,%rbx
+   0x5 <+4>: ff jne 0x2 <foo>
+   0x6 <+5>: ff ret
+"""
+
+class register:
+    def __init__( self, name ):
+        self.name = name
+
+# A frame that has real values for some registers
+class register_frame( vdb.asm.fake_frame ):
+
+    class register_architecture:
+        def __init__( self, names ):
+            self.names = names
+
+        def registers( self ):
+            return [ register(n) for n in self.names ]
+
+    def __init__( self, registers ):
+        super().__init__()
+        self.registers = registers
+
+    def read_register( self, reg ):
+        return self.registers.get( getattr(reg,"name",reg) )
+
+    def architecture( self ):
+        return self.register_architecture(self.registers.keys())
+
+# Everything the flow analysis leaves in the instructions
+def flow_results( lng ):
+    ret = []
+    for ins in lng.instructions:
+        ret.append( ( ins.address, ins.passes, [ str(e[0]) for e in ins.extra ],
+                     [ str(r) for r in ins.possible_in_register_sets ],
+                     [ str(r) for r in ins.possible_out_register_sets ] ) )
+    return ret
+
+def full_flow( lng, frame ):
+    incremental = vdb.asm.incremental_flow.value
+    try:
+        vdb.asm.incremental_flow.value = False
+        lng.flow_key = None
+        vdb.asm.register_flow(lng,frame)
+    finally:
+        vdb.asm.incremental_flow.value = incremental
+    return flow_results(lng)
+
+def marked_listing( ):
+    lng = vdb.asm.parse_from("fake",loop_listing)
+    # Without a $pc the mock can't tell fix_marker() where we are
+    lng.marker = 0x3
+    return lng
+
+def test_incremental_after_register_change( ):
+    lng = marked_listing()
+    vdb.asm.incremental_flow.value = True
+    vdb.asm.invalidate_flow()
+    vdb.asm.register_flow(lng,register_frame( { "rbx" : 0x1 } ))
+    # The inferior did not run, but a register was changed by the user
+    frame = register_frame( { "rbx" : 0x5 } )
+    vdb.asm.invalidate_flow()
+    vdb.asm.register_flow(lng,frame)
+    incremental = flow_results(lng)
+    assert incremental == full_flow(lng,frame)
+
+def test_same_generation_is_skipped( ):
+    lng = marked_listing()
+    frame = register_frame( { "rbx" : 0x1 } )
+    vdb.asm.invalidate_flow()
+    vdb.asm.register_flow(lng,frame)
+    before = flow_results(lng)
+    vdb.asm.register_flow(lng,frame)
+    assert flow_results(lng) == before
+
+if __name__ == "__main__":
+    passed = 0
+    failed = 0
+    for name,fun in list(globals().items()):
+        if( not name.startswith("test_") ):
+            continue
+        try:
+            fun()
+            print(f"{name:<40} : ok")
+            passed += 1
+        except AssertionError as e:
+            print(f"{name:<40} : FAILED {e}")
+            failed += 1
+    print(f"Passed: {passed}, Failed: {failed}")
+    sys.exit(failed != 0)
+
+# vim: tabstop=4 shiftwidth=4 expandtab ft=python
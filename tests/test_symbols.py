@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Tests for the ELF symbol reader and the symbol index of vdb.memory. A small program is compiled and its symbols are
+# compared with what nm says about them, then an index is built for it at a made up load address. Like test.py this is
+# run from within the tests directory, it also works with pytest.
+
+import os
+import sys
+import shutil
+import tempfile
+import contextlib
+import subprocess
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+import gdb
+import vdb.memory
+
+source = """
+int counter = 1;
+static char buffer[64] = { 1 };
+int twice( int x ) { return 2*x + counter; }
+int main( ) { return twice(buffer[0]); }
+"""
+
+bias = 0x555555554000
+
+class fake_progspace:
+    def __init__( self, filename ):
+        self.filename = filename
+
+class fake_objfile:
+    def __init__( self, filename, owner = None ):
+        self.filename = filename
+        self.owner = owner
+
+workdir = None
+
+def build( ):
+    global workdir
+    if( workdir is None ):
+        workdir = tempfile.mkdtemp(prefix="vdb_symbols")
+        exe = os.path.join(workdir,"symbols")
+        with open(exe + ".c","w") as f:
+            f.write(source)
+        subprocess.check_call( [ "gcc", "-O0", "-no-pie", "-o", exe, exe + ".c" ] )
+        subprocess.check_call( [ "objcopy", "--only-keep-debug", exe, exe + ".debug" ] )
+        subprocess.check_call( [ "objcopy", "--strip-all", exe, exe + ".stripped" ] )
+    return os.path.join(workdir,"symbols")
+
+def nm_symbols( exe ):
+    ret = {}
+    for line in subprocess.check_output( [ "nm", "-S", "--defined-only", exe ] ).decode("utf-8").splitlines():
+        vline = line.split()
+        if( len(vline) == 4 ):
+            ret[vline[3]] = ( int(vline[0],16), int(vline[1],16) )
+    return ret
+
+missing = object()
+
+# Makes "info files" of the fake gdb show the allocated sections of exe at bias and gdb.objfiles() return objfiles. The
+# fake gdb module is shared by all tests, so everything is put back afterwards.
+@contextlib.contextmanager
+def loaded( exe, objfiles = None ):
+    sections,_ = vdb.memory.read_elf_symbols(exe)
+    info = f"Symbols from \"{exe}\".\n"
+    for name,addr in sections.items():
+        if( addr != 0 ):
+            info += f"\t{addr+bias:#018x} - {addr+bias+1:#018x} is {name}\n"
+    saved = { name : getattr(gdb,name,missing) for name in ( "current_progspace", "execute", "objfiles" ) }
+    try:
+        gdb.current_progspace = lambda : fake_progspace(exe)
+        gdb.execute = lambda cmd, *args, **kwargs : info
+        if( objfiles is not None ):
+            gdb.objfiles = lambda : objfiles
+        yield sections
+    finally:
+        for name,fun in saved.items():
+            if( fun is missing ):
+                if( hasattr(gdb,name) ):
+                    delattr(gdb,name)
+            else:
+                setattr(gdb,name,fun)
+
+def index_of( exe ):
+    with loaded(exe):
+        idx = vdb.memory.symbol_index()
+        idx.build( { exe : vdb.memory.read_elf_symbols(exe) } )
+    return idx
+
+def test_read_elf_symbols( ):
+    exe = build()
+    sections,symbols = vdb.memory.read_elf_symbols(exe)
+    assert ".text" in sections
+    assert ".data" in sections
+    by_name = { name : ( value, size ) for value,size,name in symbols }
+    expected = nm_symbols(exe)
+    for name in [ "counter", "buffer", "twice", "main" ]:
+        assert by_name[name] == expected[name], name
+
+def test_read_elf_symbols_stripped( ):
+    exe = build()
+    _,symbols = vdb.memory.read_elf_symbols(exe + ".stripped")
+    assert "twice" not in [ name for _,_,name in symbols ]
+    _,symbols = vdb.memory.read_elf_symbols(exe + ".debug")
+    assert "twice" in [ name for _,_,name in symbols ]
+
+def test_read_elf_symbols_not_elf( ):
+    exe = build()
+    try:
+        vdb.memory.read_elf_symbols(exe + ".c")
+    except ValueError:
+        return
+    assert False, "no ValueError for a non ELF file"
+
+def test_lookup( ):
+    exe = build()
+    idx = index_of(exe)
+    expected = nm_symbols(exe)
+    for name in [ "counter", "buffer", "twice", "main" ]:
+        value,size = expected[name]
+        assert idx.lookup(value+bias) == ( value+bias, size, name ), name
+        assert idx.lookup(value+bias+size-1) == ( value+bias, size, name ), name
+    value,size = expected["counter"]
+    assert idx.lookup(value) == ( None, None, None )
+    assert idx.lookup(0) == ( None, None, None )
+
+def test_lookup_nested( ):
+    idx = vdb.memory.symbol_index()
+    # outer [0x100,0x200) contains inner [0x110,0x120)
+    idx.starts = [ 0x100, 0x110 ]
+    idx.ends = [ 0x200, 0x120 ]
+    idx.names = [ "outer", "inner" ]
+    idx.parents = [ -1, 0 ]
+    assert idx.lookup(0x108) == ( 0x100, 0x100, "outer" )
+    assert idx.lookup(0x118) == ( 0x110, 0x10, "inner" )
+    assert idx.lookup(0x130) == ( 0x100, 0x100, "outer" )
+    assert idx.lookup(0x200) == ( None, None, None )
+
+def test_overlapping( ):
+    exe = build()
+    idx = index_of(exe)
+    expected = nm_symbols(exe)
+    value,size = expected["buffer"]
+    start = value + bias + 8
+    names = [ name for _,_,name in idx.overlapping(start,start+16) ]
+    assert names == [ "buffer" ]
+    for s,sz,name in idx.overlapping(bias,bias+0x100000):
+        assert expected[name] == ( s-bias, sz ), name
+    value,size = expected["twice"]
+    names = [ name for _,_,name in idx.overlapping(value+bias+size-1,value+bias+size) ]
+    assert "twice" in names
+    assert idx.overlapping(0,0x10) == []
+
+def test_separate_debug_file( ):
+    exe = build()
+    stripped = exe + ".stripped"
+    owner = fake_objfile(stripped)
+    with loaded( stripped, [ owner, fake_objfile(exe + ".debug",owner) ] ):
+        try:
+            vdb.memory.reset_symbol_index()
+            idx = vdb.memory.get_symbol_index()
+            value,size = nm_symbols(exe)["twice"]
+            assert idx.lookup(value+bias+1) == ( value+bias, size, "twice" )
+        finally:
+            vdb.memory.reset_symbol_index()
+
+if __name__ == "__main__":
+    passed = 0
+    failed = 0
+    for name,fun in list(globals().items()):
+        if( not name.startswith("test_") ):
+            continue
+        try:
+            fun()
+            print(f"{name:<32} : ok")
+            passed += 1
+        except AssertionError as e:
+            print(f"{name:<32} : FAILED {e}")
+            failed += 1
+    if( workdir is not None ):
+        shutil.rmtree(workdir)
+    print(f"Passed: {passed}, Failed: {failed}")
+    sys.exit(failed != 0)
+
+# vim: tabstop=4 shiftwidth=4 expandtab ft=python
@@ -11,17 +11,26 @@ import vdb.command
 import vdb.arch
 import vdb.register
 import vdb.memory
+import vdb.cache
+import vdb.subcommands
 
 import gdb
 import colors
 import importlib
 
 import re
+import heapq
+import bisect
+import collections
+import array
+import mmap
 import rich
 import traceback
-import pickle
+import json
+import hashlib
 import sys
 import os
+import shutil
 import time
 import abc
 import typing
@@ -70,10 +79,10 @@ pre_colors_dot = [
 
 @vdb.event.start()
 def invalidate_cache( c ):
-    global parse_cache
     if( len(parse_cache) ):
         vdb.log("Invalidating disassembler parse cache",level=4)
-    parse_cache = {}
+    parse_cache.clear()
+    canonical_keys.clear()
 
 bp_marker = vdb.config.parameter("vdb-asm-breakpoint-marker", "⬤" )
 bp_marker_disabled = vdb.config.parameter("vdb-asm-breakpoint-disabled-marker", "◯" )
@@ -143,9 +152,11 @@ asm_showspec_dot   = vdb.config.parameter("vdb-asm-showspec-dot", "maobnptr" )
 asm_tailspec       = vdb.config.parameter("vdb-asm-tailspec", "andD" )
 asm_sort           = vdb.config.parameter("vdb-asm-sort", True )
 dot_fonts          = vdb.config.parameter("vdb-asm-font-dot", "Inconsolata,Source Code Pro,DejaVu Sans Mono,Lucida Console,Roboto Mono,Droid Sans Mono,OCR-A,Courier" )
+dot_command        = vdb.config.parameter("vdb-asm-dot-command", "nohup dot -Txlib {filename} &>/dev/null &" )
 
 callgrind_events   = vdb.config.parameter("vdb-asm-callgrind-events", "Ir,CEst", gdb_type = vdb.config.PARAM_ARRAY )
 callgrind_jumps    = vdb.config.parameter("vdb-asm-callgrind-show-jumps", True )
+callgrind_index    = vdb.config.parameter("vdb-asm-callgrind-index", True )
 header_repeat      = vdb.config.parameter("vdb-asm-header-repeat", 50 )
 direct_output      = vdb.config.parameter("vdb-asm-direct-output", True )
 gv_limit           = vdb.config.parameter("vdb-asm-variable-expansion-limit", 3 )
@@ -156,7 +167,6 @@ asm_explain        = vdb.config.parameter("vdb-asm-explain", False, on_set = inv
 ref_width          = vdb.config.parameter("vdb-asm-reference-width", 120 )
 
 callgrind_eventmap = {} # name to index
-callgrind_data = {}
 from_tty = None
 
 xi_history = {}
@@ -315,6 +325,9 @@ class flag_set:
         for k,v in other.flags.items():
             self.set(k,v)
 
+    def same_values( self, other ):
+        return self.flags == other.flags
+
     def subset( self, filterset ):
         ret = flag_set()
         for fk,fv in self.flags.items():
@@ -435,8 +448,8 @@ class register_set:
             rval = registers.get_value(reg.name)
             if( rval is not None ):
                 self.set( reg.name, rval[0], origin= origin )
-            else:
-                print(f"{reg.name} is None")
+#            else:
+#                print(f"{reg.name} is None")
  
     # Sets the value of a register, possible removing all alternative names that may be present
     # XXX We need to be able to handle in an easy way specifcations like %al and %ah, best would be through some extra
@@ -469,6 +482,16 @@ class register_set:
     def empty( self ):
         return len(self.values) == 0
 
+    # Compares only the values, not where they came from
+    def same_values( self, other ):
+        if( len(self.values) != len(other.values) ):
+            return False
+        for n,(v,_) in self.values.items():
+            ov = other.values.get(n,None)
+            if( ov is None or ov[0] != v ):
+                return False
+        return True
+
     # To be compatible with the frame interface
     def read_register( self, reg ):
         ret,_,_ = self.get( reg )
@@ -515,6 +538,10 @@ class register_set:
 
 class asm_arg_base( ):
 
+    __slots__ = ( "register", "immediate", "immediate_hex", "dereference", "prefix", "offset", "offset_shift", "target",
+                  "jmp_target", "multiplier", "add_register", "asterisk", "argspec", "list_start", "list_end",
+                  "arg_string", "_bitsize" )
+
     def __init__( self, target, arg ):
         self.register = None
         self.immediate = None
@@ -631,15 +658,15 @@ class asm_arg_base( ):
                 if( self.dereference ):
                     castto = "P"
                     if( target is None ):
-                        dval = vdb.memory.read(val,vdb.arch.pointer_size//8)
+                        dval = vdb.memory.read(val,vdb.arch.pointer_size//8,consumer="asm")
 #                        vdb.util.inspect(dval)
                         if( vdb.arch.pointer_size == 32 ):
                             castto = "I"
                     else:
                         if( target.bitsize == 64 ):
-                            dval = vdb.memory.read(val,8)
+                            dval = vdb.memory.read(val,8,consumer="asm")
                         else:
-                            dval = vdb.memory.read(val,4)
+                            dval = vdb.memory.read(val,4,consumer="asm")
                             castto = "I"
                     if( dval is not None ):
 #                        print("dval = '%s'" % (dval,) )
@@ -714,6 +741,14 @@ class instruction_base( abc.ABC ):
                 cls.class_cache[mnemonic] = "default"
         return ret
 
+    __slots__ = ( "mnemonic", "args", "arguments", "args_string", "conditional_jump", "unconditional_jump", "call",
+                  "jump", "return_", "raw_target", "target_name", "parsed_target_name", "raw_reference", "reference",
+                  "parsed_reference", "targets", "target_of", "address", "offset", "bytes", "marked", "xmarked",
+                  "rmarked", "prefixes", "infix", "jumparrows", "arrowwidth", "bt", "history", "bt_idx", "extra",
+                  "static_extra", "file_line", "override_register_set", "possible_in_register_sets",
+                  "possible_out_register_sets", "iclass", "possible_in_flag_sets", "possible_out_flag_sets", "next",
+                  "previous", "passes", "file", "line", "unhandled", "explanation", "last_seen_registers" )
+
     def __init__( self ):
         self.mnemonic = None            # Instructions "name" like mov or sub or push or call
         self.args = []                  # tokenized list of argument strings
@@ -773,31 +808,14 @@ class instruction_base( abc.ABC ):
     # - current position marker
     # - address
     # - offset marker ( <+55> )
-    def parse_common( self, line, m, oldins ):
+    # tok is the disassembly_line object tokenize() created for this line, we only need to take over the common fields
+    def parse_common( self, line, tok, oldins ):
         self.line = line
-
-        tokens = line.split()
-        marker = m.group(1)
-        if( marker is not None ):
+        if( tok.marker ):
             self.marked = True
-            tokens = tokens[1:]
-
-        addr = tokens[0].strip()
-        # A : there tells us there is no <+###> offset following (common when the symbol is not known)
-        if( addr[-1] == ":" ):
-            addr = addr[:-1]
-            self.offset = ""
-            del tokens[0] # address
-        else:
-            self.offset = tokens[1].strip()[1:-2]
-            if( self.offset[0] == "+" ):
-                self.offset = self.offset[1:]
-            del tokens[0] # address
-            del tokens[0] # offset
-
-        self.address = vdb.util.xint(addr)
-
-        return tokens
+        self.offset = tok.offset
+        self.address = tok.address
+        return tok.tokens
 
     def color_mnemonic( self ):
         if( len(color_mnemonic.value) > 0 ):
@@ -938,11 +956,196 @@ class instruction_base( abc.ABC ):
         return ret
 
     @abc.abstractmethod
-    def parse( self, line, m, oldins ):
+    def parse( self, line, tok, oldins ):
         pass
 # Reset should we ever be able to change classes dynamically
 
 
+class basic_block:
+    __slots__ = ( "index", "instructions", "successors", "predecessors" )
+
+    def __init__( self, index ):
+        self.index = index
+        self.instructions = []
+        self.successors = []
+        self.predecessors = []
+
+    def __repr__( self ):
+        return f"basic_block({self.index}, {self.instructions[0].address:#0x}, {len(self.instructions)} instructions)"
+
+class jump_arrow:
+    __slots__ = ( "fr", "to", "coloridx", "started", "done", "merger", "column" )
+
+    def __init__( self, fr, to ):
+        self.fr = fr
+        self.to = to
+        self.coloridx = next_index()
+        self.started = False            # has been drawn in at least one row
+        self.done = False
+        self.merger = None
+        self.column = None
+
+    def __str__( self ):
+        return f"{self.fr:#0x} -> {self.to:#0x}, c={self.coloridx},s={self.started},d={self.done}"
+
+class arrow_columns:
+    """
+    Assigns the columns of the jump arrows. The arrows are swept in the order of the rows they start in, a column
+    becomes free again once the arrow in it is done, the free columns are kept in a heap so that finding the next one
+    does not scan all columns.
+
+    Most of a row is the same as in the row before: a | for every arrow passing through and a blank for every free
+    column. That row is kept in quiet and every row starts as a copy of it, then only the columns of the arrows that
+    start or end in this row are drawn, and when one of them does, the free columns right of it get the horizontal line.
+    """
+
+    def __init__( self, prefer_right ):
+        self.columns = []
+        self.quiet = []
+        self.gaps = []                  # sorted indices of the free columns
+        self.free = []
+        self.prefer_right = prefer_right
+        self.ends = {}
+        self.changed = []               # arrows that start or end in the current row
+
+    def add( self, ar ):
+        cl = self.columns
+        while( len(self.free) > 0 ):
+            i = heapq.heappop(self.free)
+            if( self.prefer_right ):
+                i = -i
+            # stale entries stay in the heap until popped
+            old = cl[i]
+            if( old is None ):
+                del self.gaps[bisect.bisect_left(self.gaps,i)]
+            elif( old.done ):
+                ar.merger = old
+            else:
+                continue
+            cl[i] = ar
+            break
+        else:
+            i = len(cl)
+            cl.append(ar)
+            self.quiet.append(None)
+        ar.column = i
+        self.changed.append(ar)
+        if( ar.fr != ar.to ):
+            self.ends.setdefault(ar.fr,[]).append(ar)
+            self.ends.setdefault(ar.to,[]).append(ar)
+        return i
+
+    def release( self, ar ):
+        ar.done = True
+        self.changed.append(ar)
+        if( self.prefer_right ):
+            heapq.heappush(self.free,-ar.column)
+        else:
+            heapq.heappush(self.free,ar.column)
+
+    def end( self, addr ):
+        for ar in self.ends.pop(addr,()):
+            if( self.columns[ar.column] is ar ):
+                self.release(ar)
+
+    def render( self, ins ):
+        cl = self.columns
+        quiet = self.quiet
+        ret = quiet.copy()
+        alen = len(cl)
+        if( len(self.changed) == 0 ):
+            return ( ret, alen )
+
+        # Arrows replaced by a merger in the same row are not drawn anymore, the ones that start and end here are there
+        # twice
+        changed = sorted( { ar.column : ar for ar in self.changed if cl[ar.column] is ar }.values(), key = lambda ar : ar.column )
+        self.changed = []
+        if( len(changed) == 0 ):
+            return ( ret, alen )
+        leftarrow = None
+        for ar in changed:
+            cidx = ar.column
+            if( not ar.started ):
+                # arrow starts here, so goes down
+                # but what if there already was another?
+                if( leftarrow is not None ):
+                    if( ar.merger ):
+                        ret[cidx] = ("+",leftarrow.coloridx)
+                    else:
+                        ret[cidx] = ("T",leftarrow.coloridx)
+                else:
+                    if( ar.merger ):
+                        if( ar.to == ar.fr ):
+                            ret[cidx] = ("^",ar.coloridx)
+                        else:
+                            ret[cidx] = ("#",ar.coloridx)
+                    elif( ins.address in ins.targets ):
+                        ret[cidx] = (" ",-1)
+                    else:
+                        ret[cidx] = ("v",ar.coloridx)
+                    leftarrow = ar
+                ar.started = True
+            else:
+                # done, otherwise it would not have changed
+                if( leftarrow is not None ):
+                    ret[cidx] = ("u",leftarrow.coloridx)
+                else:
+                    ret[cidx] = ("^",ar.coloridx)
+                    leftarrow = ar
+            if( ar.done ):
+                cl[cidx] = None
+                quiet[cidx] = (" ",-1)
+                bisect.insort(self.gaps,cidx)
+            else:
+                quiet[cidx] = ("|",ar.coloridx)
+
+        # No vertical line expected in the free columns, but right of the first arrow that starts or ends here there is
+        # a horizontal one
+        gaps = self.gaps
+        hline = ("-",leftarrow.coloridx)
+        for gi in range(bisect.bisect_right(gaps,leftarrow.column),len(gaps)):
+            gidx = gaps[gi]
+            if( cl[gidx] is None and ret[gidx][0] == " " ):
+                ret[gidx] = hline
+
+        if( ins.address in ins.targets ):
+            ret.append( ("Q",leftarrow.coloridx) )
+        elif( leftarrow.to == ins.address ):
+            ret.append( (">",leftarrow.coloridx) )
+        else:
+            ret.append( ("<",leftarrow.coloridx) )
+        alen += 1
+        return ( ret, alen )
+
+def layout_arrows( instructions, start, end, prefer_right = False ):
+    """
+    Fills in jumparrows and arrowwidth of all instructions, returns the number of columns used
+    """
+    columns = arrow_columns(prefer_right)
+    for ins in instructions:
+        # Remove those arrows that end here, whiche are always from above. Those that start here are not yet in the
+        # list
+        columns.end(ins.address)
+
+        # Now add the new ones
+        for tgt in ins.targets:
+            if( start <= tgt <= end ):
+                if( tgt == ins.address ):
+                    ar = jump_arrow(ins.address,tgt)
+                    columns.add(ar)
+                    columns.release(ar)
+                # Target is further down, add an arrow
+                elif( tgt > ins.address ):
+                    columns.add( jump_arrow(ins.address,tgt) )
+        if( len(ins.target_of) > 0 ):
+            # We are a target of something, lets have a look if those are further down
+            for target in ins.target_of :
+                if( target > ins.address ):
+                    # yep, further down, we need a new arrow
+                    columns.add( jump_arrow(target,ins.address) )
+        (ins.jumparrows,ins.arrowwidth) = columns.render(ins)
+    return len(columns.columns)
+
 class listing( ):
 
     def __init__( self ):
@@ -966,6 +1169,9 @@ class listing( ):
         self.initial_registers = register_set()
         self.marker = None
         self.frame = None
+        self.flow_key = None            # inputs of the last register_flow() run, to be able to skip or shorten the next
+        self.blocks = None
+        self.block_of = None
 
     def get_frame_register( self, reg ):
         ret = None
@@ -1053,6 +1259,67 @@ ascii mockup:
 │
 ╰───►   A3:
 """
+    # Splits the listing into basic blocks, built only when someone needs it and kept until invalidate_blocks() is called
+    # (e.g. when the register flow found new jump targets). Blocks end after conditional
+    # and unconditional jumps, returns and anything else jumping to a target within the listing. They start at any such
+    # target. Returns the list of blocks and a map from instruction address to the block containing it.
+    # As a side effect target_of is complete for all instructions afterwards and ins_map maps each (target) address to
+    # the set of addresses of instructions jumping there.
+    def basic_blocks( self ):
+        if( self.blocks is not None ):
+            return ( self.blocks, self.block_of )
+
+        leaders = set()
+        ins_map = {}
+        for ins in self.instructions:
+            ends_block = ( ins.conditional_jump or ins.unconditional_jump or ins.return_ )
+            for tga in ins.targets:
+                ins_map.setdefault(tga,set()).add(ins.address)
+                tgt = self.by_addr.get(tga,None)
+                if( tgt is not None ):
+                    tgt.target_of.add(ins.address)
+                    leaders.add(tga)
+                    ends_block = True
+            if( ends_block and ins.next is not None ):
+                leaders.add(ins.next.address)
+
+        blocks = []
+        block_of = {}
+        blk = None
+        previous = None
+        for ins in self.instructions:
+            if( blk is None or ins.address in leaders or previous.next is not ins ):
+                blk = basic_block(len(blocks))
+                blocks.append(blk)
+            blk.instructions.append(ins)
+            block_of[ins.address] = blk
+            previous = ins
+
+        for blk in blocks:
+            last = blk.instructions[-1]
+            for tga in last.targets:
+                tgt = block_of.get(tga,None)
+                if( tgt is not None and tgt not in blk.successors ):
+                    blk.successors.append(tgt)
+            if( last.next is not None and not last.return_ and not last.unconditional_jump ):
+                tgt = block_of.get(last.next.address,None)
+                if( tgt is not None and tgt not in blk.successors ):
+                    blk.successors.append(tgt)
+            for succ in blk.successors:
+                succ.predecessors.append(blk)
+
+        self.blocks = blocks
+        self.block_of = block_of
+        self.ins_map = ins_map
+        return ( blocks, block_of )
+
+    # The blocks, target_of, ins_map and the arrows all depend on the jump targets, when those change everything of it
+    # needs to be done again
+    def invalidate_blocks( self ):
+        self.blocks = None
+        self.block_of = None
+        self.finished = False
+
     def add_target( self,ins ):
 #        print("add_target")
 #        print("ins = '%s'" % ins )
@@ -1075,160 +1342,18 @@ ascii mockup:
             else:
                 return s
 
-        class arrow:
-            def __init__( self, fr, to ):
-                self.fr = fr
-                self.to = to
-                self.coloridx = next_index()
-                self.lines = 0
-                self.rows = 0
-                self.done = False
-                self.merger = None
-
-            def __str__( self ):
-                return f"{self.fr:#0x} -> {self.to:#0x}, c={self.coloridx},l={self.lines},r={self.rows},d={self.done}"
-
-        def find_next( cl, ar ):
-            clen = len(cl)
-            if( tree_prefer_right.value ):
-                r = range(clen-1,-1,-1)
-            else:
-                r = range(0,clen)
-
-            for i in r:
-                if( cl[i] is None ):
-                    cl[i] = ar
-                    return i
-                if( cl[i].done ):
-                    old = cl[i]
-                    ar.merger = old
-                    cl[i] = ar
-                    return i
-
-            cl += [ None ]
-            cl[clen] = ar
-            return clen
-
-        def to_arrows( ins, cl, ignore_target = False  ):
-#            print("###################")
-            ret = []
-            alen = 0
-#            print("ins.address = '%x'" % ins.address )
-
-#            print("current_lines = '%s'" % current_lines )
-            ridx = 0
-            doneleft = False
-            leftarrow = None
-            remove_indices = set()
-            for cidx in range(0,len(cl)):
-                ar = cl[cidx]
-#                print("ar = '%s'" % ar )
-                if( ar is None ):
-                    # No vertical line expected here, lets see if we need some horizontal
-                    if( leftarrow is not None ):
-                        ret.append( ("-",leftarrow.coloridx) )
-                    else:
-                        ret.append( (" ",-1) )
-                else: # c is not None here
-                    if( ar.done ):
-                        remove_indices.add(cidx)
-                    if( ar.rows == 0 ):
-                        # arrow starts here, so goes down
-                        # but what if there already was another?
-                        if( leftarrow is not None ):
-                            if( ar.merger ):
-                                ret.append( ("+",leftarrow.coloridx) )
-                            else:
-                                ret.append( ("T",leftarrow.coloridx) )
-                        else:
-                            if( ar.merger ):
-                                if( ar.to == ar.fr ):
-                                    ret.append( ("^",ar.coloridx) )
-                                else:
-                                    ret.append( ("#",ar.coloridx) )
-                            elif( ins.address in ins.targets ):
-                                ret.append( (" ",-1) )
-                            else:
-                                ret.append( ("v",ar.coloridx) )
-                            leftarrow = ar
-                    else:
-                        if( ar.done ):
-                            if( leftarrow is not None ):
-                                ret.append( ("u",leftarrow.coloridx) )
-                            else:
-                                ret.append( ("^",ar.coloridx) )
-                                leftarrow = ar
-                        else:
-                            # arrow already had a start
-                            if( ar.lines == 0 ):
-                                ret.append( ("|",ar.coloridx) )
-                            else:
-                                ret.append( ("|",ar.coloridx) )
-                        ar.lines += 1
-                    ar.rows += 1
-                alen += 1
-                # back to the current_line loop from here
-            if( leftarrow is not None ):
-                if( ins.address in ins.targets ):
-                    ret.append( ("Q",leftarrow.coloridx) )
-                elif( leftarrow.to == ins.address ):
-                    ret.append( (">",leftarrow.coloridx) )
-                else:
-                    ret.append( ("<",leftarrow.coloridx) )
-                alen += 1
-            for i in remove_indices:
-                cl[i] = None
-            return ( ret, alen )
-
+        # Makes sure target_of is complete
+        self.basic_blocks()
         self.do_backtrack()
 
         self.finished = True
-        current_lines = []
-        adict = {}
 
-        # Seperate loop for the later needs all informaation always
         for ins in self.instructions:
-            self.add_target(ins)
             if( ins.marked ):
                 self.marker = int(ins.address)
 #                print(f"{self.marker=:#0x}")
 
-        for ins in self.instructions:
-#            print("INS_----------------------------------")
-#            print("ins = '%s'" % ins )
-            self.add_target(ins)
-
-            # Remove those arrows that end here, whiche are always from above. Those that start here are not yet in the
-            # list
-            for cl in current_lines:
-                if( cl is not None ):
-                    # One of the arrow ends targets this instruction
-                    if( cl.to == ins.address or cl.fr == ins.address ):
-                        cl.done = True
-#                        print("DONE_01 cl = '%s'" % cl )
-
-
-            # Now add the new ones
-            for tgt in ins.targets:
-                if( self.start <= tgt <= self.end ):
-                    if( tgt == ins.address ):
-                        ar = arrow(ins.address,tgt)
-                        find_next( current_lines, ar )
-                        ar.done = True
-#                        print("ADD2 %s" % ar)
-                    # Target is further down, add an arrow
-                    elif( tgt > ins.address ):
-                        ar = arrow(ins.address,tgt)
-                        find_next( current_lines, ar )
-#                        print("ADD1 %s" % ar)
-            if( len(ins.target_of) > 0 ):
-                # We are a target of something, lets have a look if those are further down
-                for target in ins.target_of :
-                    if( target > ins.address ):
-                        # yep, further down, we need a new arrow
-                        ar = arrow(target,ins.address)
-                        find_next( current_lines, ar )
-            (ins.jumparrows,ins.arrowwidth) = to_arrows(ins,current_lines)
+        ncolumns = layout_arrows( self.instructions, self.start, self.end, tree_prefer_right.value )
 
         while( self.optimize_arrows() ):
             pass
@@ -1239,7 +1364,7 @@ ascii mockup:
                 nj += acolor(ja,jl)
             ins.jumparrows = nj
 
-        self.maxarrows = len(current_lines)+1
+        self.maxarrows = ncolumns+1
 
         if( debug_all() ):
             for ins in self.instructions:
@@ -1360,7 +1485,8 @@ ascii mockup:
 
     def do_backtrack( self ):
 #        vdb.util.bark() # print("BARK")
-        self.ins_map = {}
+        # fills ins_map
+        self.basic_blocks()
         idx = 0
         midx = None
         self.current_branch = 0
@@ -1395,10 +1521,6 @@ ascii mockup:
 #                    print("h = '%s'" % h )
             i.bt_idx = idx
             i.bt = None
-            for sr in i.target_of:
-                self.ins_map.setdefault(i.address,set()).add(sr)
-            for tgt in i.targets:
-                self.ins_map.setdefault(tgt,set()).add(i.address)
             if( i.marked ):
                 midx = idx
             idx += 1
@@ -1502,6 +1624,8 @@ ascii mockup:
             current_pc = int( current_pc )
 #        print(f"{current_pc=:#0x}")
 #        vdb.util.bark() # print("BARK")
+        if( source ):
+            resolve_lines( self.instructions )
         for idx,i in enumerate(self.instructions):
             if( idx > 0 ):
                 previous = self.instructions[idx-1]
@@ -1518,8 +1642,6 @@ ascii mockup:
                     otbl.append( header )
 
             if( source ):
-                if( i.file is None ):
-                    i.file,i.line = info_line( i.address )
                 fl = f"{i.file}:{i.line}"
                 fl = [ (fl,0,0) ]
                 if( fl != file_line ):
@@ -1632,7 +1754,7 @@ ascii mockup:
                 prejump += 1
                 if( ( xilist := xi_history.get(i.address,None) ) is not None ):
                     entry = ""
-                    for xi,_ in xilist:
+                    for xi in xilist.steps:
                         entry = f"{entry},{xi}"
                     entry = entry[1:]
                     line += [ entry ]
@@ -1947,39 +2069,24 @@ ascii mockup:
         g = vdb.dot.graph("disassemble")
         g.node_attributes["fontname"] = dot_fonts.value
 
-        node = None
-        previous_node = None
-        previous_instruction = None
-        for ins in self.instructions:
-            if( node is None or len(ins.target_of) > 0 ):
-                node = g.node(ins.address)
-                if( previous_node is not None ):
-                    if( previous_instruction is not None and ( not previous_instruction.return_ ) ):
-                        if( len(previous_instruction.targets) > 0  and not ( previous_instruction.conditional_jump or previous_instruction.call ) ):
-                            pass
-                        else:
-                            e=previous_node.edge( ins.address )
-                            if( previous_instruction and previous_instruction.conditional_jump ):
-                                e["color"] = color_jump_false_dot.value
-                            elif( previous_instruction and previous_instruction.call ):
-                                e["color"] = color_call_dot.value
-                    previous_node = None
-                    previous_instruction = None
-            if( node.table is None ):
-                node.table = vdb.dot.table()
-                node.table.attributes["border"] = "1"
-                node.table.attributes["cellspacing"] = "0"
-                node.table.attributes["cellborder"] = "0"
-            self.ins_to_dot(ins,node,showspec)
-            previous_node = node
-            previous_instruction = ins
-            if( len(ins.targets) > 0 and not ins.call ):
-                for tgt in ins.targets:
+        blocks,block_of = self.basic_blocks()
+        for blk in blocks:
+            node = g.node(blk.instructions[0].address)
+            node.table = vdb.dot.table()
+            node.table.attributes["border"] = "1"
+            node.table.attributes["cellspacing"] = "0"
+            node.table.attributes["cellborder"] = "0"
+            for ins in blk.instructions:
+                self.ins_to_dot(ins,node,showspec)
+
+            last = blk.instructions[-1]
+            if( len(last.targets) > 0 and not last.call ):
+                for tgt in last.targets:
                     port = None
-                    if( tgt < ins.address ):
+                    if( tgt < last.address ):
                         port = tgt
                     e=node.edge(tgt,port)
-                    if( ins.conditional_jump ):
+                    if( last.conditional_jump ):
                         e["color"] = color_jump_true_dot.value
                     else:
                         e["color"] = color_jump_dot.value
@@ -1987,15 +2094,22 @@ ascii mockup:
                     if( prefer_linear_dot.value ):
                         if( node.name > tgt ): # If jumping back it should not influence the layout
                             e["constraint"] = "false"
-                node = None
-            if( ins.return_ ):
-                node = None
+
+            # The fall through edge
+            if( last.next is not None and not last.return_ and not last.unconditional_jump ):
+                nblk = block_of.get(last.next.address,None)
+                if( nblk is not None ):
+                    e=node.edge( last.next.address )
+                    if( last.conditional_jump ):
+                        e["color"] = color_jump_false_dot.value
+                    elif( last.call ):
+                        e["color"] = color_call_dot.value
         return g
 
 
 
     def add( self, ins ):
-        self.finished = False
+        self.invalidate_blocks()
         self.instructions.append(ins)
         self.maxoffset = max(self.maxoffset,len(ins.offset))
         self.maxbytes = max(self.maxbytes,len(ins.bytes))
@@ -2191,7 +2305,223 @@ def fix_marker( ls, alt = None, frame = None, do_flow = True ):
     return ls
 
 
-parse_cache = {}
+def listing_size( ls ):
+    seen = set()
+    ret = 0
+    for ins in ls.instructions:
+        ret += memory_size(ins,seen)
+    return ret
+
+parse_cache = vdb.cache.lru_cache("asm_parse",sizeof = listing_size)
+
+def resize_parse_cache( _ ):
+    parse_cache.resize( cache_entries.value, cache_bytes.value )
+
+cache_entries = vdb.config.parameter("vdb-asm-cache-entries", 128, on_set = resize_parse_cache )
+cache_bytes = vdb.config.parameter("vdb-asm-cache-bytes", 0, on_set = resize_parse_cache )
+parse_cache.resize( cache_entries.value, cache_bytes.value )
+
+persistent_cache = vdb.config.parameter("vdb-asm-persistent-cache", True )
+persistent_cache_bytes = vdb.config.parameter("vdb-asm-persistent-cache-bytes", 32*1024*1024 )
+window_threshold = vdb.config.parameter("vdb-asm-window-threshold", 16384 )
+
+# Upper bound for all supported architectures, we rather disassemble a bit too much than too little
+max_instruction_size = 15
+
+def function_block( addr ):
+    block = gdb.block_for_pc(addr)
+    # The function block is the one directly below the static block, everything in between are lexical and inlined
+    # blocks
+    while( block is not None and block.superblock is not None and not block.superblock.is_static ):
+        block = block.superblock
+    if( block is None or block.function is None ):
+        return None
+    return block
+
+# Resolves the argument to the disassemble command to the function (or explicit range) it covers. Returns a tuple of the
+# address and the start and end of the range, or None when that is not possible, e.g. because there is no debug
+# information for the function.
+def function_range( arg ):
+    try:
+        rng = arg.split(",")
+        if( len(rng) == 2 ):
+            start = vdb.util.gint(rng[0])
+            end = vdb.util.gint(rng[1])
+            return ( start, start, end )
+        if( len(arg) == 0 ):
+            addr = vdb.util.gint(f"${last_working_pc}")
+        else:
+            addr = gdb.parse_and_eval(arg)
+            if( addr.type.code == gdb.TYPE_CODE_FUNC ):
+                addr = addr.address
+            addr = int(addr)
+        block = function_block(addr)
+        if( block is None ):
+            return None
+        return ( addr, block.start, block.end )
+    except (gdb.error,RuntimeError,AttributeError):
+#        vdb.print_exc()
+        return None
+
+# argument string => key, only for arguments that always resolve to the same function
+canonical_keys = {}
+
+@vdb.event.new_objfile()
+@vdb.event.free_objfile()
+@vdb.event.clear_objfiles()
+def clear_canonical_keys( _ = None ):
+    canonical_keys.clear()
+
+constant_arg_re = re.compile("^(0x[0-9a-fA-F]+|[0-9]+)$")
+
+# Function names and plain addresses resolve to the same key until the objfiles change or the program is started again,
+# anything involving registers or variables may not
+def constant_arg( arg ):
+    if( len(arg) == 0 or "$" in arg ):
+        return False
+    for a in arg.split(","):
+        a = a.strip()
+        if( constant_arg_re.match(a) ):
+            continue
+        try:
+            if( gdb.parse_and_eval(a).type.code != gdb.TYPE_CODE_FUNC ):
+                return False
+        except (gdb.error,RuntimeError,AttributeError):
+            return False
+    return True
+
+# Different spellings of the same function should end up in the same cache entry, so whenever possible we use the start
+# address of the function as the key. Resolving that asks gdb, so it is done only once per argument string.
+def canonical_key( arg, fallback ):
+    ret = canonical_keys.get(arg,None)
+    if( ret is not None ):
+        return ret
+    frng = function_range(arg)
+    if( frng is None ):
+        return fallback
+    addr,start,end = frng
+    if( len(arg.split(",")) == 2 ):
+        ret = ( start, end )
+    else:
+        ret = start
+    if( constant_arg(arg) ):
+        canonical_keys[arg] = ret
+    return ret
+
+# The on disk cache stores the raw disassembler output per function, keyed by the build-id of the objfile and the range
+# of the function. Parsing that text is cheap compared to asking gdb to disassemble it again, and the text (unlike the
+# parsed listing with all its gdb references) survives gdb restarts just fine. Explicit ranges are only stored when they
+# cover exactly one whole function, anything else (like the windows of parse_window) would add a new file for almost
+# every stop.
+def persistent_key( arg ):
+    frng = function_range(arg)
+    if( frng is None ):
+        return None
+    addr,start,end = frng
+    try:
+        if( len(arg.split(",")) == 2 ):
+            block = function_block(start)
+            if( block is None or block.start != start or block.end != end ):
+                return None
+        objfile = gdb.current_progspace().objfile_for_address(addr)
+        if( objfile is None or objfile.build_id is None ):
+            return None
+        flavor = gdb.parameter("disassembly-flavor")
+        return f"asm/{objfile.build_id}/{start:x}-{end:x}.{flavor}"
+    except (gdb.error,RuntimeError,AttributeError):
+#        vdb.print_exc()
+        return None
+
+def persistent_get( pkey ):
+    if( pkey is None ):
+        return None
+    try:
+        ret = vdb.cache.get_string(pkey)
+        vdb.cache.touch(pkey)
+        vdb.log(f"Loaded disassembly from persistent cache {pkey}",level=4)
+        return ret
+    except OSError:
+        return None
+
+# What the on disk cache takes up, only looked at the first time something is saved and then kept up to date
+persistent_bytes = None
+
+def persistent_save( pkey, dis ):
+    global persistent_bytes
+    if( pkey is None ):
+        return
+    # The marker depends on the current pc, we don't want that to end up in the cache
+    dis = "\n".join( [ ( "  " + line[2:] ) if line.startswith("=>") else line for line in dis.splitlines() ] )
+    try:
+        fn = vdb.cache.filename(pkey)
+        os.makedirs(os.path.dirname(fn),exist_ok = True)
+        if( persistent_bytes is None ):
+            persistent_bytes = vdb.cache.disk_usage("asm")
+        vdb.cache.save_string(pkey,dis)
+        persistent_bytes += len(dis)
+        limit = persistent_cache_bytes.value
+        if( limit and persistent_bytes > limit ):
+            persistent_bytes = vdb.cache.trim("asm",limit)
+    except OSError as e:
+        vdb.log(f"Failed to save disassembly to persistent cache: {e}",level=3)
+
+def persistent_flush( ):
+    global persistent_bytes
+    persistent_bytes = None
+    try:
+        shutil.rmtree(vdb.cache.filename("asm"))
+    except FileNotFoundError:
+        pass
+
+# For huge functions with only a small context requested we don't want to disassemble and parse the whole thing. The
+# start of the window has to be on an instruction boundary, for that we use the start of the source line, which is the
+# best we can do without disassembling from the start of the function.
+def window_range( context, pc, scale = 1 ):
+    before,after = context
+    if( before is None ):
+        before = 0
+    if( after is None ):
+        after = 0
+    if( before >= sys.maxsize or after >= sys.maxsize ):
+        return None
+    block = function_block(pc)
+    if( block is None ):
+        return None
+    if( block.end - block.start < window_threshold.value ):
+        return None
+
+    lo = pc - ( before + 1 ) * max_instruction_size * scale
+    if( lo <= block.start ):
+        start = block.start
+    else:
+        start = gdb.find_pc_line(lo).pc
+        if( start == 0 or start > pc ):
+            return None
+        start = max(start,block.start)
+    end = min(block.end, pc + ( after + 1 ) * max_instruction_size * scale )
+    return ( start, end, block.start )
+
+def parse_window( context ):
+    if( window_threshold.value <= 0 or context is None or context == (None,None) ):
+        return None
+    try:
+        pc = int(gdb.parse_and_eval("$pc"))
+        scale = 1
+        while( True ):
+            rng = window_range(context,pc,scale)
+            if( rng is None ):
+                return None
+            start,end,fstart = rng
+            ret = parse_from(f"{start:#0x},{end:#0x}")
+            before = sum( 1 for i in ret.instructions if i.address < pc )
+            # Not enough context before the marker, the source line was too short, try again with a bigger window
+            if( context[0] is None or before >= context[0] or start == fstart or scale >= 16 ):
+                vdb.log(f"Disassembled window {start:#0x}-{end:#0x} instead of whole function",level=4)
+                return ret
+            scale *= 2
+    except gdb.error:
+#        vdb.print_exc()
+        return None
 
 def split_args( in_args : str ) -> list[str]:
 #    vdb.util.bark() # print("BARK")
@@ -2656,6 +2986,54 @@ def update_vars( ls, frame ):
 
 ilinere = re.compile('Line ([0-9]*) of "(.*)"')
 
+class disassembly_line:
+    __slots__ = ( "marker", "address", "offset", "tokens" )
+
+    def __init__( self, marker, address, offset, tokens ):
+        self.marker = marker
+        self.address = address
+        self.offset = offset
+        self.tokens = tokens
+
+# Splits one line of disassemble/r output in a single pass into the parts common to all architectures, the rest of the
+# tokens (bytes, prefixes, mnemonic, arguments, references) are left to the architecture specific instruction parser.
+# Returns None for lines that do not contain an instruction.
+def tokenize( line ):
+    tokens = line.split()
+    if( len(tokens) == 0 ):
+        return None
+
+    marker = ( tokens[0] == "=>" )
+    if( marker ):
+        del tokens[0]
+        if( len(tokens) == 0 ):
+            return None
+
+    addr = tokens[0]
+    if( not addr.startswith("0x") ):
+        return None
+    # A : there tells us there is no <+###> offset following (common when the symbol is not known)
+    if( addr[-1] == ":" ):
+        addr = addr[:-1]
+        offset = ""
+        tokens = tokens[1:]
+    else:
+        if( len(tokens) < 2 ):
+            return None
+        offset = tokens[1][1:-2]
+        if( offset.startswith("+") ):
+            offset = offset[1:]
+        tokens = tokens[2:]
+
+    try:
+        addr = int(addr,16)
+    except ValueError:
+        return None
+    return disassembly_line( marker, addr, offset, tokens )
+
+dump_function_prefix = "Dump of assembler code for function "
+dump_ignored_prefixes = ( "End of assembler dump.", "Address range", "Dump of assembler code from " )
+
 @vdb.util.memoize()
 def info_line( addr ):
     il = gdb.execute(f"info line *{addr:#0x}",False,True)
@@ -2665,10 +3043,98 @@ def info_line( addr ):
 #    print("il = '%s'" % (il,) )
     return (None,None)
 
+class line_table:
+    """
+    The linetable of one symtab as address sorted arrays. Lines of 0 mark the end of a sequence, e.g. where the code
+    of another (inlined) file starts, these addresses are not ours.
+    """
+
+    def __init__( self, symtab ):
+        self.filename = symtab.filename
+        self.pcs = []
+        self.lines = []
+        lt = symtab.linetable()
+        if( lt is None ):
+            return
+        entries = sorted( lt, key = lambda e: e.pc )
+        for e in entries:
+            if( len(self.pcs) > 0 and self.pcs[-1] == e.pc ):
+                # Like gdb prefer the last of the is_stmt entries for the same address
+                if( getattr(e,"is_stmt",True) or self.lines[-1] == 0 ):
+                    self.lines[-1] = e.line
+                continue
+            self.pcs.append(e.pc)
+            self.lines.append(e.line)
+
+    def lookup( self, addr ):
+        idx = bisect.bisect_right(self.pcs,addr) - 1
+        if( idx < 0 ):
+            return ( None, None )
+        return ( self.pcs[idx], self.lines[idx] )
+
+# objfile filename => { ( CU address range, symtab filename ) => line_table }
+line_tables = {}
+
+@vdb.event.new_objfile()
+@vdb.event.clear_objfiles()
+def clear_line_tables( _ = None ):
+    line_tables.clear()
+
+def symtab_key( symtab ):
+    # A header has a symtab in every CU that includes it, each with only the lines of its CU. All symtabs of a CU share
+    # its static block, the address range of that tells the CUs apart
+    try:
+        blk = symtab.static_block()
+        cu = ( blk.start, blk.end )
+    except ( RuntimeError, AttributeError ):
+        cu = None
+    return ( cu, symtab.filename )
+
+def get_line_table( symtab ):
+    tables = line_tables.setdefault(symtab.objfile.filename,{})
+    key = symtab_key(symtab)
+    ret = tables.get(key,None)
+    if( ret is None ):
+        ret = line_table(symtab)
+        tables[key] = ret
+    return ret
+
+def resolve_lines( instructions ):
+    """
+    Sets file and line for all instructions that do not have them yet. Uses the linetables of the symtabs already
+    seen in this listing and only asks gdb for the symtab when none of them knows the address.
+    """
+    tables = []
+    for ins in instructions:
+        if( ins.file is not None ):
+            continue
+        best = None
+        for lt in tables:
+            pc,line = lt.lookup(ins.address)
+            if( line and ( best is None or pc > best[0] ) ):
+                best = ( pc, line, lt.filename )
+        if( best is None ):
+            try:
+                symtab = gdb.find_pc_line(ins.address).symtab
+            except RuntimeError:
+                symtab = None
+            if( symtab is None ):
+                # No debug information for the address at all
+                continue
+            lt = get_line_table(symtab)
+            if( lt not in tables ):
+                tables.append(lt)
+            pc,line = lt.lookup(ins.address)
+            if( not line ):
+                ins.file,ins.line = info_line( ins.address )
+                continue
+            best = ( pc, line, lt.filename )
+        ins.file = best[2]
+        ins.line = str(best[1])
+
 def parse_from_gdb( arg, fakedata = None, arch = None, fakeframe = None, cached = True, do_flow = True ):
 
     vdb.log(f"parse_from_gdb(arg={arg}, fakedata, {arch=}, {fakeframe=}, {cached=}, {do_flow=})",level=5)
-    global parse_cache
 #    print(f"{len(parse_cache)=}")
 
     key = arg
@@ -2693,6 +3159,9 @@ def parse_from_gdb( arg, fakedata = None, arch = None, fakeframe = None, cached
 #        print("key = '%s'" % key )
         key = re.sub(r" \+ [0-9]+","",key)
 
+    if( fakedata is None ):
+        key = canonical_key(arg,key)
+
 #    print("arg = '%s'" % arg )
 #    print("key = '%s'" % key )
 
@@ -2722,71 +3191,56 @@ def parse_from_gdb( arg, fakedata = None, arch = None, fakeframe = None, cached
     archname = configure_arch(arch)
 
     if( fakedata is None ):
-        dis = gdb.execute(f'disassemble/r {arg}',False,True)
+        dis = None
+        pkey = None
+        if( persistent_cache.value ):
+            pkey = persistent_key(arg)
+            if( cached and not debug_registers.value ):
+                dis = persistent_get(pkey)
+        if( dis is None ):
+            dis = gdb.execute(f'disassemble/r {arg}',False,True)
+            persistent_save(pkey,dis)
     else:
         dis = fakedata
-#    linere = re.compile("^(=>)*\s*(0x[0-9a-f]*)\s*<\+([0-9]*)>:\s*([^<]*)(<[^+]*(.*)>)*")
-    linere = re.compile(r"^(=>)*\s*(0x[0-9a-f]*)(\s*<\+([0-9]*)>:)*\s*([^<]*)(<[^+]*(.*)>)*")
-    funcre = re.compile("for function (.*):")
-    rangere = re.compile("Dump of assembler code from (0x[0-9a-f]*) to (0x[0-9a-f]*):")
-    current_function=""
-
     markers = 0
     oldins = None
 
-    # Figure out roughly how "long" the function is
+    # Tokenize everything first, that way we figure out roughly how "long" the function is
     # XXX Sometimes functions are split in parts, how do we handle that?
+    lines = []
     for line in dis.splitlines():
-        vline = line.split()
-        try:
-            vaddr = int(vline[0],16)
-            ret.start = min(ret.start,vaddr)
-            ret.end = max(ret.end,vaddr)
-        except ValueError:
-            pass
-
-    for line in dis.splitlines():
+        tok = tokenize(line)
+        if( tok is not None ):
+            ret.start = min(ret.start,tok.address)
+            ret.end = max(ret.end,tok.address)
+        lines.append( (line,tok) )
 
-        if( line in set(["End of assembler dump."]) ):
-            continue
-        if( line.startswith("Address range") ):
-            continue
-        if( len(line) == 0 ):
-            continue
-
-        fm=re.search(funcre,line)
-        if( fm ):
-            ret.function = fm.group(1)
-            try:
-                # try to demangle
-                fsym = gdb.lookup_symbol(ret.function)
-                ret.function = fsym[0].name
-            except:
-                pass
-            current_function = "<" + fm.group(1)
-            continue
+    for line,tok in lines:
 
-        rr = re.search(rangere,line)
-        if( rr ):
+        if( tok is None ):
+            if( len(line) == 0 or line.startswith(dump_ignored_prefixes) ):
+                continue
+            if( line.startswith(dump_function_prefix) ):
+                ret.function = line[len(dump_function_prefix):].rstrip(":")
+                try:
+                    # try to demangle
+                    fsym = gdb.lookup_symbol(ret.function)
+                    ret.function = fsym[0].name
+                except:
+                    pass
+                continue
+            print(f"Don't know what to do with '{line}'")
             continue
 
-        m=re.search(linere,line)
-
-        ins = None
-        if( m ):
-            ins = current_arch.instruction( line, m, oldins, (ret.start,ret.end) )
+        ins = current_arch.instruction( line, tok, oldins, (ret.start,ret.end) )
 
-        if ins is not None :
-            if( ins.marked ):
-                markers += 1
-            ret.add(ins)
-            ret.start = min(ret.start,ins.address)
-            ret.end = max(ret.end,ins.address)
+        if( ins.marked ):
+            markers += 1
+        ret.add(ins)
+        ret.start = min(ret.start,ins.address)
+        ret.end = max(ret.end,ins.address)
 
-            oldins = ins
-        else:
-            print(f"Don't know what to do with '{line}'")
-#			print("m = '%s'" % m )
+        oldins = ins
     if( fakedata is None ):
         parse_cache[key] = ret
 
@@ -2860,6 +3314,53 @@ def current_registers( frame ):
 
 
 
+incremental_flow = vdb.config.parameter("vdb-asm-incremental-flow", True )
+
+# Anything that can change the outcome of the register flow analysis without changing the listing itself bumps this
+flow_generation = 0
+
+@vdb.event.stop()
+@vdb.event.memory_changed()
+@vdb.event.register_changed()
+@vdb.event.inferior_call()
+def invalidate_flow( _ = None ):
+    global flow_generation
+    flow_generation += 1
+
+def reset_flow( i ):
+    i.passes = 0
+    i.possible_in_register_sets = []
+    i.possible_out_register_sets = []
+    i.possible_in_flag_sets = []
+    i.possible_out_flag_sets = []
+    i.extra = []
+    i.reset_argspecs()
+
+    # Will copy only ever on the very first call where we did not have a user defined reference
+    if( i.parsed_reference is None ):
+        i.parsed_reference = i.reference.copy()
+    i.reference = []
+
+# All instructions the flow analysis can get to when starting at ins
+def flow_reachable( lng, ins ):
+    _,block_of = lng.basic_blocks()
+    start = block_of[ins.address]
+    ret = start.instructions[start.instructions.index(ins):]
+    seen = set()
+    todo = list(start.successors)
+    while( len(todo) > 0 ):
+        blk = todo.pop()
+        if( blk.index in seen ):
+            continue
+        seen.add(blk.index)
+        if( blk is start ):
+            # Looped back, now the part before ins is reachable too
+            ret = blk.instructions[:blk.instructions.index(ins)] + ret
+        else:
+            ret += blk.instructions
+        todo += blk.successors
+    return ret
+
 def register_flow( lng, frame : "gdb frame" ):
     global flow_vtable
     if( len(flow_vtable) == 0 ):
@@ -2867,21 +3368,31 @@ def register_flow( lng, frame : "gdb frame" ):
     if( len( lng.instructions) == 0 ):
         return None
 
-    for i in lng.instructions:
-        i.passes = 0
-        i.possible_in_register_sets = []
-        i.possible_out_register_sets = []
-        i.possible_in_flag_sets = []
-        i.possible_out_flag_sets = []
-        i.extra = []
-        i.reset_argspecs()
-
-        # Will copy only ever on the very first call where we did not have a user defined reference
-        if( i.parsed_reference is None ):
-            i.parsed_reference = i.reference.copy()
-        i.reference = []
+    # Nothing changed since the last time (e.g. the same listing is shown multiple times per stop), all results are
+    # still stored in the instructions
+    flow_key = ( lng.marker, flow_generation, id(xi_history), debug_registers.value, debug.value )
+    if( lng.flow_key == flow_key ):
+        return None
+    previous_key = lng.flow_key
+    lng.flow_key = flow_key
 
     ins = lng.instructions[0]
+    todo = lng.instructions
+
+    # When only the position changed but nothing else did (e.g. showing another frame of the same function), everything
+    # not reachable from the marker keeps the results of the previous run. From the marker onwards the real register
+    # values are known, so the path leading there doesn't add anything for the rest. After a stop or a change to
+    # registers or memory the results before the marker (and the flow into loops around it) are stale too, then
+    # everything is analysed again.
+    if( incremental_flow.value and previous_key is not None and previous_key[1:] == flow_key[1:] ):
+        marked = lng.by_addr.get(lng.marker,None)
+        if( marked is not None and marked.marked ):
+            ins = marked
+            todo = flow_reachable(lng,marked)
+
+    for i in todo:
+        reset_flow(i)
+
 #    print("lng.var_addresses = '%s'" % (lng.var_addresses,) )
     # Try to follow execution path to figure out possible register values (and maybe later flags)
     possible_registers = lng.initial_registers.clone()
@@ -2893,358 +3404,361 @@ def register_flow( lng, frame : "gdb frame" ):
         if( vdb.memory.mmap.accessible(rbp) ):
             possible_registers.set( current_arch.base_pointer, rbp, origin="frame.bp" ,)
 
-#    for ins in ret.instructions:
-    flowstack = [ (None,None,None) ]
-
-    passlimit = 2
-    next = None
-
     # XXX make it perhaps possible to pre-populate it by an option so we can disable handling this way?
     unhandled_mnemonics = set()
 
     # XXX Just need to figure out how to figure out best
     thumb_mode = True
 
-    # at the end we advance to the next instruction or get one from a stack of conditional jump points (flowstack)
-    while ins is not None:
-#        print("ins = '%s'" % (ins,) )
-        # Simple protection against any kinds of endless loops
-        # XXX Better would be to check (additionally?) if the register and flag sets are the same as in previous runs
-        ins.passes += 1
-
-
-        # Assumes the last one is the target, might be different for different archs
-#        print(f"{ins.args=}")
-        # XXX x86 relies on this while arm parses them for the instruction already. Unify that.
-        # As per convention, rip on x86 as an argument is the next instruction
-        if( current_arch.name == "arm" ):
-            # arm is a bit tricky here, especially in thumb mode where there can be multiple instruction lengths
-            # Thumb:
-            # Cases (for ldr, [r0,label](2 or 4 bytes); nop(2), label: bx lr;)
-            #    * 2 byte aligned, 4 byte instruction, offset 4, total offset to ins.addr = 6, pc offset 2
-            #    * 4 byte aligned, 2 byte instruction, offset 0, total offset to ins.addr = 4, pc offset 4
-            # Cases (for ldr, [r0,label](2 or 4 bytes); label: bx lr;)
-            #    * 2 byte aligned, 2 byte instruction, offset 0, total offset to ins.addr = 2, pc offset 2
-            #    * 4 byte aligned, 4 byte instruction, offset 0, total offset to ins.addr = 4, pc offset 4
-            # ARM:
-            # Cases (for ldr, [r0,label](4 bytes); nop(4), label: bx lr;)
-            #    * 4 byte aligned, 4 byte instruction, offset 0, total offset to ins.addr = 8, pc offset 8
-            #    * 8 byte aligned, 4 byte instruction, offset 0, total offset to ins.addr = 8, pc offset 8
-            # Cases (for ldr, [r0,label](4 bytes); label: bx lr;)
-            #    * 4 byte aligned, 4 byte instruction, offset -4, total offset to ins.addr = 4, pc offset 8
-            #    * 8 byte aligned, 4 byte instruction, offset -4, total offset to ins.addr = 4, pc offset 8
-
-            # It seems that there is really some extra special handling for PC because PC is always ins.address+2 but
-            # all instructions using it will align it before using it, as such this alignment hack here helps them,
-            # otherwise we would need special handling at each and every place where an instruction does that.
-
-            if( thumb_mode ):
-                if( ins.address & 0x2 ): # Aligned to only 2 bytes
-                    possible_registers.set( "pc", ins.address + 2,origin="len(ins.bytes)" )
-                else: # 0 so aligned to 4 bytes (can't be 1 or 3 )
-                    possible_registers.set( "pc", ins.address + 4,origin="len(ins.bytes)" )
-            else:
-                possible_registers.set( "pc", ins.address + 8,origin="len(ins.bytes)" )
+    _,block_of = lng.basic_blocks()
+    # Flow handlers may find targets of computed jumps, the blocks and arrows need to know about them
+    ntargets = sum( len(i.targets) for i in lng.instructions )
+    # Each block is analysed once per distinct input state it gets, up to passlimit different ones. Blocks are only put
+    # on the worklist again when their input changes, an unchanged input would produce the very same results.
+    passlimit = 2
+    block_inputs = {}
+    worklist = []
+
+    def offer( blk, pos, regs, flags ):
+        seen = block_inputs.setdefault( (blk.index,pos), [] )
+        for sregs,sflags in seen:
+            if( sregs.same_values(regs) and sflags.same_values(flags) ):
+                return
+        if( len(seen) >= passlimit ):
+            return
+        seen.append( (regs,flags) )
+        worklist.append( (blk,pos,regs,flags) )
+
+    blk = block_of[ins.address]
+    offer( blk, blk.instructions.index(ins), possible_registers, possible_flags )
+
+    while( len(worklist) > 0 ):
+        blk,pos,possible_registers,possible_flags = worklist.pop()
+        possible_registers = possible_registers.clone()
+        possible_flags = possible_flags.clone()
+        for ins in blk.instructions[pos:]:
+            # We don't want to pass multiple times over the marked one as here we know exactly what the values are
+            if( ins.marked and ins.passes > 0 ):
+                break
+            possible_registers,possible_flags = flow_instruction( lng, ins, frame, possible_registers, possible_flags, unhandled_mnemonics, thumb_mode )
         else:
-            if( ins.next is not None ):
-                possible_registers.set( "pc", ins.next.address, origin="ins.next" )
-            elif( len(ins.bytes) > 0 ):
-                possible_registers.set( "pc", ins.address + len(ins.bytes),origin="len(ins.bytes)" )
-
-        if( ins.last_seen_registers is not None ):
-            ls = register_set()
-            ls.merge( ins.last_seen_registers, origin = "last_seen" )
-            ls.merge(possible_registers)
-            possible_registers = ls
-            #   →  0x0000000000401152 0  <+12>:           48 83 7d f8 04    cmpq  $0x4,-0x8(%rbp) %=0x4,x@-0x8(%rbp),x@@0x7fffffffccc8,x@=0x1
-            #                                                               cmpq $0x4,-0x8(%rbp) %=0x4,x@-0x8(%rbp)
+            # The fall through successor is the last one, so it is taken next, keeping the depth first order
+            for succ in blk.successors:
+                offer( succ, 0, possible_registers.clone(), possible_flags.clone() )
 
-        if( ins.marked ):
-            cf = current_arch.current_flags(frame)
-            if( cf is not None ):
-                possible_flags.merge(cf)
-            cr = current_registers(frame)
-            if( debug_registers.value ):
-                for r,(v,o) in cr.values.items():
-                    ov,an,origin = possible_registers.get(r)
-                    if( ov is not None and v != ov ):
-                        ins.add_extra( f"Real register {r} has real value {v:#0x} from {o} but we deduced {ov:#0x} for {an} from {origin}")
-            possible_registers.merge(cr)
-            ins.last_seen_registers = possible_registers.clone()
-
-        # XXX Refactor to have the register setting etc. just once
-        # Check if we have a special function handling more than the basics
-        fun = flow_vtable.get(ins.mnemonic,None)
-        if( fun is not None ):
-            ins.possible_in_register_sets.append( possible_registers.clone() )
-            ins.possible_in_flag_sets.append( possible_flags.clone() )
-            # clone of registers and flags from the last instruction output register set, returns a clone of the ins
-            # output sets
-            (possible_registers, possible_flags) = fun( ins, frame, possible_registers, possible_flags )
-            ins.possible_out_register_sets.append( possible_registers.clone() )
-            ins.possible_out_flag_sets.append( possible_flags.clone() )
-        # There is none, check if there is any that can be synthesized from the table
+    if( sum( len(i.targets) for i in lng.instructions ) != ntargets ):
+        lng.invalidate_blocks()
+
+    if( debug_all() ):
+        print("unhandled_mnemonics = '%s'" % (unhandled_mnemonics,) )
+
+def flow_instruction( lng, ins, frame, possible_registers, possible_flags, unhandled_mnemonics, thumb_mode ):
+#    print("ins = '%s'" % (ins,) )
+    ins.passes += 1
+
+
+    # Assumes the last one is the target, might be different for different archs
+#    print(f"{ins.args=}")
+    # XXX x86 relies on this while arm parses them for the instruction already. Unify that.
+    # As per convention, rip on x86 as an argument is the next instruction
+    if( current_arch.name == "arm" ):
+        # arm is a bit tricky here, especially in thumb mode where there can be multiple instruction lengths
+        # Thumb:
+        # Cases (for ldr, [r0,label](2 or 4 bytes); nop(2), label: bx lr;)
+        #    * 2 byte aligned, 4 byte instruction, offset 4, total offset to ins.addr = 6, pc offset 2
+        #    * 4 byte aligned, 2 byte instruction, offset 0, total offset to ins.addr = 4, pc offset 4
+        # Cases (for ldr, [r0,label](2 or 4 bytes); label: bx lr;)
+        #    * 2 byte aligned, 2 byte instruction, offset 0, total offset to ins.addr = 2, pc offset 2
+        #    * 4 byte aligned, 4 byte instruction, offset 0, total offset to ins.addr = 4, pc offset 4
+        # ARM:
+        # Cases (for ldr, [r0,label](4 bytes); nop(4), label: bx lr;)
+        #    * 4 byte aligned, 4 byte instruction, offset 0, total offset to ins.addr = 8, pc offset 8
+        #    * 8 byte aligned, 4 byte instruction, offset 0, total offset to ins.addr = 8, pc offset 8
+        # Cases (for ldr, [r0,label](4 bytes); label: bx lr;)
+        #    * 4 byte aligned, 4 byte instruction, offset -4, total offset to ins.addr = 4, pc offset 8
+        #    * 8 byte aligned, 4 byte instruction, offset -4, total offset to ins.addr = 4, pc offset 8
+
+        # It seems that there is really some extra special handling for PC because PC is always ins.address+2 but
+        # all instructions using it will align it before using it, as such this alignment hack here helps them,
+        # otherwise we would need special handling at each and every place where an instruction does that.
+
+        if( thumb_mode ):
+            if( ins.address & 0x2 ): # Aligned to only 2 bytes
+                possible_registers.set( "pc", ins.address + 2,origin="len(ins.bytes)" )
+            else: # 0 so aligned to 4 bytes (can't be 1 or 3 )
+                possible_registers.set( "pc", ins.address + 4,origin="len(ins.bytes)" )
         else:
-            if( ins.mnemonic not in unhandled_mnemonics ):
-                for mn,fun in flow_vtable.items():
-                    if( ins.mnemonic.startswith(mn) ):
-                        vdb.log(f"Synthesized mnemonic {ins.mnemonic} from {mn}, if their flow is not handled the same, create an additional one for {ins.mnemonic}",level=4)
-                        flow_vtable[ins.mnemonic] = fun
-                        ins.possible_in_register_sets.append( possible_registers.clone() )
-                        ins.possible_in_flag_sets.append( possible_flags.clone() )
-                        (possible_registers, possible_flags) = fun( ins, frame, possible_registers, possible_flags )
-                        ins.possible_out_register_sets.append( possible_registers.clone() )
-                        ins.possible_out_flag_sets.append( possible_flags.clone() )
-                        break
-                else:
-                    ins.unhandled = True
-                    # Store for later to be quicker
-                    unhandled_mnemonics.add( ins.mnemonic )
+            possible_registers.set( "pc", ins.address + 8,origin="len(ins.bytes)" )
+    else:
+        if( ins.next is not None ):
+            possible_registers.set( "pc", ins.next.address, origin="ins.next" )
+        elif( len(ins.bytes) > 0 ):
+            possible_registers.set( "pc", ins.address + len(ins.bytes),origin="len(ins.bytes)" )
+
+    if( ins.last_seen_registers is not None ):
+        ls = register_set()
+        ls.merge( ins.last_seen_registers, origin = "last_seen" )
+        ls.merge(possible_registers)
+        possible_registers = ls
+        #   →  0x0000000000401152 0  <+12>:           48 83 7d f8 04    cmpq  $0x4,-0x8(%rbp) %=0x4,x@-0x8(%rbp),x@@0x7fffffffccc8,x@=0x1
+        #                                                               cmpq $0x4,-0x8(%rbp) %=0x4,x@-0x8(%rbp)
+
+    if( ins.marked ):
+        cf = current_arch.current_flags(frame)
+        if( cf is not None ):
+            possible_flags.merge(cf)
+        cr = current_registers(frame)
+        if( debug_registers.value ):
+            for r,(v,o) in cr.values.items():
+                ov,an,origin = possible_registers.get(r)
+                if( ov is not None and v != ov ):
+                    ins.add_extra( f"Real register {r} has real value {v:#0x} from {o} but we deduced {ov:#0x} for {an} from {origin}")
+        possible_registers.merge(cr)
+        ins.last_seen_registers = possible_registers.clone()
+
+    # XXX Refactor to have the register setting etc. just once
+    # Check if we have a special function handling more than the basics
+    fun = flow_vtable.get(ins.mnemonic,None)
+    if( fun is not None ):
+        ins.possible_in_register_sets.append( possible_registers.clone() )
+        ins.possible_in_flag_sets.append( possible_flags.clone() )
+        # clone of registers and flags from the last instruction output register set, returns a clone of the ins
+        # output sets
+        (possible_registers, possible_flags) = fun( ins, frame, possible_registers, possible_flags )
+        ins.possible_out_register_sets.append( possible_registers.clone() )
+        ins.possible_out_flag_sets.append( possible_flags.clone() )
+    # There is none, check if there is any that can be synthesized from the table
+    else:
+        if( ins.mnemonic not in unhandled_mnemonics ):
+            for mn,fun in flow_vtable.items():
+                if( ins.mnemonic.startswith(mn) ):
+                    vdb.log(f"Synthesized mnemonic {ins.mnemonic} from {mn}, if their flow is not handled the same, create an additional one for {ins.mnemonic}",level=4)
+                    flow_vtable[ins.mnemonic] = fun
+                    ins.possible_in_register_sets.append( possible_registers.clone() )
+                    ins.possible_in_flag_sets.append( possible_flags.clone() )
+                    (possible_registers, possible_flags) = fun( ins, frame, possible_registers, possible_flags )
+                    ins.possible_out_register_sets.append( possible_registers.clone() )
+                    ins.possible_out_flag_sets.append( possible_flags.clone() )
+                    break
             else:
                 ins.unhandled = True
+                # Store for later to be quicker
+                unhandled_mnemonics.add( ins.mnemonic )
+        else:
+            ins.unhandled = True
+
+    if( ins.unhandled ):
+        ins.possible_out_register_sets.append( possible_registers.clone() )
+        ins.possible_out_flag_sets.append( possible_flags.clone() )
+
+    # Do that only on the first pass
+    # XXX This possibly overrides all the stuff above, maybe in that case we should skip it for speed?
+    if( ins.passes == 1 ):
+        xilist = xi_history.get(ins.address,None)
+        npregisters = []
+        npflags = []
+        if( xilist is not None ):
+            for _,xi in xilist:
+                if( debug_all(ins) ):
+                    ins.add_extra(f"XI: {str(xi)}")
+                rset = register_set()
+                rset.fill( xi.final_registers, origin = "xi" )
+                npregisters.append( rset )
+                # This is so the next instruction gets us as input
+                possible_registers = rset
+                nf = current_arch.current_flags( rset )
+                npflags.append(nf)
+        if( len(npregisters) ):
+            ins.possible_out_register_sets = npregisters
+
+#    if( len(ins.constants) > 0 ):
+#        for c in ins.constants:
+#            xc = vdb.util.xint(c)
+#                print("vdb.memory.mmap.accessible(xc) = '%s'" % (vdb.memory.mmap.accessible(xc),) )
+#            if( vdb.memory.mmap.accessible(xc) ):
+#                ch = vdb.pointer.chain( xc, vdb.arch.pointer_size, 1, True, 1, False, asm_tailspec.value )
+#                ins.reference.append(ch[0])
+    printed_addrs = set()
+
+
+
+    extra = None
+#    vdb.util.bark() # print("BARK")
+#    print("ins = '%s'" % (ins,) )
+#    print("ins.arguments = '%s'" % (ins.arguments,) )
+#    print("ins.args = '%s'" % (ins.args,) )
+    # Check if we can output a bit more info about the register values used in this
+    if( len(ins.arguments) > 0 ):
+        cnt = 0
+        target = None
+        if( len(ins.arguments) > 1 ):
+            target = ins.arguments[1]
+        ins_references = []
+        for aidx in range(0,len(ins.args)):
+            a = ins.args[aidx]
+            arg = ins.arguments[aidx]
+            extra = string_ref(f"ARG[{aidx}]({arg.argspec}) = {arg}")
+            if( debug_registers.value ):
+                ins.add_extra(extra)
+
+            # regardless of argspec we always output based on expression (since that works even if we don't have any
+            # register values)
+            av = lng.var_expressions.get(a,None)
+            extra.value += f", av = {av}"
+#            print("av = '%s'" % (av,) )
+#            print("a = '%s'" % (a,) )
+#            print("lng.var_expressions = '%s'" % (lng.var_expressions,) )
+            if( av is not None ):
+#                ins_references.append(  vdb.color.color(av,color_var.value) + "@" + vdb.color.color(a,color_location.value) )
+                ins_references.append( vdb.color.concat( [  vdb.color.colorl(av,color_var.value) ,"@", vdb.color.colorl(a,color_location.value) ] ) )
 
-        if( ins.unhandled ):
-            ins.possible_out_register_sets.append( possible_registers.clone() )
-            ins.possible_out_flag_sets.append( possible_flags.clone() )
-
-        # Do that only on the first pass
-        # XXX This possibly overrides all the stuff above, maybe in that case we should skip it for speed?
-        if( ins.passes == 1 ):
-            xilist = xi_history.get(ins.address,None)
-            npregisters = []
-            npflags = []
-            if( xilist is not None ):
-                for _,xi in xilist:
+            try:
+                # If its a target we want to use the value after the instruction executed
+                if( "i" in arg.argspec ):
+                    regset = ins.possible_in_register_sets
+                elif( "o" in arg.argspec ):
+                    regset = ins.possible_out_register_sets
+                else:
+                    # No register set specified, no value available
+                    continue
+                if( len(regset) == 0 ): # in case no registers available this causes constants to be shown
+                    regset = [ register_set() ]
+                argval = None
+                # Check via the possible register sets the value of the register
+                argaddr = None
+                # target is the target argument to the instruction, mainly here for the type (8/16/32/64 bit register)
+                # the override set is a special one that can be used by the register flow mechanism to override
+                # things used here to display some extra info
+                if( ins.override_register_set is not None ):
+                    argval,argaddr = arg.value(ins.override_register_set,target)
+                if( argval is None ):
+                    for prs in reversed(regset):
+                        argval,argaddr= arg.value(prs,target)
+                        if( argval is not None or argaddr is not None ):
+                            break
+                addr = argaddr
+                if( argval is not None ):
+                    extra.value += f", argval = {argval:#0x}, addr = {addr}"
+                else:
+                    extra.value += f", argval = {argval}, addr = {addr}"
+                extra.value += f", argspec = {arg.argspec}"
+
+#                vdb.util.bark() # print("BARK")
+#                print("ins = '%s'" % (ins,) )
+#                print("addr = '%s'" % (addr,) )
+#                print("printed_addrs = '%s'" % (printed_addrs,) )
+                # We have a an address, which means the value from the argument was located at some memory
+                if( addr is not None and addr not in printed_addrs ):
+                    printed_addrs.add(addr)
+
+                    # Check if the memory address is known to host some (local) variable
+                    av = lng.var_addresses.get(addr,None)
                     if( debug_all(ins) ):
-                        ins.add_extra(f"XI: {str(xi)}")
-                    rset = register_set()
-                    rset.fill( xi.final_registers, origin = "xi" )
-                    npregisters.append( rset )
-                    # This is so the next instruction gets us as input
-                    possible_registers = rset
-                    nf = current_arch.current_flags( rset )
-                    npflags.append(nf)
-            if( len(npregisters) ):
-                ins.possible_out_register_sets = npregisters
-
-        if( len(ins.targets) > 0 ):
-#            print("ins.targets = '%s'" % (ins.targets,) )
-#            print("ins.conditional_jump = '%s'" % (ins.conditional_jump,) )
-#            print("ins.call = '%s'" % (ins.call,) )
-#            ins.add_extra(f"targets {ins.targets}")
-            if( not ins.conditional_jump and not ins.call ):
-                next = None
-            for tga in ins.targets:
-                tgt = lng.by_addr.get(tga,None)
-                if( tgt is not None and tgt.passes < passlimit ):
-                    flowstack.append( (tgt,possible_registers.clone(), possible_flags.clone()) )
-
-#        if( len(ins.constants) > 0 ):
-#            for c in ins.constants:
-#                xc = vdb.util.xint(c)
-#                    print("vdb.memory.mmap.accessible(xc) = '%s'" % (vdb.memory.mmap.accessible(xc),) )
-#                if( vdb.memory.mmap.accessible(xc) ):
-#                    ch = vdb.pointer.chain( xc, vdb.arch.pointer_size, 1, True, 1, False, asm_tailspec.value )
-#                    ins.reference.append(ch[0])
-        printed_addrs = set()
-
-
-
-        extra = None
-#        vdb.util.bark() # print("BARK")
-#        print("ins = '%s'" % (ins,) )
-#        print("ins.arguments = '%s'" % (ins.arguments,) )
-#        print("ins.args = '%s'" % (ins.args,) )
-        # Check if we can output a bit more info about the register values used in this
-        if( len(ins.arguments) > 0 ):
-            cnt = 0
-            target = None
-            if( len(ins.arguments) > 1 ):
-                target = ins.arguments[1]
-            ins_references = []
-            for aidx in range(0,len(ins.args)):
-                a = ins.args[aidx]
-                arg = ins.arguments[aidx]
-                extra = string_ref(f"ARG[{aidx}]({arg.argspec}) = {arg}")
-                if( debug_registers.value ):
-                    ins.add_extra(extra)
-
-                # regardless of argspec we always output based on expression (since that works even if we don't have any
-                # register values)
-                av = lng.var_expressions.get(a,None)
-                extra.value += f", av = {av}"
-#                print("av = '%s'" % (av,) )
-#                print("a = '%s'" % (a,) )
-#                print("lng.var_expressions = '%s'" % (lng.var_expressions,) )
-                if( av is not None ):
-#                    ins_references.append(  vdb.color.color(av,color_var.value) + "@" + vdb.color.color(a,color_location.value) )
-                    ins_references.append( vdb.color.concat( [  vdb.color.colorl(av,color_var.value) ,"@", vdb.color.colorl(a,color_location.value) ] ) )
-
-                try:
-                    # If its a target we want to use the value after the instruction executed
-                    if( "i" in arg.argspec ):
-                        regset = ins.possible_in_register_sets
-                    elif( "o" in arg.argspec ):
-                        regset = ins.possible_out_register_sets
-                    else:
-                        # No register set specified, no value available
-                        continue
-                    if( len(regset) == 0 ): # in case no registers available this causes constants to be shown
-                        regset = [ register_set() ]
-                    argval = None
-                    # Check via the possible register sets the value of the register
-                    argaddr = None
-                    # target is the target argument to the instruction, mainly here for the type (8/16/32/64 bit register)
-                    # the override set is a special one that can be used by the register flow mechanism to override
-                    # things used here to display some extra info
-                    if( ins.override_register_set is not None ):
-                        argval,argaddr = arg.value(ins.override_register_set,target)
-                    if( argval is None ):
-                        for prs in reversed(regset):
-                            argval,argaddr= arg.value(prs,target)
-                            if( argval is not None or argaddr is not None ):
-                                break
-                    addr = argaddr
-                    if( argval is not None ):
-                        extra.value += f", argval = {argval:#0x}, addr = {addr}"
-                    else:
-                        extra.value += f", argval = {argval}, addr = {addr}"
-                    extra.value += f", argspec = {arg.argspec}"
-
-#                    vdb.util.bark() # print("BARK")
-#                    print("ins = '%s'" % (ins,) )
-#                    print("addr = '%s'" % (addr,) )
-#                    print("printed_addrs = '%s'" % (printed_addrs,) )
-                    # We have a an address, which means the value from the argument was located at some memory
-                    if( addr is not None and addr not in printed_addrs ):
-                        printed_addrs.add(addr)
-
-                        # Check if the memory address is known to host some (local) variable
-                        av = lng.var_addresses.get(addr,None)
-                        if( debug_all(ins) ):
-                            print("###################")
-                            print(f"{ins.address=:#0x}")
-                            print(f"{addr=:#0x}")
-                            print("type(addr) = '%s'" % (type(addr),) )
-                            print("av = '%s'" % (av,) )
-                        extra.value += f", ava = {av}"
-
-                        if( addr is not None ):
-                            if( "@" in arg.argspec ):
-                                _,ei = extra_info( av, "@", addr, extra )
-                                ins_references.append(ei)
-#                                ins_references.append(  vdb.color.color(av,color_var.value) + "@" + vdb.color.color(addr,color_location.value) )
-                            if( argval is not None ):
-                                if( "=" in arg.argspec and argval not in printed_addrs ):
-                                    printed_addrs.add(argval)
-                                    _,ei = extra_info( av, "=", argval, extra )
-                                    ins_references.append( ei )
-#                                    ins_references.append(  vdb.color.color(av,color_var.value) + "=" + vdb.color.color(val,color_location.value) )
-                    # No address means its the value of a register or result of an operation
-                    if( addr is None and argval is not None and argval not in printed_addrs ):
-                        extra.value += "!addr&argval"
-                        printed_addrs.add(argval)
-                        if( "%" in arg.argspec ):
-                            if( av is None ):
-                                if( ins.parsed_target_name is None ):
-                                    ins.parsed_target_name = ins.target_name
-                                av = ins.parsed_target_name
-                                if( av is not None ):
-                                    if( av[0] == "<" and av[-1] == ">" ):
-                                        av = av[1:-1]
-                                ins.target_name = None
-                                extra.value += f", av={av}"
-                            sym,ei = extra_info( av, "%=", argval, extra )
-                            ins_references.append( ei )
-                            if( sym is not None and len(sym) != 0 ):
-                                ins.target_name = None # The plaintext name has been replaced by the symbol expression
-                        continue
-                        _,_,symbol = vdb.memory.get_gdb_sym( argval )
-                        extra.value += f", sym = {symbol}"
-                        if( symbol is not None ):
-                            symbol = vdb.shorten.symbol(symbol)
-                            symbol = symbol.split("@")
-                            symbol = vdb.color.color(symbol[0],color_var.value) + "@" + "@".join(symbol[1:])
-                            fav = f"{argval:#0x}"
-                            ins_references.append(symbol + "@" + vdb.color.color( fav, color_location.value ) )
+                        print("###################")
+                        print(f"{ins.address=:#0x}")
+                        print(f"{addr=:#0x}")
+                        print("type(addr) = '%s'" % (type(addr),) )
+                        print("av = '%s'" % (av,) )
+                    extra.value += f", ava = {av}"
+
+                    if( addr is not None ):
+                        if( "@" in arg.argspec ):
+                            _,ei = extra_info( av, "@", addr, extra )
+                            ins_references.append(ei)
+#                            ins_references.append(  vdb.color.color(av,color_var.value) + "@" + vdb.color.color(addr,color_location.value) )
+                        if( argval is not None ):
+                            if( "=" in arg.argspec and argval not in printed_addrs ):
+                                printed_addrs.add(argval)
+                                _,ei = extra_info( av, "=", argval, extra )
+                                ins_references.append( ei )
+#                                ins_references.append(  vdb.color.color(av,color_var.value) + "=" + vdb.color.color(val,color_location.value) )
+                # No address means its the value of a register or result of an operation
+                if( addr is None and argval is not None and argval not in printed_addrs ):
+                    extra.value += "!addr&argval"
+                    printed_addrs.add(argval)
+                    if( "%" in arg.argspec ):
+                        if( av is None ):
+                            if( ins.parsed_target_name is None ):
+                                ins.parsed_target_name = ins.target_name
+                            av = ins.parsed_target_name
+                            if( av is not None ):
+                                if( av[0] == "<" and av[-1] == ">" ):
+                                    av = av[1:-1]
+                            ins.target_name = None
+                            extra.value += f", av={av}"
+                        sym,ei = extra_info( av, "%=", argval, extra )
+                        ins_references.append( ei )
+                        if( sym is not None and len(sym) != 0 ):
                             ins.target_name = None # The plaintext name has been replaced by the symbol expression
-                        else:
+                    continue
+                    _,_,symbol = vdb.memory.get_gdb_sym( argval )
+                    extra.value += f", sym = {symbol}"
+                    if( symbol is not None ):
+                        symbol = vdb.shorten.symbol(symbol)
+                        symbol = symbol.split("@")
+                        symbol = vdb.color.color(symbol[0],color_var.value) + "@" + "@".join(symbol[1:])
+                        fav = f"{argval:#0x}"
+                        ins_references.append(symbol + "@" + vdb.color.color( fav, color_location.value ) )
+                        ins.target_name = None # The plaintext name has been replaced by the symbol expression
+                    else:
+#                        vdb.util.bark() # print("BARK")
+#                        print("arg = '%s'" % (arg,) )
+#                        print(f"argval = {int(argval):#0x}")
+#                        print("vdb.memory.mmap.accessible(argval) = '%s'" % (vdb.memory.mmap.accessible(argval),) )
+                        if( vdb.memory.mmap.accessible(argval) ):
 #                            vdb.util.bark() # print("BARK")
-#                            print("arg = '%s'" % (arg,) )
-#                            print(f"argval = {int(argval):#0x}")
-#                            print("vdb.memory.mmap.accessible(argval) = '%s'" % (vdb.memory.mmap.accessible(argval),) )
-                            if( vdb.memory.mmap.accessible(argval) ):
-#                                vdb.util.bark() # print("BARK")
-                                ch = vdb.pointer.chain( argval, vdb.arch.pointer_size, 1, True, 1, False, asm_tailspec.value )
-#                                print("ch = '%s'" % (ch,) )
-                                ins_references.append(ch[0])
-                            else:
-                                if( not arg.immediate ):
-                                    fav = f"{argval:#0x}"
-                                    ins_references.append( "%=" + vdb.color.color(fav,color_location.value) )
-                except:
-                    extra.value += "EXCEPTION"
-                    vdb.print_exc()
-
-                    if( debug_all(ins) ):
-                        vdb.print_exc()
-                    pass
-#            for irx in range(0,len(ins_references)-1):
-#                ins_references[irx] = ins_references[irx] + ","
-            if( ins.passes > 1 ):
-                if( ins.reference == ins_references ):
-                    ins.reference = []
-                else:
-                    ins.reference.append(("ALT:",4))
-            ins.reference += ins_references
-
-        for opr in ins.parsed_reference:
-            try:
-                # some are in brackets
-                br=""
-                pr = opr[0].strip()
-                if( pr[0] == "(" ):
-                    br="("
-                    pr = pr[1:]
-                prv = pr.split()
-                xr = vdb.util.xint(prv[0])
-                if xr not in printed_addrs:
-#                    print("extra = '%s'" % (extra,) )
-                    sym,ei = extra_info(None, "~", xr, extra )
-                    if( sym is None or len(sym) == 0 ):
-#                        print("type(ei) = '%s'" % (type(ei),) )
-#                        print("len(ei) = '%s'" % (len(ei),) )
-                        ei = vdb.color.concat(ei,br)
-                        ei = vdb.color.concat(ei,"".join(prv[1:]))
-                    ins.reference.append(ei)
+                            ch = vdb.pointer.chain( argval, vdb.arch.pointer_size, 1, True, 1, False, asm_tailspec.value )
+#                            print("ch = '%s'" % (ch,) )
+                            ins_references.append(ch[0])
+                        else:
+                            if( not arg.immediate ):
+                                fav = f"{argval:#0x}"
+                                ins_references.append( "%=" + vdb.color.color(fav,color_location.value) )
             except:
-                ins.reference.append(opr)
+                extra.value += "EXCEPTION"
+                vdb.print_exc()
+
                 if( debug_all(ins) ):
                     vdb.print_exc()
+                pass
+#        for irx in range(0,len(ins_references)-1):
+#            ins_references[irx] = ins_references[irx] + ","
+        if( ins.passes > 1 ):
+            if( ins.reference == ins_references ):
+                ins.reference = []
+            else:
+                ins.reference.append(("ALT:",4))
+        ins.reference += ins_references
 
+    for opr in ins.parsed_reference:
+        try:
+            # some are in brackets
+            br=""
+            pr = opr[0].strip()
+            if( pr[0] == "(" ):
+                br="("
+                pr = pr[1:]
+            prv = pr.split()
+            xr = vdb.util.xint(prv[0])
+            if xr not in printed_addrs:
+#                print("extra = '%s'" % (extra,) )
+                sym,ei = extra_info(None, "~", xr, extra )
+                if( sym is None or len(sym) == 0 ):
+#                    print("type(ei) = '%s'" % (type(ei),) )
+#                    print("len(ei) = '%s'" % (len(ei),) )
+                    ei = vdb.color.concat(ei,br)
+                    ei = vdb.color.concat(ei,"".join(prv[1:]))
+                ins.reference.append(ei)
+        except:
+            ins.reference.append(opr)
+            if( debug_all(ins) ):
+                vdb.print_exc()
 
-        if( debug_registers.value ):
-            ins._gen_extra()
-
-        # Check if the next instruction would go over the pass limit
-        ins = ins.next
-        if( ins is not None and ins.passes >= passlimit ):
-            ins = None
-
-        # We don't want to pass multiple times over the marked one as here we know exactly what the values are
-        if( ins is not None and ins.marked and ins.passes > 0 ):
-            ins = None
 
-        while( ins is None ):
-            ins,possible_registers,possible_flags = flowstack.pop()
-            if( ins is None ): # marker for the flowstack being empty
-                break
-            if( ins.marked and ins.passes > 0 ):
-                ins = None
+    if( debug_registers.value ):
+        ins._gen_extra()
 
-    # while(ins) done
-    if( debug_all() ):
-        print("unhandled_mnemonics = '%s'" % (unhandled_mnemonics,) )
+    return ( possible_registers, possible_flags )
 
 def parse_from( arg, fakedata = None, context = None, arch = None ):
 #    print(f"parse_from({arg=},,{context=},{arch=})")
@@ -3289,12 +3803,28 @@ def parse_from( arg, fakedata = None, context = None, arch = None ):
 
 
 
+callgrind_synthetic = [
+        ( "L1m", [ "I1mr", "D1mr", "D1mw" ] ),
+        ( "L2m", [ "I2mr", "D2mr", "D2mw" ] ),
+        ( "LLm", [ "ILmr", "DLmr", "DLmw" ] ),
+        ( "Bm",  [ "Bim", "Bcm" ] ),
+        ]
+
+def callgrind_event_key( name ):
+    global callgrind_eventmap
+    ret = callgrind_eventmap.get(name,None)
+    if( ret is None ):
+#        print("callgrind_eventmap = '%s'" % (callgrind_eventmap,) )
+        ret = len(callgrind_eventmap) + 2
+        callgrind_eventmap[name] = ret
+    return ret
+
+# The costs of one address, put together from all loaded files when it is about to be displayed
 class callgrind_instruction:
 
-    def __init__( self, line, previous ):
-        self.values = None
-        self.address = None
-        self.parse( line.split(), previous )
+    def __init__( self, address ):
+        self.values = {}
+        self.address = address
         self.jumps = {}
 #        self._dump()
 
@@ -3312,14 +3842,14 @@ class callgrind_instruction:
         else:
             return 0
 
+    def add_values( self, events, values ):
+        for ev,val in zip(events,values):
+            if( val ):
+                evidx = callgrind_event_key(ev)
+                self.values[evidx] = self.values.get(evidx,0) + val
+
     def add_synth( self, name, elist ):
-        global callgrind_eventmap
-        nni = callgrind_eventmap.get(name,None)
-        if( nni is None ):
-#            print("callgrind_eventmap = '%s'" % (callgrind_eventmap,) )
-            nni = len(callgrind_eventmap) + 2
-            callgrind_eventmap[name] = nni
-#            print("callgrind_eventmap = '%s'" % (callgrind_eventmap,) )
+        nni = callgrind_event_key(name)
 
         val = 0
         for e in elist:
@@ -3337,16 +3867,10 @@ class callgrind_instruction:
         return val
 
     def synthesize( self ):
-        self.add_synth( "L1m", [ "I1mr", "D1mr", "D1mw" ] )
-        self.add_synth( "L2m", [ "I2mr", "D2mr", "D2mw" ] )
-        self.add_synth( "LLm", [ "ILmr", "DLmr", "DLmw" ] )
-        self.add_synth( "Bm",  [ "Bim", "Bcm" ] )
+        for name,elist in callgrind_synthetic:
+            self.add_synth( name, elist )
 
-        global callgrind_eventmap
-        cidx = callgrind_eventmap.get("CEst",None)
-        if( cidx is None ):
-            cidx = len(callgrind_eventmap) + 2
-            callgrind_eventmap["CEst"] = cidx
+        cidx = callgrind_event_key("CEst")
 
         cest = 0
         cest += self.value( "Ir" )
@@ -3378,146 +3902,348 @@ class callgrind_instruction:
             else:
                 return f"Jumped {self.jumped} of {self.executed} times to {self.target:#08x}"
 
-    def add_jump( self, j, ex, target, raw = None ):
-#        outof = outof.split("/")
-#        print("outof = '%s'" % (outof,) )
-#        print("target = '%s'" % (target,) )
-#        print("self.address = '%s'" % (self.address,) )
+    def add_jump( self, j, ex, target ):
         ji = self.jump_info()
-        if( target[0] == "+" ):
-            offset = int(target[1:])
-            ji.target = self.address + offset
-        elif( target[0] == "-" ):
-            offset = int(target[1:])
-            ji.target = self.address - offset
-        elif( target == "*" ):
-            ji.target = self.address
-        else:
-            ji.target = int(target,16)
-        ji.executed = int(ex)
-        if( j is not None ):
-            ji.jumped  = int(j)
-        ji.raw = raw
+        ji.target = target
+        ji.executed = ex
+        ji.jumped = j
         si = self.jumps.get(ji.target,None)
         if( si is not None ):
             si.merge(ji)
         else:
             self.jumps[ji.target] = ji
 
+# The costs of one loaded file. One array per event, all in the order of the sorted array of addresses
+class callgrind_file:
 
-    # This is the "previous" we ask for the next addr
-    def parse_address( self, addrstr ):
-        if( addrstr.startswith( "0x" ) ):
-            return int(addrstr,16)
-        elif( addrstr.startswith( "+" ) ):
-            return self.address + int(addrstr[1:])
-        elif( addrstr.startswith( "-" ) ):
-            return self.address - int(addrstr[1:])
-        else:
-            raise RuntimeError("Invalid address string " + addrstr)
+    def __init__( self, filename, events, addresses, columns, jumps, mapped = None ):
+        self.filename = filename
+        self.events = events
+        self.addresses = addresses
+        self.columns = columns
+        self.jumps = jumps
+        # keeps the mmap of the index alive as long as the memoryviews into it are
+        self.mapped = mapped
 
-    def parse( self, vec, previous ):
-        if( previous is not None ):
-            self.address = previous.parse_address( vec[0] )
-        else:
-            self.address = self.parse_address( vec[0] )
-        self.values = {}
-        for i in range(1,len(vec)):
-            val = vec[i]
-            if( val == "*" ):
-                val = previous.values[i]
-            elif( val.startswith("+") ):
-                add = int(val[1:])
-                val = previous.values[i] + add
+    def __len__( self ):
+        return len(self.addresses)
+
+    def lookup( self, addr ):
+        idx = bisect.bisect_left(self.addresses,addr)
+        if( idx < len(self.addresses) and self.addresses[idx] == addr ):
+            return idx
+        return None
+
+    def annotate( self, ci ):
+        idx = self.lookup(ci.address)
+        if( idx is None ):
+            return False
+        ci.add_values( self.events, [ col[idx] for col in self.columns ] )
+        for j,ex,target in self.jumps.get(ci.address,()):
+            ci.add_jump(j,ex,target)
+        return True
+
+    # The index is a json header followed by the raw 64 bit columns: the addresses, one per event and then the jumps as
+    # four columns of address, jumped (-1 for unconditional jumps), executed and target
+    def save( self, fn, stamp ):
+        jumps = [ array.array("q") for _ in range(4) ]
+        for addr,jl in self.jumps.items():
+            for j,ex,target in jl:
+                for col,val in zip(jumps,( addr, -1 if j is None else j, ex, target )):
+                    col.append(val)
+        header = json.dumps( {
+            "version" : callgrind_index_version,
+            "source" : stamp,
+            "events" : self.events,
+            "count" : len(self.addresses),
+            "jumps" : len(jumps[0]),
+            } ).encode("utf-8")
+        pad = b"\0" * ( -(len(callgrind_index_magic)+8+len(header)) % 8 )
+        os.makedirs(os.path.dirname(fn),exist_ok = True)
+        # Never write into an index that may still be mapped by a previous load of the same file
+        tmpfn = f"{fn}.{os.getpid()}"
+        with open(tmpfn,"wb") as f:
+            f.write(callgrind_index_magic)
+            f.write(len(header).to_bytes(8,"little"))
+            f.write(header)
+            f.write(pad)
+            f.write(self.addresses.tobytes())
+            for col in self.columns:
+                f.write(col.tobytes())
+            for col in jumps:
+                f.write(col.tobytes())
+        os.replace(tmpfn,fn)
+
+    @staticmethod
+    def load( filename, fn, stamp ):
+        with open(fn,"rb") as f:
+            mapped = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        mv = memoryview(mapped)
+        pos = len(callgrind_index_magic)
+        if( mv[:pos] != callgrind_index_magic ):
+            return None
+        hlen = int.from_bytes(mv[pos:pos+8],"little")
+        pos += 8
+        header = json.loads(bytes(mv[pos:pos+hlen]).decode("utf-8"))
+        if( header.get("version") != callgrind_index_version or header.get("source") != list(stamp) ):
+            return None
+        pos += hlen
+        pos += -pos % 8
+        def column( count, fmt = "Q" ):
+            nonlocal pos
+            if( pos + count*8 > len(mv) ):
+                raise ValueError(f"{fn} is truncated")
+            ret = mv[pos:pos+count*8].cast(fmt)
+            pos += count*8
+            return ret
+        count = header["count"]
+        addresses = column(count)
+        columns = [ column(count) for _ in header["events"] ]
+        jumps = {}
+        njumps = header["jumps"]
+        jaddr,jj,jex,jtarget = [ column(njumps,"q") for _ in range(4) ]
+        for i in range(njumps):
+            j = jj[i]
+            jumps.setdefault(jaddr[i],[]).append( ( None if j < 0 else j, jex[i], jtarget[i] ) )
+        return callgrind_file( filename, header["events"], addresses, columns, jumps, mapped )
+
+# Collects the costs while streaming through a file. Each address gets a row on first sight, the values are summed up
+# in one array per event and only sorted once at the end
+class callgrind_builder:
+
+    def __init__( self, filename ):
+        self.filename = filename
+        self.events = []
+        self.rows = {}
+        self.addresses = array.array("Q")
+        self.columns = []
+        self.jumps = {}
+
+    def set_events( self, events ):
+        ret = []
+        for ev in events:
+            if( ev in self.events ):
+                ret.append( self.columns[self.events.index(ev)] )
             else:
-                val = int(val)
-            self.values[i] = val
-        self.synthesize()
+                self.events.append(ev)
+                self.columns.append( array.array("Q",bytes(8*len(self.addresses))) )
+                ret.append( self.columns[-1] )
+        return ret
+
+    def row( self, addr ):
+        ret = self.rows.get(addr,None)
+        if( ret is None ):
+            ret = len(self.addresses)
+            self.rows[addr] = ret
+            self.addresses.append(addr)
+            for col in self.columns:
+                col.append(0)
+        return ret
 
-    def get_next( self, cline ):
-        vec = cline.split()
-        next_addr = self.parse_address( vec[0] )
-        return get_instruction( next_addr )
+    def add_jump( self, addr, j, ex, target ):
+        self.jumps.setdefault(addr,[]).append( (j,ex,target) )
 
-    def merge( self, other ):
-        if( other.address != self.address ):
-            raise RuntimeError(f"Can not merge different addresses {self.address} and {other.address}")
-        for _,oj in other.jumps.items():
-            si = self.jumps.get(oj.target,None)
-            if( si is not None ):
-                si.merge(oj)
+    def finish( self ):
+        order = sorted( range(len(self.addresses)), key = self.addresses.__getitem__ )
+        addresses = array.array("Q", ( self.addresses[i] for i in order ) )
+        columns = [ array.array("Q", ( col[i] for i in order ) ) for col in self.columns ]
+        return callgrind_file( self.filename, self.events, addresses, columns, self.jumps )
+
+def open_profile( fn ):
+    if( fn.endswith(".gz") ):
+        import gzip
+        return gzip.open(fn,"rt")
+    if( fn.endswith(".xz") ):
+        import lzma
+        return lzma.open(fn,"rt")
+    if( fn.endswith(".bz2") ):
+        import bz2
+        return bz2.open(fn,"rt")
+    return open(fn,"r")
+
+# Position strings are either absolute, relative to the previous one or the same as the previous one
+def parse_position( pstr, previous ):
+    if( pstr.startswith( "0x" ) ):
+        return int(pstr,16)
+    elif( pstr.startswith( "+" ) ):
+        return previous + int(pstr[1:])
+    elif( pstr.startswith( "-" ) ):
+        return previous - int(pstr[1:])
+    elif( pstr == "*" ):
+        return previous
+    else:
+        raise RuntimeError("Invalid address string " + pstr)
+
+def parse_callgrind( fn ):
+    bld = callgrind_builder(fn)
+    columns = []
+    npos = 2
+    address = 0
+    row = None
+    with open_profile( fn ) as cf:
+        for cfline in cf:
+            if( len(cfline) == 0 ):
+                continue
+            c = cfline[0]
+            if( c == "0" or c == "+" or c == "-" or c == "*" ):
+                vec = cfline.split()
+                if( len(vec) == 0 ):
+                    continue
+                address = parse_position(vec[0],address)
+                row = bld.row(address)
+                for col,val in zip(columns,vec[npos:]):
+                    col[row] += int(val)
+            elif( cfline.startswith("events:") ):
+                columns = bld.set_events( cfline.split()[1:] )
+            elif( cfline.startswith("positions:") ):
+                positions = cfline.split()[1:]
+                if( len(positions) == 0 or positions[0] != "instr" ):
+                    raise RuntimeError(f"{fn} has no instruction level information, run callgrind with --dump-instr=yes")
+                npos = len(positions)
+            elif( cfline.startswith( "jcnd=" ) and row is not None ):
+                vec = cfline[5:].split()
+                oo = vec[0].split("/")
+                bld.add_jump( address, int(oo[0]), int(oo[1]), parse_position(vec[1],address) )
+            elif( cfline.startswith( "jump=" ) and row is not None ):
+                vec = cfline[5:].split()
+                bld.add_jump( address, None, int(vec[0]), parse_position(vec[1],address) )
             else:
-                self.jumps[oj.target] = oj
+#                print("cfline = '%s'" % (cfline,) )
+                pass
+    return bld.finish()
 
-        for oi,ov in other.values.items():
-            ov += self.values.get(oi,0)
-            self.values[oi] = ov
+callgrind_index_magic = b"VDBCGIX\0"
+callgrind_index_version = 2
 
-        self.synthesize()
+def load_profile( fn, parser ):
+    """
+    Loads fn through its index in the vdb cache directory if that is still up to date, otherwise parses the file with
+    parser and tries to write a new index
+    """
+    fn = os.path.realpath(fn)
+    st = os.stat(fn)
+    stamp = ( fn, st.st_size, st.st_mtime_ns, parser.__name__ )
+    ifn = vdb.cache.filename( "callgrind/" + hashlib.sha256(fn.encode("utf-8")).hexdigest() )
+    if( callgrind_index.value ):
+        try:
+            ret = callgrind_file.load( fn, ifn, stamp )
+            if( ret is not None ):
+                vdb.log(f"Using index {ifn}",level=3)
+                return ret
+        except FileNotFoundError:
+            pass
+        except Exception:
+            vdb.log(f"Failed to read index {ifn}, parsing {fn} again",level=2)
+    ret = parser(fn)
+    if( callgrind_index.value ):
+        try:
+            ret.save(ifn,stamp)
+        except OSError as e:
+            vdb.log(f"Could not write index {ifn}: {e}",level=2)
+    return ret
 
-def get_instruction( addr ):
-    global callgrind_data
-    ci = callgrind_data.get(addr,None)
-    return ci
+# All loaded files, the values of an address are only collected when it is displayed
+class callgrind_database:
 
-def get_next( cline, ci ):
-    if( ci is not None ):
-        pci = ci.get_next(cline)
-        if( pci is None ):
-            return callgrind_instruction( cline, ci )
+    def __init__( self ):
+        self.files = {}
+
+    def __len__( self ):
+        return len(self.files)
 
-    ci = callgrind_instruction( cline, ci )
-    pci = get_instruction( ci.address )
-    if( pci is not None ):
-        pci.merge(ci)
-        return pci
-    return ci
+    def add( self, cf ):
+        self.files[cf.filename] = cf
+        for ev in cf.events:
+            callgrind_event_key(ev)
+        # Make sure the synthetic events are known before anything is displayed
+        callgrind_instruction(0).synthesize()
+
+    def clear( self ):
+        self.files = {}
+
+    def get( self, addr, default = None ):
+        ret = callgrind_instruction(addr)
+        found = False
+        for _,cf in self.files.items():
+            found = cf.annotate(ret) or found
+        if( not found ):
+            return default
+        ret.synthesize()
+        return ret
+
+callgrind_data = callgrind_database()
 
 def load_callgrind( argv ):
 #    print("argv = '%s'" % (argv,) )
-    global callgrind_data
-    global callgrind_eventmap
     if( argv[0] == "clear" ):
-        callgrind_data = {}
+        callgrind_data.clear()
         print("Cleared callgrind database")
         return None
-    current_instruction = None
-    with open( argv[0], "r" ) as cf:
-        for cfline in cf:
-            cfline = cfline.rstrip()
-            if( len(cfline) == 0 ):
-                continue
+    fn = os.path.abspath(argv[0])
+    cf = load_profile( fn, parse_callgrind )
+    callgrind_data.add(cf)
+    print(f"Read information for {len(cf)} instructions from {argv[0]}")
 
-            if( cfline.startswith("0x") ):
-                current_instruction = get_next( cfline, current_instruction )
-                callgrind_data[current_instruction.address] = current_instruction
-            elif( cfline[0] == "+" or cfline[0] == "-" ):
-                current_instruction = get_next( cfline, current_instruction )
-                callgrind_data[current_instruction.address] = current_instruction
-            elif( cfline.startswith("events:") ):
-                cfv = cfline.split()
-                for i in range( 1,len(cfv) ):
-                    callgrind_eventmap[cfv[i]] = i+1
-#                    print("cfv[i] = '%s'" % (cfv[i],) )
-            elif( cfline.startswith( "jcnd=" ) ):
-                cfline = cfline[5:]
-                vec = cfline.split()
-                oo = vec[0]
-                oo = oo.split("/")
-                current_instruction.add_jump( oo[0], oo[1], vec[1], cfline )
-            elif( cfline.startswith( "jump=" ) ):
-                cfline = cfline[5:]
-                vec = cfline.split()
-                current_instruction.add_jump( None, vec[0], vec[1] )
-            else:
-#                print("cfline = '%s'" % (cfline,) )
-                pass
 
+perf_event_re = re.compile(r"^(.*?)(:[ukhIGHpPSDWe]+)?$")
+perf_split_re = re.compile(r":\s+")
+
+def perf_event_name( ev ):
+    # Strip the modifiers like :u or :ppp off, they would only make the names differ between recordings
+    return perf_event_re.match(ev).group(1)
 
-#        while( cfline := cf.readline().rstrip() ):
-#            print("cfline = '%s'" % (cfline,) )
+def parse_perf( fn ):
+    """
+    Reads the text output of perf script. The sample lines look like
 
-    print(f"Read information for {len(callgrind_data)} instructions from {argv[0]}")
+        comm pid [cpu] time: period event: ip sym+off (dso)
+
+    or with callchains the ip is the first of the following lines. Only the sample ip counts, the addresses are
+    collected per event first and then counted in one go
+    """
+    samples = {}
+    pending = None
+    with open_profile( fn ) as pf:
+        for pfline in pf:
+            if( pending is not None ):
+                vec = pfline.split(None,1)
+                if( len(vec) == 0 ):
+                    continue
+                try:
+                    pending.append( int(vec[0],16) )
+                except ValueError:
+                    pass
+                pending = None
+                continue
+            parts = perf_split_re.split(pfline.lstrip(),2)
+            if( len(parts) < 2 ):
+                continue
+            ev = parts[1].rsplit(None,1)
+            if( len(ev) == 0 ):
+                continue
+            ips = samples.setdefault(perf_event_name(ev[-1]),[])
+            if( len(parts) < 3 or len(parts[2]) == 0 ):
+                pending = ips
+                continue
+            try:
+                ips.append( int(parts[2].split(None,1)[0],16) )
+            except ValueError:
+                pass
+
+    bld = callgrind_builder(fn)
+    columns = bld.set_events( list(samples.keys()) )
+    for col,ips in zip(columns,samples.values()):
+        for addr,cnt in collections.Counter(ips).items():
+            col[bld.row(addr)] += cnt
+    return bld.finish()
+
+def load_perf( argv ):
+    if( len(argv) == 0 or argv[0] == "clear" ):
+        return load_callgrind( [ "clear" ] )
+    fn = os.path.abspath(argv[0])
+    cf = load_profile( fn, parse_perf )
+    callgrind_data.add(cf)
+    print(f"Read samples of {len(cf)} instructions for events {','.join(cf.events)} from {argv[0]}")
 
 function_vars = {}
 function_registers = {}
@@ -3567,11 +4293,15 @@ def disassemble( argv, flags, context ):
     if( "c" in flags ):
         return load_callgrind( argv )
 
+    if( "P" in flags ):
+        return load_perf( argv )
+
     if( "r" in flags ):
         return gdb.execute("disassemble/r " + " ".join(argv))
 
     if( "F" in flags ):
         print("Flushed disassembler parse cache")
+        persistent_flush()
         return invalidate_cache(None)
 
     if( "v" in flags ):
@@ -3596,7 +4326,11 @@ def disassemble( argv, flags, context ):
 #    print("context = '%s'" % (context,) )
 #    print("argv = '%s'" % (argv,) )
 
-    asm_listing = parse_from(" ".join(argv),fakedata,context,arch)
+    asm_listing = None
+    if( len(argv) == 0 and not dotty ):
+        asm_listing = parse_window(context)
+    if( asm_listing is None ):
+        asm_listing = parse_from(" ".join(argv),fakedata,context,arch)
     if( asm_sort.value ):
         asm_listing.sort()
     marked = None
@@ -3616,8 +4350,7 @@ def disassemble( argv, flags, context ):
         if( dotty ):
             g = asm_listing.to_dot(asm_showspec_dot.value)
             oid = id(asm_listing)
-            g.write(f"dis.{oid}.dot")
-            os.system(f"nohup dot -Txlib dis.{oid}.dot &")
+            vdb.dot.render( g, f"dis.{oid}.dot", dot_command.value )
     except:
         vdb.print_exc()
         pass
@@ -3651,6 +4384,64 @@ def get_single_tuple( bpos, showspec_filter = "abomjhHcdtT", extra_filter = "",
         pass
     return (rets,reti)
 
+# Approximation of the memory an object keeps alive. Does not follow the links between instructions, otherwise the first
+# instruction would account for the whole listing.
+def memory_size( obj, seen ):
+    if( id(obj) in seen ):
+        return 0
+    seen.add(id(obj))
+    ret = sys.getsizeof(obj)
+    if( isinstance(obj,(str,bytes,int,float,bool)) or obj is None ):
+        return ret
+    if( isinstance(obj,(list,tuple,set,frozenset)) ):
+        for o in obj:
+            ret += memory_size(o,seen)
+    elif( isinstance(obj,dict) ):
+        for k,v in obj.items():
+            ret += memory_size(k,seen)
+            ret += memory_size(v,seen)
+    elif( type(obj).__module__ == "gdb" ):
+        pass
+    else:
+        slots = []
+        for cls in type(obj).__mro__:
+            slots += getattr(cls,"__slots__",())
+        for sl in slots:
+            if( sl in ( "next", "previous" ) ):
+                continue
+            try:
+                ret += memory_size(object.__getattribute__(obj,sl),seen)
+            except AttributeError:
+                pass
+        d = getattr(obj,"__dict__",None)
+        if( d is not None ):
+            ret += memory_size(d,seen)
+    return ret
+
+def asm_stats( argv ):
+    tbl = []
+    tbl.append( [ "Listing", "Instructions", "Bytes", "Bytes/Instruction" ] )
+    seen = set()
+    total_ins = 0
+    total_bytes = 0
+    for key,ls in parse_cache.items():
+        sz = 0
+        for ins in ls.instructions:
+            sz += memory_size(ins,seen)
+        nins = len(ls.instructions)
+        total_ins += nins
+        total_bytes += sz
+        if( isinstance(key,int) ):
+            key = f"{key:#0x}"
+        elif( isinstance(key,tuple) ):
+            key = f"{key[0]:#0x}-{key[1]:#0x}"
+        tbl.append( [ key.strip(), str(nins), str(sz), f"{sz/max(nins,1):.1f}" ] )
+    tbl.append( [ "Total", str(total_ins), str(total_bytes), f"{total_bytes/max(total_ins,1):.1f}" ] )
+    vdb.util.print_table(tbl)
+    print(f"parse cache: {parse_cache}")
+
+vdb.subcommands.add_subcommand( [ "asm", "stats" ], asm_stats )
+
 class Dis (vdb.command.command):
     """Disassemble with bells and whistels
 
@@ -3665,8 +4456,9 @@ dis/<N>     - Have N instructions of context before and after the current marker
 dis/+<N>    - Have N Instructions of context after the marker
 dis/-<N>    - Have N Instructions of context before the marker
 dis/<N>,<M> - Have N Instructions of context before and M after the Marker
-dis/F       - Flushes some internal caches
+dis/F       - Flushes some internal caches (including the persistent on disk cache)
 dis/c <CG>  - Loads callgrind information from file <CG>
+dis/P <PS>  - Loads the samples from the text output of perf script in file <PS>
 dis/v       - dis/v argv r1 99 tells the disassembler to assume that the variable argv is stored in register r1 with value 99
 dis/s       - Tries to output the source code location where possible
 
@@ -98,6 +98,8 @@ base_pointer = "sp"
 
 class asm_arg(vdb.asm.asm_arg_base):
 
+    __slots__ = ()
+
     shift_map = {
             "lsl #1" : 1,
             "lsl #2" : 2,
@@ -201,19 +203,21 @@ class asm_arg(vdb.asm.asm_arg_base):
 
 class instruction( vdb.asm.instruction_base ):
 
+    __slots__ = ()
+
     class_res = vdb.asm.instruction_base.compile_class_res( _arm_class_res )
     class_cache = {}
     last_cmp_immediate = 1
 
-    def __init__( self, line, m, oldins, function_range ):
+    def __init__( self, line, tok, oldins, function_range ):
         super().__init__()
-        self.parse(line,m,oldins, function_range)
+        self.parse(line,tok,oldins, function_range)
 
     @vdb.overrides
-    def parse( self, line, m, oldins, function_range ):
+    def parse( self, line, tok, oldins, function_range ):
 #        vdb.util.bark() # print("BARK")
 
-        tokens = self.parse_common( line, m, oldins )
+        tokens = self.parse_common( line, tok, oldins )
 
         ibytes = []
         while( self.bytere2.match(tokens[0]) ):
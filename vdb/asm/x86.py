@@ -76,6 +76,8 @@ argument_registers = [ "rdi", "rsi", "rdx", "rcx", "r8", "r9" ]
 
 class asm_arg(vdb.asm.asm_arg_base):
 
+    __slots__ = ()
+
     @vdb.overrides
     def parse( self, arg ):
 #        vdb.util.bark() # print("BARK")
@@ -167,23 +169,25 @@ class asm_arg(vdb.asm.asm_arg_base):
 
 class instruction( vdb.asm.instruction_base ):
 
+    __slots__ = ()
+
     class_res = vdb.asm.instruction_base.compile_class_res( _x86_class_res )
     class_cache = {}
 
 
     # line: the assembler text line
-    # m: the match of the linere regular expression
-    def __init__( self, line, m, oldins, function_range ):
+    # tok: the disassembly_line created by vdb.asm.tokenize()
+    def __init__( self, line, tok, oldins, function_range ):
         super().__init__()
-        self.parse(line,m,oldins)
+        self.parse(line,tok,oldins)
 
     jmpre = re.compile(r"^\*(0x[0-9a-fA-F]*)\(.*")
     last_cmp_immediate = 1
 
     @vdb.overrides
-    def parse( self, line, m, oldins ) -> "instruction":
-#        print(f"parse( {line=}, {m=}, {oldins=} )")
-        tokens = self.parse_common( line, m, oldins )
+    def parse( self, line, tok, oldins ) -> "instruction":
+#        print(f"parse( {line=}, {tok=}, {oldins=} )")
+        tokens = self.parse_common( line, tok, oldins )
 
 #        print("tokens = '%s'" % tokens )
         # the dissamble version without <line+>
@@ -6,6 +6,8 @@ import vdb.util
 
 import gdb
 import sys
+import os
+import collections
 
 from typing import Dict
 
@@ -29,6 +31,45 @@ def save_string( cachename, data ):
     with open(filename(cachename),"w") as f:
         f.write(data)
 
+# ( mtime, size, path ) of all files below the cache directory cachename
+def disk_files( cachename ):
+    ret = []
+    for root,_,files in os.walk(filename(cachename)):
+        for fn in files:
+            path = os.path.join(root,fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            ret.append( ( st.st_mtime, st.st_size, path ) )
+    return ret
+
+# Total size of all files below the cache directory cachename
+def disk_usage( cachename ):
+    return sum( sz for _,sz,_ in disk_files(cachename) )
+
+# Marks a file as recently used so that trim() removes it last
+def touch( cachename ):
+    try:
+        os.utime(filename(cachename))
+    except OSError:
+        pass
+
+# Removes the files below the cache directory cachename that were used least recently (by their modification time)
+# until all of them together take at most max_bytes. Returns the size of what is left.
+def trim( cachename, max_bytes ):
+    files = disk_files(cachename)
+    total = sum( sz for _,sz,_ in files )
+    for _,sz,path in sorted(files):
+        if( total <= max_bytes ):
+            break
+        try:
+            os.remove(path)
+            total -= sz
+        except OSError:
+            pass
+    return total
+
 def add_time( t: float, n: float ):
     ct = cumulative_time.get(n,0.0)
     ct += t
@@ -45,6 +86,88 @@ class cache_entry:
         r = f"{self.hits}h,{self.misses}m=>{ratio:.2f}@{len(self.cache)}"
         return r
 
+lru_caches = {}
+
+# A cache_entry that is bounded by number of entries and/or (estimated) bytes, evicting the least recently used entries
+# first. A limit of 0 means unlimited. The sizeof function is only called when there is a byte limit, when one is set
+# later on the entries that were inserted without it are sized then.
+class lru_cache( cache_entry ):
+    def __init__( self, name, max_entries = 0, max_bytes = 0, sizeof = None ):
+        super().__init__()
+        self.cache = collections.OrderedDict()
+        self.sizes = { }
+        self.bytes = 0
+        self.evictions = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        lru_caches[name] = self
+
+    def __str__( self ):
+        r = super().__str__()
+        r += f",{self.evictions}e"
+        if( self.max_bytes ):
+            r += f",{self.bytes}/{self.max_bytes}b"
+        return r
+
+    def __len__( self ):
+        return len(self.cache)
+
+    def get( self, key, default = None ):
+        if( key in self.cache ):
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        return default
+
+    def __setitem__( self, key, value ):
+        self.pop(key)
+        self.cache[key] = value
+        if( self.max_bytes and self.sizeof is not None ):
+            sz = self.sizeof(value)
+            self.sizes[key] = sz
+            self.bytes += sz
+        self.evict()
+
+    def pop( self, key ):
+        if( key in self.cache ):
+            del self.cache[key]
+            self.bytes -= self.sizes.pop(key,0)
+
+    def items( self ):
+        return self.cache.items()
+
+    def clear( self ):
+        self.cache.clear()
+        self.sizes.clear()
+        self.bytes = 0
+
+    def resize( self, max_entries, max_bytes ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if( self.max_bytes and self.sizeof is not None ):
+            for key,value in self.cache.items():
+                if( key not in self.sizes ):
+                    sz = self.sizeof(value)
+                    self.sizes[key] = sz
+                    self.bytes += sz
+        self.evict()
+
+    def over_limit( self ):
+        if( self.max_entries and len(self.cache) > self.max_entries ):
+            return True
+        if( self.max_bytes and self.bytes > self.max_bytes ):
+            return True
+        return False
+
+    # Always keeps the most recent entry, even if it alone is over the limit
+    def evict( self ):
+        while( len(self.cache) > 1 and self.over_limit() ):
+            key,_ = self.cache.popitem(last = False)
+            self.bytes -= self.sizes.pop(key,0)
+            self.evictions += 1
+
 class cache_result:
     def __init__(self):
         self.result = None
@@ -111,6 +234,8 @@ class re:
 def dump( ):
     print(f"type_cache : {type_cache}")
     print(f"re_cache   : {re_cache}")
+    for n,c in lru_caches.items():
+        print(f"{n:<11}: {c}")
 
     for k,v in cumulative_time.items():
         print(f"{k:<20} : {v}")
@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import vdb.util
+
+import gdb
+
 import io
+import os
+import subprocess
 
 def dot_escape( txt ):
     txt = txt.replace("&","&amp;")
@@ -190,17 +196,22 @@ class graph:
         if( not filename.endswith( ".dot" )):
             filename += ".dot"
 #        print("filename = '%s'" % filename )
-        with open(filename,"w+") as f:
-            f.write(f"digraph {self.name} {{\n")
-            f.write("node [ ")
-            for nn,nv in self.node_attributes.items():
-                f.write(f'{nn}="{nv}"')
-            f.write(" ];\n")
-            for n in self.nodes:
-                n.write(f)
-            for n in self.nodes:
-                n.write_edges(f)
-            f.write("}\n")
+        with open(filename,"w+",buffering=write_buffer) as f:
+            self.write_to(f)
+        return filename
+
+    # Everything is written piece by piece into f, the text of the whole graph never exists as one string
+    def write_to( self, f ):
+        f.write(f"digraph {self.name} {{\n")
+        f.write("node [ ")
+        for nn,nv in self.node_attributes.items():
+            f.write(f'{nn}="{nv}"')
+        f.write(" ];\n")
+        for n in self.nodes:
+            n.write(f)
+        for n in self.nodes:
+            n.write_edges(f)
+        f.write("}\n")
 
     def node( self, name ):
         n = node(name)
@@ -208,6 +219,45 @@ class graph:
         return n
 
 
+write_buffer = 1024*1024
+
+def report( msg ):
+    gdb.post_event( lambda : print(msg) )
+
+def render_task( at, write, cmd, name ):
+    at.set_progress(f"writing {name}")
+    write()
+    if( cmd is None or len(cmd) == 0 ):
+        return
+    at.set_progress(f"starting {name}")
+    # The commands usually put the viewer in the background (... &). Nothing may be connected to a pipe of ours then,
+    # otherwise we would wait for the viewer to be closed instead of just for the shell to start it
+    ret = subprocess.run( cmd, shell = True, stdin = subprocess.DEVNULL, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL, check = False )
+    if( ret.returncode != 0 ):
+        report(f"'{cmd}' failed with exit code {ret.returncode}")
+
+def start( write, cmd, name ):
+    """
+    Calls write and then runs the shell command cmd in the background, while it is running the prompt shows the
+    progress
+    """
+    at = vdb.util.async_task( render_task, write, cmd, name )
+    at.start()
+    return at
+
+def render( g, filename, cmd ):
+    """
+    Writes the graph g into filename (.dot is appended when missing) and then runs cmd on it, both in the background.
+    cmd is formatted with filename and filebase (the name without .dot)
+    """
+    if( filename.endswith(".dot") ):
+        filebase = filename[:-4]
+    else:
+        filebase = filename
+        filename += ".dot"
+    cmd = cmd.format(filename = filename, filebase = filebase)
+    print(f"Writing '{filename}', then starting {cmd}")
+    return start( lambda : g.write(filename), cmd, os.path.basename(filename) )
 
 def color_raw( s, col ):
     # dotty doesn't like empty font tags
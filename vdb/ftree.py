@@ -18,7 +18,6 @@ import itertools
 import colors
 import traceback
 import re
-import os
 import datetime
 
 
@@ -1269,20 +1268,12 @@ ftree <pointer>|<variable> [<limit>]  - It takes a pointer to some object or a v
 #            print("f.edge_redirects = '%s'" % f.edge_redirects )
             sw.stop()
             sw.print("Creating ftree took {}")
-            sw.start()
 
 #            xl = vdb.layout.object_layout(val.type,val)
 #            return
             self.print_result()
             print("limit = '%s'" % limit )
-            g.write(filebase)
-            sw.stop()
-            sw.print("Writing ftree took {}")
-
-            filename = filebase + ".dot"
-            cmd=dot_command.value.format(filename=filename, filebase=filebase)
-            print(f"Created '{filename}', starting {cmd}")
-            os.system(cmd)
+            vdb.dot.render( g, filebase, dot_command.value )
             vdb.cache.dump()
         except Exception as e:
             vdb.print_exc()
@@ -82,12 +82,15 @@ class mock_event:
 
 class events:
     new_objfile = mock_event
+    free_objfile = mock_event
+    clear_objfiles = mock_event
     new_thread = mock_event
     stop = mock_event
     before_prompt = mock_event
     memory_changed = mock_event
     inferior_call = mock_event
     new_inferior = mock_event
+    register_changed = mock_event
 
 class mock_type:
 
@@ -122,13 +125,28 @@ class Architecture:
     def name( self ):
         return "x86"
 
+class MemoryError(error):
+    pass
+
 class Inferior:
+    pid = 0
+    num = 1
+
     def architecture( self ):
         return Architecture()
 
+    def read_memory( self, addr, length ):
+        raise MemoryError(f"Cannot access memory at address {addr:#x}")
+
 def selected_inferior( ):
     return Inferior()
 
+def selected_frame( ):
+    raise error("No frame selected.")
+
+def current_recording( ):
+    return None
+
 class Value:
     def __init__( self, x ):
         self.x = x
@@ -3,6 +3,7 @@
 
 import vdb.command
 import vdb.config
+import vdb.dot
 
 import gdb
 
@@ -10,7 +11,6 @@ import traceback
 import math
 import re
 import datetime
-import os
 from PIL import Image
 
 
@@ -195,13 +195,10 @@ def eval_hashtable( val ):
     filename = raw_filename.value
     now=datetime.datetime.now()
     filename=now.strftime(filename)
-#    img.save("hashtable.png")
-    img.save("hashtable.png")
-
-    if( len(imgcommand.value) > 0 ):
-        cmd=imgcommand.value.format(filename=filename)
-        print(f"Created '{filename}', starting {cmd}")
-        os.system(cmd)
+    cmd=imgcommand.value.format(filename=filename)
+    if( len(cmd) > 0 ):
+        print(f"Saving '{filename}', then starting {cmd}")
+    vdb.dot.start( lambda : img.save(filename), cmd, filename )
 
 class cmd_hashtable (vdb.command.command):
     """Generate graphical information about the state of a hashtable (std:: and boost::)
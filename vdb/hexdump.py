@@ -18,6 +18,7 @@ import string
 import traceback
 import re
 import intervaltree
+import sys
 
 
 color_head       = vdb.config.parameter("vdb-hexdump-colors-header",                "#ffa",    gdb_type = vdb.config.PARAM_COLOUR)
@@ -26,6 +27,10 @@ default_len   = vdb.config.parameter("vdb-hexdump-default-len",8*16)
 repeat_header = vdb.config.parameter("vdb-hexdump-repeat-header",42)
 default_chaindepth = vdb.config.parameter("vdb-hexdump-default-chaindepth",3)
 default_align = vdb.config.parameter("vdb-hexdump-default-align",False)
+default_max_rows = vdb.config.parameter("vdb-hexdump-max-rows",0)
+chunk_size = vdb.config.parameter("vdb-hexdump-chunk-size",64*1024)
+flush_rows = vdb.config.parameter("vdb-hexdump-flush-rows",64)
+collapse = vdb.config.parameter("vdb-hexdump-collapse",False)
 
 pc_separator = vdb.config.parameter("vdb-hexdump-pointer-chain-separator","|")
 row_format = vdb.config.parameter("vdb-hexdump-row-format", "{p}: {l}{t} {s}{pointer_string}{value_string}")
@@ -35,6 +40,9 @@ color_list = vdb.config.parameter("vdb-hexdump-colors-symbols", "#f00;#0f0;#00f;
 unknown_color = vdb.config.parameter("vdb-hexdump-colors-unknown-bytes", "#666666", gdb_type =vdb.config.PARAM_COLOUR )
 
 def print_header( ):
+    print(header_string())
+
+def header_string( ):
     #pylint: disable=possibly-unused-variable
     plen = vdb.arch.pointer_size // 4
     rowf = row_format.value
@@ -46,7 +54,7 @@ def print_header( ):
     pointer_string = "POINTERS "
     value_string = "VALUES "
     rowh = rowf.format(**locals())
-    print(vdb.color.color(rowh,color_head.value))
+    return vdb.color.color(rowh,color_head.value)
 #    print(vdb.color.color(f'  {" "*plen}  0  1  2  3   4  5  6  7    8  9  A  B   C  D  E  F   01234567 89ABCDEF',color_head.value))
 
 
@@ -92,10 +100,159 @@ def tile_format( cnt, t, l ):
         l += " "
     return (t,l)
 
-def hexdump( addr, xlen = -1, pointers = False, chaindepth = -1, values = False, symbols = True, align = None, uncached = False ):
+# Byte to character for the text column, everything not printable (or a whitespace other than space) becomes a dot
+printable_table = bytes( b if ( chr(b) in string.printable and chr(b) not in "\t\n\r\v\f" ) else ord(".") for b in range(256) )
+
+# Colours the tokens [start,end) with one escape sequence per run of equal colours
+def colored_runs( tokens, cols, start, end ):
+    if( end > start and cols[start:end].count(cols[start]) == end - start ):
+        return vdb.color.color("".join(tokens[start:end]),cols[start])
+    ret = ""
+    i = start
+    while( i < end ):
+        c = cols[i]
+        j = i + 1
+        while( j < end and cols[j] == c ):
+            j += 1
+        ret += vdb.color.color("".join(tokens[i:j]),c)
+        i = j
+    return ret
+
+# Renders the rows of one hexdump. Keeps the state that is carried from row to row (the current symbol and its colour)
+# and works on whole rows: the hex and text columns are converted for all bytes of the row at once and the annotations
+# are looked up once per row instead of once per byte.
+class row_renderer:
+    def __init__( self, symtree, values ):
+        self.symtree = symtree
+        self.values = values
+        self.current_symbol = None
+        self.next_color = -1
+        self.sym_color = None
+        self.shortened = {}
+
+    # The annotation for every byte of [xaddr,xaddr+n), explicit annotations win over symbols
+    def names( self, xaddr, n ):
+        ret = [None] * n
+        end = xaddr + n
+        for tree in ( self.symtree, annotation_tree ):
+            for iv in tree[xaddr:end]:
+                lo = max(iv.begin,xaddr) - xaddr
+                hi = min(iv.end,end) - xaddr
+                ret[lo:hi] = [iv.data] * (hi-lo)
+        return ret
+
+    def shorten( self, nsym ):
+        ret = self.shortened.get(nsym)
+        if( ret is None ):
+            ret = vdb.shorten.symbol(nsym)
+            self.shortened[nsym] = ret
+        return ret
+
+    def value_of( self, nsym ):
+        try:
+            value = gdb.parse_and_eval(f"{nsym}")
+        except:
+            value = ""
+        value = str(value)
+        if( len(value) > 0 and value[-1] == "\n" ):
+            value = value[:-1]
+        if( len(value) > 0 and value.find("\n") == -1 ):
+            return vdb.color.color(value,self.sym_color) + " "
+        return ""
+
+    # raw are the bytes of the row, holes is None or a list that is True for every inaccessible byte, the first suppress
+    # bytes are left out. Returns the hex and text columns and the symbol and value annotations. names can be passed in
+    # when the caller already looked them up.
+    def row( self, xaddr, raw, holes = None, suppress = 0, names = None ):
+        n = len(raw)
+        s = ""
+        value_string = ""
+        cols = [None] * n
+
+        if( names is None ):
+            names = self.names(xaddr+suppress,n-suppress)
+        i = 0
+        while( i < len(names) ):
+            nsym = names[i]
+            j = i + 1
+            while( j < len(names) and names[j] == nsym ):
+                j += 1
+            if( nsym is not None ):
+                nsym = self.shorten(nsym)
+                if( self.current_symbol != nsym ):
+                    if( nsym ):
+                        self.next_color += 1
+                        self.next_color %= len(color_list.elements)
+                        self.sym_color = color_list.elements[self.next_color]
+                        s += vdb.color.color(nsym,self.sym_color)
+                        s += " "
+                        if( self.values ):
+                            value_string += self.value_of(nsym)
+                    else:
+                        self.sym_color = None
+                    self.current_symbol = nsym
+            else:
+                self.sym_color = None
+                self.current_symbol = None
+            cols[suppress+i:suppress+j] = [self.sym_color] * (j-i)
+            i = j
+
+        txt = raw.translate(printable_table).decode("latin-1")
+        if( n == 16 and suppress == 0 and holes is None and cols.count(None) == 16 ):
+            # The common case of a full row without any annotations
+            hx = raw.hex(" ")
+            l = hx[0:12] + " " + hx[12:24] + "- " + hx[24:36] + " " + hx[36:47] + "  "
+            t = txt[:8] + " " + txt[8:]
+            return ( l, t, s, value_string )
+
+        hx = raw.hex()
+        ltok = [ hx[2*k:2*k+2] + " " for k in range(n) ]
+        ttok = list(txt)
+        for k in range(suppress):
+            ltok[k] = "   "
+            ttok[k] = " "
+        if( holes is not None ):
+            for k in range(suppress,n):
+                if( holes[k] ):
+                    ltok[k] = "?? "
+                    ttok[k] = "?"
+                    if( cols[k] is None ):
+                        cols[k] = unknown_color.value
+
+        l = ""
+        for q in range(0,n,4):
+            e = min(q+4,n)
+            l += colored_runs(ltok,cols,q,e)
+            if( e == 8 ):
+                l += "-"
+            if( e % 4 == 0 ):
+                l += " "
+        t = colored_runs(ttok,cols,0,min(n,8))
+        if( n >= 8 ):
+            t += " "
+            t += colored_runs(ttok,cols,8,n)
+        t,l = spacer_format(16-n,t,l)
+        return ( l, t, s, value_string )
+
+# Splits one row of whatever vdb.memory.read() returned into its bytes and the list of holes (or None if there are none)
+def row_bytes( dc ):
+    if( isinstance(dc,memoryview) ):
+        return ( dc.tobytes(), None )
+    items = list(dc)
+    holes = [ d is ... for d in items ]
+    raw = b"".join( b"\0" if d is ... else d for d in items )
+    if( not any(holes) ):
+        holes = None
+    return ( raw, holes )
+
+def hexdump( addr, xlen = -1, pointers = False, chaindepth = -1, values = False, symbols = True, align = None, uncached = False, max_rows = None, collapse_rows = None ):
 
     if( align is None ):
         align = default_align.value
+    if( max_rows is None ):
+        max_rows = default_max_rows.value
+    if( collapse_rows is None ):
+        collapse_rows = collapse.value
 
 
 
@@ -103,10 +260,6 @@ def hexdump( addr, xlen = -1, pointers = False, chaindepth = -1, values = False,
         chaindepth = default_chaindepth.value
     if( xlen == -1):
         xlen = default_sizes.get(addr,default_len.value)
-    if( symbols ):
-        symtree = vdb.memory.get_symbols(addr,xlen)
-    else:
-        symtree = intervaltree.IntervalTree()
 
     suppress = 0 # amount of bytes at the beginning to leave out
     if( align ): # needs to align to 16 bytes
@@ -116,12 +269,9 @@ def hexdump( addr, xlen = -1, pointers = False, chaindepth = -1, values = False,
         xlen += suppress
 
     olen = xlen
+    chunk = max( 16, chunk_size.value - chunk_size.value % 16 )
 
-    print(f"hexdump reads {addr:#0x}")
-    data = vdb.memory.read_u(uncached,addr,xlen,partial=True)
-    print(f"{type(data)=}")
-#    if( data is not None ):
-#        print(f"{data.tobytes()=}")
+    data = vdb.memory.read_u(uncached,addr,min(chunk,xlen),partial=True,consumer="hexdump")
 
     # Could not read data for whatever reason...
     if( data is None ):
@@ -129,161 +279,133 @@ def hexdump( addr, xlen = -1, pointers = False, chaindepth = -1, values = False,
         data = vdb.memory.read_u(uncached,addr+suppress,1)
         if( data is not None ):
             data = None
+            xlen = min(chunk,xlen)
             while(data is None ):
                 xlen -= 1
                 data = vdb.memory.read_u(uncached,addr,xlen)
     if( data is None ):
         print(f"Can not access memory at {addr:#0x}")
         return
-#    print(f"{type(data)=}")
-#    print(f"{type(data[0])=}")
-
-    xaddr = addr
-#    p,add,col,mm,_ = vdb.pointer.color(addr,vdb.arch.pointer_size)
-#    nm = gdb.parse_and_eval(f"(void*)({addr})")
-    current_symbol = None
-    next_color = -1
-    sym_color = None
-    line = 0
 
+    renderer = row_renderer( None, values )
     rowf = row_format.value
-
-    if( len(data) > 0 ):
-        vdb.memory.print_legend( )
-    #pylint: disable=possibly-unused-variable
-    while(len(data) > 0 ):
-#        print(f"{data=}")
-        dc = data[:16]
-#        print(f"{dc=}")
-        data = data[16:]
-#        print(f"{dc.tobytes()=}")
-#        print(f"{data.tobytes()=}")
+    step = vdb.arch.pointer_size // 8
+    holes = 0
+    line = 0
+    # How many bytes from addr on are done (shown or collapsed), line only counts the rows actually printed
+    consumed = 0
+    block = []
+    limited = False
+    # For collapsing, the previous row that was printed, how many rows equal to it were left out since and the first of
+    # those
+    previous = None
+    collapsed = 0
+    held = None
+
+    def emit( xaddr, raw, rholes, names ):
+        nonlocal line
+        nonlocal suppress
+        l,t,s,value_string = renderer.row( xaddr, raw, rholes, suppress, names )
         p,_,_,_,_ = vdb.pointer.color(xaddr,vdb.arch.pointer_size)
-        cnt = 0
-        l = ""
-        t = ""
-        s = ""
+
         pointer_string=""
-        value_string=""
-        parr = []
-        step = vdb.arch.pointer_size // 8
         # XXX Suppress the output of the pointers also when at least one of their bytes is suppressed
         if( pointers ):
             for poffset in range(0,16,step):
-#                print("poffset = '%s'" % poffset )
-#                print("step = '%s'" % step )
-                pbytes = dc[poffset:poffset+step]
+                if( rholes is not None and any(rholes[poffset:poffset+step]) ):
+                    # at least one byte is inaccessible
+                    continue
                 # XXX get byteorder from global
-                pint = int.from_bytes(pbytes,"little")
-#                print("pint = '%s'" % pint )
+                pint = int.from_bytes(raw[poffset:poffset+step],"little")
                 ps,pu = vdb.pointer.chain( pint, vdb.arch.pointer_size, chaindepth, test_for_ascii = False )
                 if( not pu ):
                     pointer_string += ps
                     pointer_string += pc_separator.value
+        suppress = 0
 
-#        print(f"{type(dc)=}")
-#        print(f"{type(dc[0])=}")
-        for d in dc:
-#            vdb.util.inspect(dc)
-#            vdb.util.inspect(d)
-#            if( isinstance(d,int) ):
-#                d=d.to_bytes()
-#            print(f"{type(d)=}")
-#            print(f"1{d=}")
-#            d = bytes(d)
-#            print(f"2{d=}")
-            if( suppress ):
-                suppress -= 1
-                l += "   "
-                t += " "
-                cnt += 1
-                t,l = tile_format(cnt,t,l)
-                continue
-#            xs = symtree[xaddr+cnt]
-#            print("")
-#            print(f"xaddr = {int(xaddr):#0x}" if xaddr is not None else "xaddr = None")
-#            print(f"{cnt=}")
-            xs = get_annotation( xaddr + cnt, symtree )
-#            print(f"{xs=}")
-            nsym = None
-            for x in xs:
-#                print("x[0] = '%s'" % x[0] )
-#                print("x[1] = '%s'" % x[1] )
-#                print("xaddr = '%s'" % xaddr )
-                nsym = x[2]
-                break
-
-#            nm = gdb.parse_and_eval(f"(void*)({xaddr+cnt})")
-#            m=symre.match(str(nm))
-#            if( m ):
-            if( nsym is not None ):
-#                print("m.group(0) = '%s'" % m.group(0) )
-#                print("m.group(1) = '%s'" % m.group(1) )
-#                nsym = m.group(1)
-                nsym = vdb.shorten.symbol(nsym)
-#                print("nsym = '%s'" % nsym )
-                if( current_symbol != nsym ):
-                    if( nsym ):
-                        next_color += 1
-                        next_color %= len(color_list.elements)
-                        sym_color = color_list.elements[next_color]
-                        s += vdb.color.color(nsym,sym_color)
-                        s += " "
-                        if( values ):
-#                            print("nsym = '%s'" % nsym )
-#                            value = gdb.execute(f"p {nsym}",False,True)
-                            try:
-                                value = gdb.parse_and_eval(f"{nsym}")
-                            except:
-                                value = ""
-                            value = str(value)
-#                            print("value = '%s'" % value )
-                            if( len(value) > 0 and value[-1] == "\n" ):
-                                value = value[:-1]
-                            if( len(value) > 0 and value.find("\n") == -1 ):
-                                value_string += vdb.color.color(value,sym_color)
-                                value_string += " "
-                    else:
-                        sym_color = None
-                    current_symbol = nsym
-            else:
-                sym_color = None
-                current_symbol = None
-
-            if( d == ... ):
-                if( sym_color is None ):
-                    sym_color = unknown_color.value
-                l += vdb.color.color("?? ",sym_color)
-                t += vdb.color.color("?",sym_color)
-            else:
-                d = int.from_bytes(d,"little")
-                l += vdb.color.color(f"{d:02x} ",sym_color)
-                c = chr(d)
-                if( c in string.printable and not ( c in "\t\n\r\v\f") ):
-                    t += vdb.color.color(c,sym_color)
-                else:
-                    t += vdb.color.color(".",sym_color)
-            cnt += 1
-            t,l = tile_format(cnt,t,l)
-        cnt = (16-cnt)
-        t,l = spacer_format(cnt,t,l)
         if( line % repeat_header.value == 0 ):
-            print_header()
+            block.append( header_string() )
         line += 1
-#        print("len(t) = '%s'" % len(t) )
-        print(rowf.format(**locals()))
-#        print("dc = '%s'" % dc )
-#        print("len(dc) = '%s'" % len(dc) )
-#        print("data = '%s'" % data )
-#        print("len(data) = '%s'" % len(data) )
-        xaddr += 16
-#    print("data = '%s'" % data )
-
-#    print("HEXDUMP")
-#    print("addr = '%s'" % addr )
-#    print("xlen = '%s'" % xlen )
+        block.append( rowf.format(p=p,l=l,t=t,s=s,pointer_string=pointer_string,value_string=value_string,xaddr=xaddr) )
+
+    # A single left out row is shown after all, the marker would not be any shorter
+    def end_run( ):
+        nonlocal collapsed
+        if( collapsed == 1 ):
+            emit( *held )
+        elif( collapsed > 1 ):
+            block.append( collapse_marker(collapsed) )
+        collapsed = 0
+
+    if( xlen > 0 ):
+        vdb.memory.print_legend( )
+    # The range is read, rendered and printed in chunks so that the output of big dumps starts right away and an
+    # interruption (Ctrl-C or quitting the pager) keeps everything up to there
+    try:
+        for cstart in range(0,xlen,chunk):
+            caddr = addr + cstart
+            clen = min(chunk,xlen-cstart)
+            if( cstart > 0 ):
+                data = vdb.memory.read_u(uncached,caddr,clen,partial=True,consumer="hexdump")
+                if( data is None ):
+                    data = vdb.memory.sparse_memory(clen,[])
+            if( isinstance(data,vdb.memory.sparse_memory) ):
+                holes += len(data) - data.accessible()
+            if( symbols ):
+                renderer.symtree = vdb.memory.get_symbols(caddr,clen)
+            else:
+                renderer.symtree = intervaltree.IntervalTree()
+
+            for offset in range(0,len(data),16):
+                if( max_rows > 0 and line >= max_rows ):
+                    limited = True
+                    break
+                xaddr = caddr + offset
+                raw,rholes = row_bytes( data[offset:offset+16] )
+                names = None
+                if( collapse_rows ):
+                    names = renderer.names(xaddr+suppress,len(raw)-suppress)
+                    current = ( raw, rholes, names )
+                    # Only rows that are completely within one (or no) annotation, anything else would look different
+                    if( current == previous and len(names) and names.count(names[0]) == len(names) ):
+                        if( collapsed == 0 ):
+                            held = ( xaddr, raw, rholes, names )
+                        collapsed += 1
+                        consumed = cstart + offset + len(raw)
+                        continue
+                    previous = current
+                    end_run()
+                emit( xaddr, raw, rholes, names )
+                consumed = cstart + offset + len(raw)
+                if( len(block) >= flush_rows.value ):
+                    flush_block(block)
+            if( limited ):
+                break
+    except KeyboardInterrupt:
+        end_run()
+        flush_block(block)
+        print(f"Interrupted after {line} rows, {xlen-consumed} more bytes from {addr+consumed:#0x} on not shown")
+        return
+    end_run()
+    flush_block(block)
+
+    if( limited ):
+        print(f"Stopped after {line} rows, {xlen-consumed} more bytes from {addr+consumed:#0x} on not shown")
+        return
+
     if( olen != xlen ):
         print(f"Could only access {xlen} of {olen} requested bytes")
+    if( holes ):
+        print(f"Could not access {holes} of {xlen} requested bytes")
+
+def collapse_marker( rows ):
+    return f"* ({rows} identical rows, {rows*16} bytes)"
+
+def flush_block( block ):
+    if( len(block) ):
+        print("\n".join(block))
+        sys.stdout.flush()
+        block.clear()
 
 def annotate_range( addr, length, name ):
     annotation_tree[addr:addr+length] = name
@@ -366,6 +488,14 @@ def call_hexdump( argv, flags ):
     align = None
     uncached = False
     chainlen = -1
+    max_rows = None
+    collapse_rows = None
+
+    # before p, which takes all the rest of the flags as its number
+    m = re.search("n([0-9]+)",flags)
+    if( m is not None ):
+        max_rows = int(m.group(1))
+        flags = flags.replace(m.group(0),"")
 
     m = re.search("p[0-9]*",flags)
     if( m is not None ):
@@ -390,6 +520,10 @@ def call_hexdump( argv, flags ):
         align = True
         flags = flags.replace("a","")
 
+    if( flags.find("c") != -1 ):
+        collapse_rows = True
+        flags = flags.replace("c","")
+
     if( len(flags) > 0 ):
         print(f"Unknown flags {flags}")
         return
@@ -432,11 +566,11 @@ def call_hexdump( argv, flags ):
                 olen = dtype.sizeof
 #            print(f"{olen=}")
 
-            hexdump(oaddr,olen,pointers=pointers,chaindepth=chainlen,values=values,align=align,uncached=uncached)
+            hexdump(oaddr,olen,pointers=pointers,chaindepth=chainlen,values=values,align=align,uncached=uncached,max_rows=max_rows,collapse_rows=collapse_rows)
         elif( len(argv) == 2 ):
             addr = vdb.util.gint("(void*)" + argv[0])
             xlen = vdb.util.gint(argv[1])
-            hexdump(addr,xlen,pointers=pointers,chaindepth=chainlen,values=values,align=align,uncached=uncached)
+            hexdump(addr,xlen,pointers=pointers,chaindepth=chainlen,values=values,align=align,uncached=uncached,max_rows=max_rows,collapse_rows=collapse_rows)
         else:
             print(cmd_hexdump.__doc__)
     return
@@ -455,6 +589,8 @@ hexdump[/p#|v] <addr> [<len>]               - shows a hexdump of <len> or vdb-he
 hexdump/p#                                  - In the annotation text, show pointer chains of (aligned) pointers with max length of #
 hexdump/v                                   - In case of annotated known variables, print their pretty printed values too
 hexdump/a                                   - Output addresses 16 byte aligned
+hexdump/n#                                  - Stop after # rows
+hexdump/c                                   - Show runs of identical rows only once
 
 hexdump annotate <varname>                  - annotates the variable <varname> according to the type information known to gdb
 hexdump annotate <addres> <type>            - annotates the given address like a variable of type <type>
@@ -5,11 +5,14 @@ import vdb.config
 import vdb.color
 import vdb.util
 import vdb.arch
+import vdb.cache
+import vdb.subcommands
 import vdb
 
 import gdb
 import intervaltree
 import struct
+import bisect
 
 import traceback
 import colors
@@ -18,6 +21,7 @@ import re
 from enum import Enum,auto
 import time
 import sys
+import os
 
 
 
@@ -52,7 +56,11 @@ color_iv = vdb.config.parameter("vdb-memory-colors-invalid"     , "#16f", gdb_ty
 
 ignore_empty = vdb.config.parameter("vdb-memory-ignore-empty-sections", False, gdb_type = gdb.PARAM_BOOLEAN )
 
-test_write = vdb.config.parameter("vdb-memory-test-write-access", True )
+# The access bits tested with the old setting are of no use anymore
+def forget_access( _ ):
+    section_cache.pop("access",None)
+
+test_write = vdb.config.parameter("vdb-memory-test-write-access", True, on_set = forget_access )
 default_colorspec = vdb.config.parameter("vdb-memory-default-colorspec","smAa")
 
 
@@ -423,18 +431,399 @@ def add_overlay( addr, data, length = None ):
 add_overlay( 0x8004010, None, 32 )
 
 
-def read_u( uncached, ptr, count = 1, partial = False ):
+def read_u( uncached, ptr, count = 1, partial = False, consumer = None ):
     if( uncached ):
         return read_uncached( ptr, count, partial )
     else:
-        return read( ptr, count, partial )
+        return read( ptr, count, partial, consumer )
+
+def normalize_address( ptr ):
+    if( isinstance(ptr,str) ):
+        addr=vdb.util.gint(ptr)
+    else:
+        addr=ptr
+    while( addr < 0 ):
+        addr += 2** vdb.arch.pointer_size
+    addr=int(addr)
+    addr &= ( 2 ** vdb.arch.pointer_size - 1 )
+    return addr
+
+# Read through cache of page_size aligned blocks of target memory. Missing pages of a request are fetched with one
+# read_memory call per contiguous run and kept as slices of that buffer, so requests that fall within one page are
+# served as a memoryview slice without copying. Pages that could not be read are remembered as False, requests touching
+# them go the old way through read_uncached() which knows how to handle partial reads.
+#
+# Reading more than was asked for is only safe for ordinary memory, on bare metal targets the bytes next to a variable
+# can just as well be a read to clear register or a FIFO. So only requests whose pages all lie within a region the
+# memory map knows to be ordinary memory (see memory_map.normal_span()) go through the cache, all others are read
+# exactly as requested.
+#
+# For read ahead every consumer (code that walks memory and names itself in the consumer argument of read()) gets a
+# stream that remembers its last address and the stride between its reads. When the same stride was seen twice in a row
+# and the consumer misses the cache, not just the missing pages but the whole read ahead window in that direction is
+# fetched in one go, though never beyond the end of the ordinary memory the read is in.
+class read_stream:
+    __slots__ = ( "addr", "stride", "seen" )
+
+    def __init__( self, addr ):
+        self.addr = addr
+        self.stride = 0
+        self.seen = 0
+
+    def update( self, addr ):
+        stride = addr - self.addr
+        if( stride == 0 ):
+            return
+        if( stride == self.stride ):
+            self.seen += 1
+        else:
+            self.stride = stride
+            self.seen = 0
+        self.addr = addr
+
+    def sequential( self ):
+        return ( self.seen > 0 and self.stride > 0 )
+
+class page_cache:
+    def __init__( self, page_size, max_pages ):
+        self.pages = vdb.cache.lru_cache("memory_pages")
+        self.page_size = page_size
+        self.pages.resize( max_pages, 0 )
+        self.hits = 0
+        self.misses = 0
+        self.reads = 0
+        self.bytes_read = 0
+        self.failed = 0
+        self.fallbacks = 0
+        self.exact = 0
+        self.invalidations = 0
+        self.readahead = 0
+        self.streams = {}
+        self.prefetched = set()
+        self.failed_ahead = (0,0)
+        self.readaheads = 0
+        self.readahead_failed = 0
+        self.saved = 0
+        self.wasted = 0
+
+    def clear( self, _ = None ):
+        if( len(self.pages) ):
+            self.invalidations += 1
+            self.pages.clear()
+        self.wasted += len(self.prefetched)
+        self.prefetched.clear()
+        self.failed_ahead = (0,0)
+
+    def resize( self, page_size, max_pages ):
+        if( page_size != self.page_size ):
+            self.pages.clear()
+            self.page_size = page_size
+        self.pages.resize( max_pages, 0 )
+
+    # Reads [first,last) with a single round trip and splits it into pages
+    def fetch( self, first, last ):
+        self.reads += 1
+        ps = self.page_size
+        try:
+            data = gdb.selected_inferior().read_memory(first,last-first)
+        except gdb.error:
+            self.failed += 1
+            if( last - first > ps ):
+                # Somewhere in there is an inaccessible page, find out which ones are readable
+                for pa in range(first,last,ps):
+                    self.fetch(pa,pa+ps)
+            else:
+                self.pages[first] = False
+            return
+        self.bytes_read += last-first
+        for pa in range(first,last,ps):
+            self.pages[pa] = data[pa-first:pa-first+ps]
+        if( self.prefetched ):
+            # It was prefetched but got evicted before it was used
+            self.prefetched.difference_update( range(first,last,ps) )
+
+    # Like fetch() but for the missing run [first,last) of a sequential stream, extended to the read ahead window, which
+    # ends at limit at the latest. If that fails (likely the window reaches into unmapped memory) only the run itself is
+    # fetched.
+    def fetch_ahead( self, first, last, limit ):
+        ps = self.page_size
+        ahead = first + self.readahead
+        ahead += -ahead % ps
+        ahead = min( ahead, limit - limit % ps, 2 ** vdb.arch.pointer_size, first + ps * self.pages.max_entries // 2 )
+        lo,hi = self.failed_ahead
+        if( ahead <= last or lo <= first < hi ):
+            self.fetch(first,last)
+            return
+        self.reads += 1
+        try:
+            data = gdb.selected_inferior().read_memory(first,ahead-first)
+        except gdb.error:
+            # Don't try again for anything starting in this window
+            self.readahead_failed += 1
+            self.failed_ahead = (first,ahead)
+            self.fetch(first,last)
+            return
+        self.readaheads += 1
+        self.bytes_read += ahead-first
+        pages = self.pages.cache
+        for pa in range(first,ahead,ps):
+            if( pa >= last ):
+                if( pa in pages ):
+                    continue
+                self.prefetched.add(pa)
+            self.pages[pa] = data[pa-first:pa-first+ps]
+
+    def fetch_run( self, first, last, limit ):
+        if( limit is None ):
+            self.fetch(first,last)
+        else:
+            self.fetch_ahead(first,last,limit)
+
+    # span is the ( start, end ) of the ordinary memory around addr, pages reaching out of it are not read
+    def read( self, addr, count, span, consumer = None ):
+        ps = self.page_size
+        first = addr - addr % ps
+        end = addr + count
+        last = end + (-end % ps)
+        if( span is None or first < span[0] or last > span[1] ):
+            self.exact += 1
+            return None
+
+        limit = None
+        if( self.readahead and consumer is not None ):
+            stream = self.streams.get(consumer)
+            if( stream is None ):
+                self.streams[consumer] = read_stream(addr)
+            else:
+                stream.update(addr)
+                if( stream.sequential() ):
+                    limit = span[1]
+
+        pages = self.pages.cache
+        run = None
+        for pa in range(first,last,ps):
+            if( pa in pages ):
+                if( run is not None ):
+                    self.fetch_run(run,pa,limit)
+                    run = None
+            elif( run is None ):
+                run = pa
+        if( run is not None ):
+            self.fetch_run(run,last,limit)
+
+        prefetched = self.prefetched
+        blocks = []
+        for pa in range(first,last,ps):
+            p = self.pages.get(pa)
+            if( p is None or p is False ):
+                self.misses += 1
+                self.fallbacks += 1
+                return None
+            if( prefetched and pa in prefetched ):
+                # This one would have been a round trip of its own
+                prefetched.discard(pa)
+                self.saved += 1
+            blocks.append(p)
+        self.hits += 1
+
+        offset = addr - first
+        if( len(blocks) == 1 ):
+            return blocks[0][offset:offset+count]
+        return memoryview(b"".join(blocks)).cast("c")[offset:offset+count]
 
-@vdb.util.memoize( [gdb.events.stop, gdb.events.memory_changed, gdb.events.inferior_call,gdb.events.new_objfile,gdb.events.new_inferior] )
-def read( ptr, count = 1, partial = False ):
+    def __str__( self ):
+        ratio = self.hits/(self.hits+self.misses+0.000000001)
+        return f"{self.hits}h,{self.misses}m=>{ratio:.2f},{self.reads}r@{len(self.pages)}"
+
+def resize_page_cache( _ ):
+    pages.clear()
+    pages.resize( page_size.value, cache_pages.value )
+    pages.readahead = readahead.value
+
+use_page_cache = vdb.config.parameter("vdb-memory-page-cache", True, on_set = resize_page_cache )
+page_size = vdb.config.parameter("vdb-memory-page-size", 4096, on_set = resize_page_cache )
+cache_pages = vdb.config.parameter("vdb-memory-cache-pages", 1024, on_set = resize_page_cache )
+readahead = vdb.config.parameter("vdb-memory-readahead", 65536, on_set = resize_page_cache )
+
+pages = page_cache( page_size.value, cache_pages.value )
+pages.readahead = readahead.value
+memory_events = [gdb.events.stop, gdb.events.memory_changed, gdb.events.inferior_call,gdb.events.new_objfile,gdb.events.new_inferior]
+for ev in memory_events:
+    ev.connect( pages.clear )
+
+@vdb.util.memoize( memory_events )
+def read_exact( ptr, count = 1, partial = False ):
     return read_uncached(ptr,count,partial)
 
-# XXX Feature idea: dont use memoryview but our own thing (might be interval tree based) that supports "inaccessible"
-# for a byte, so that at least hexdump and maybe others can display that
+# consumer names code that reads memory sequentially (like hexdump going through its chunks), only those reads are
+# considered for read ahead
+def read( ptr, count = 1, partial = False, consumer = None ):
+    if( use_page_cache.value and count > 0 ):
+        try:
+            addr = normalize_address(ptr)
+        except gdb.error:
+            addr = None
+        if( addr is not None and not overlay_memory.overlaps(addr,addr+count) ):
+            ret = pages.read(addr,count,mmap.normal_span(addr),consumer)
+            if( ret is not None ):
+                return ret
+    return read_exact(ptr,count,partial)
+
+def memory_stats( argv ):
+    tbl = []
+    tbl.append( [ "Page size", "Pages", "Hits", "Misses", "Reads", "Bytes read", "Failed", "Not ordinary", "Invalidations" ] )
+    tbl.append( [ str(pages.page_size), f"{len(pages.pages)}/{pages.pages.max_entries}",
+                 str(pages.hits), str(pages.misses), str(pages.reads), str(pages.bytes_read), str(pages.failed),
+                 str(pages.exact), str(pages.invalidations) ] )
+    vdb.util.print_table(tbl)
+    tbl = []
+    tbl.append( [ "Read ahead", "Streams", "Sequential", "Read aheads", "Failed", "Round trips saved", "Pages unused" ] )
+    sequential = sum( 1 for s in pages.streams.values() if s.sequential() )
+    tbl.append( [ str(pages.readahead), str(len(pages.streams)), str(sequential), str(pages.readaheads),
+                 str(pages.readahead_failed), str(pages.saved), str(pages.wasted + len(pages.prefetched)) ] )
+    vdb.util.print_table(tbl)
+    print(f"exact cache: {len(read_exact.cache)} entries")
+
+vdb.subcommands.add_subcommand( [ "memory", "stats" ], memory_stats )
+
+# Memory with holes, returned by partial reads. The accessible parts are kept as the memoryview objects they were read
+# as, found by bisecting their start offsets. Like a memoryview of format "c" indexing and iterating gives single bytes
+# objects, but for bytes in holes it gives ... instead. Slices that are completely accessible are plain memoryview
+# slices, all others are sparse_memory objects again.
+class sparse_memory:
+    __slots__ = ( "length", "starts", "chunks" )
+
+    def __init__( self, length, chunks ):
+        self.length = length
+        self.chunks = chunks
+        self.starts = [ o for o,_ in chunks ]
+
+    def __len__( self ):
+        return self.length
+
+    def __getitem__( self, key ):
+        if( isinstance(key,slice) ):
+            start,stop,step = key.indices(self.length)
+            if( step != 1 ):
+                return [ self[i] for i in range(start,stop,step) ]
+            stop = max(start,stop)
+            chunks = []
+            i = max( bisect.bisect_right(self.starts,start)-1, 0 )
+            for o,mv in self.chunks[i:]:
+                if( o >= stop ):
+                    break
+                e = o + len(mv)
+                if( e <= start ):
+                    continue
+                if( o <= start and e >= stop ):
+                    return mv[start-o:stop-o]
+                lo = max(o,start)
+                chunks.append( ( lo-start, mv[lo-o:min(e,stop)-o] ) )
+            return sparse_memory( stop-start, chunks )
+
+        if( key < 0 ):
+            key += self.length
+        if( key < 0 or key >= self.length ):
+            raise IndexError("sparse_memory index out of range")
+        i = bisect.bisect_right(self.starts,key)-1
+        if( i >= 0 ):
+            o,mv = self.chunks[i]
+            if( key < o + len(mv) ):
+                return mv[key-o]
+        return ...
+
+    def __iter__( self ):
+        pos = 0
+        for o,mv in self.chunks:
+            for _ in range(pos,o):
+                yield ...
+            yield from mv
+            pos = o + len(mv)
+        for _ in range(pos,self.length):
+            yield ...
+
+    def holes( self ):
+        ret = []
+        pos = 0
+        for o,mv in self.chunks:
+            if( o > pos ):
+                ret.append( (pos,o) )
+            pos = o + len(mv)
+        if( pos < self.length ):
+            ret.append( (pos,self.length) )
+        return ret
+
+    def accessible( self ):
+        return sum( len(mv) for _,mv in self.chunks )
+
+    def tobytes( self, fill = b"\0" ):
+        ret = bytearray()
+        pos = 0
+        for o,mv in self.chunks:
+            ret += fill * (o-pos)
+            ret += mv
+            pos = o + len(mv)
+        ret += fill * (self.length-pos)
+        return bytes(ret)
+
+# Splits [addr,end) at the boundaries of the known memory regions. Every span is returned as (start,end,readable)
+# where readable is True or False if a region tells us so, and None if no region covers that span.
+def mapping_spans( addr, end ):
+    try:
+        mmap.lazy_parse()
+        regions = mmap.regions[addr:end]
+    except gdb.error:
+        return [ ( addr, end, None ) ]
+    points = { addr, end }
+    for iv in regions:
+        if( addr < iv.begin < end ):
+            points.add(iv.begin)
+        if( addr < iv.end < end ):
+            points.add(iv.end)
+    points = sorted(points)
+
+    ret = []
+    for start,stop in zip(points,points[1:]):
+        readable = None
+        for iv in regions:
+            if( iv.begin <= start and iv.end >= stop ):
+                if( iv.data.can_read ):
+                    readable = True
+                    break
+                readable = False
+        if( len(ret) and ret[-1][2] == readable and ret[-1][1] == start ):
+            ret[-1] = ( ret[-1][0], stop, readable )
+        else:
+            ret.append( ( start, stop, readable ) )
+    return ret
+
+# Reads [start,end) into chunks, halving what fails down to single pages that are then left out as holes
+def read_bisect( start, end, base, chunks ):
+    try:
+        chunks.append( ( start-base, gdb.selected_inferior().read_memory(start,end-start) ) )
+        return
+    except gdb.error:
+        pass
+    ps = page_size.value
+    if( end - start <= 1 or start // ps == (end-1) // ps ):
+        return
+    mid = ( start + end ) // 2
+    mid -= mid % ps
+    if( mid <= start ):
+        mid += ps
+    read_bisect( start, mid, base, chunks )
+    read_bisect( mid, end, base, chunks )
+
+def read_sparse( addr, count ):
+    chunks = []
+    for start,end,readable in mapping_spans(addr,addr+count):
+        if( readable is False ):
+            continue
+        read_bisect( start, end, addr, chunks )
+    if( len(chunks) == 0 ):
+        return None
+    return sparse_memory( count, chunks )
+
 def read_uncached( ptr, count = 1, partial = False ):
     """Reads some memory from the inferior
 
@@ -445,8 +834,9 @@ def read_uncached( ptr, count = 1, partial = False ):
 
     Returns:
         A memoryview object containing the data read from memory. If partial is False and the memory is not fully
-        accessible, a gdb.error will be raised. If partial is True and the memory is not fully accessible all bytes
-        accessible from the pointer on will be returned.
+        accessible, a gdb.error will be raised. If partial is True and the memory is not fully accessible a
+        sparse_memory object of the requested size is returned, with the inaccessible parts as holes. If not a single
+        byte is accessible None is returned.
 
         Memory overlays will be honoured.
     """
@@ -473,29 +863,9 @@ def read_uncached( ptr, count = 1, partial = False ):
         result = gdb.selected_inferior().read_memory(addr, count)
     except gdb.error:
         if( partial ):
-            if( count == 1 ):
-                return None
-            cnt0 = count // 2
-            cnt1 = count-cnt0
-            r0 = read_uncached( ptr, cnt0, partial=True )
-#            if( r0 is None ):
-#                print(f"{r0=}")
-#            else:
-#                print(f"{r0.tobytes()=}")
-            if( r0 is None ): # then not even a single byte could be read
+            result = read_sparse( addr, count )
+            if( result is None ): # then not even a single byte could be read
                 return None
-            if( len(r0) >= cnt0 ):
-                r1 = read_uncached( ptr + cnt0, cnt1, partial=True )
-                if( r1 is not None ):
-                    r0b = r0.tobytes()
-                    r1b = r1.tobytes()
-                    allbytes = r0b+r1b
-#                    print(f"{type(allbytes)=}")
-                    return memoryview(allbytes).cast("c")
-                else:
-                    return r0
-            else:
-                return r0
 
     ovmem = overlay_read( addr, count )
 #    print(f"{result=}")
@@ -514,6 +884,7 @@ def write( ptr, buf ):
         addr=vdb.util.gint(ptr)
     else:
         addr=ptr
+    pages.clear()
     try:
         gdb.selected_inferior().write_memory( addr, buf )
     except gdb.error:
@@ -535,6 +906,7 @@ def memset( ptr, val, size ):
 #    print("len(buf) = '%s'" % (len(buf),) )
 #    print("ptr = '%s'" % (ptr,) )
 #    print("buf = '%s'" % (buf,) )
+    pages.clear()
     gdb.selected_inferior().write_memory( ptr, buf )
 
 
@@ -542,7 +914,7 @@ def memset( ptr, val, size ):
 class memory_region:
 
 
-    def __init__(self,start,end,section,file):
+    def __init__(self,start,end,section,file,perms = None):
         self.start = start
         self.end = end
         self.section = section
@@ -556,8 +928,15 @@ class memory_region:
         self.procline = None
         self.maintline = None
         self.fileline = None
+        # ordinary memory, reading around what was asked for has no side effects
+        self.normal = False
         if( self.size > 0 ):
-            self._test_access()
+            if( perms is None ):
+                self._test_access()
+            else:
+                # known from /proc/<pid>/maps, no need to ask the target
+                self.can_read = ( perms[0] == "r" )
+                self.can_write = ( perms[1] == "w" )
             if( self.can_write and self.can_read ):
                 self.atype = access_type.ACCESS_RW
             elif( self.can_read ):
@@ -652,6 +1031,182 @@ def thread_print( thr ):
         return thr
     return f"{thr.num} LWP {thr.ptid} '{thr.name}'"
 
+use_proc_maps = vdb.config.parameter("vdb-memory-proc-maps", True )
+
+# The parsed output of "info files" and "maint info sections" and the access bits tested for their sections, they only
+# change when objfiles come and go (or get relocated by running)
+section_cache = {}
+
+@vdb.event.new_objfile()
+@vdb.event.free_objfile()
+@vdb.event.clear_objfiles()
+def reset_section_cache( _ = None ):
+    section_cache.clear()
+
+# ( start, end, section, file, line ) for every section of "info files"
+def file_sections( ):
+    ret = section_cache.get("files")
+    if( ret is not None ):
+        return ret
+    ret = []
+    info_files = gdb.execute("info files",False,True)
+    fre = re.compile("(0x[0-9a-fA-F]*) - (0x[0-9a-fA-F]*) is (.*?)(?: in (.*))?$")
+    for info in info_files.splitlines():
+        info=info.strip()
+        m = fre.match(info)
+        if( m ):
+            start=int(m.group(1),16)
+            end=int(m.group(2),16)
+            section=m.group(3)
+            file=m.group(4)
+            size=end-start
+            if( ignore_empty.value and size == 0 ):
+                continue
+            ret.append( ( start, end, section, file, info ) )
+    section_cache["files"] = ret
+    return ret
+
+# The memory_region of a section of "info files" or "maint info sections". Its memory is only accessed to test the
+# access bits the first time, then they are kept in section_cache with the sections.
+def section_region( start, end, section, file ):
+    access = section_cache.setdefault("access",{})
+    perms = access.get( ( start, end ) )
+    ret = memory_region( start, end, section, file, perms )
+    if( perms is None ):
+        access[ ( start, end ) ] = ( "r" if ret.can_read else "-" ) + ( "w" if ret.can_write else "-" )
+    return ret
+
+# ( start, end, section, flags, line ) for every section of "maint info sections ALLOBJ"
+def maint_sections( ):
+    ret = section_cache.get("maint")
+    if( ret is not None ):
+        return ret
+    ret = []
+    maint = gdb.execute("maint info sections ALLOBJ",False,True)
+    sre = re.compile(".*(0x[0-9a-fA-F]*)->(0x[0-9a-fA-F]*)\s*at\s*(0x[0-9a-fA-F]*):\s*(.*?)\s\s*(.*)")
+    for sec in maint.splitlines():
+        sec = sec.strip()
+        m = sre.match(sec)
+        if( m ):
+            start = int(m.group(1),16)
+            # Those are registers and all kinds of other stuff
+            if( start == 0 ):
+                continue
+            end = int(m.group(2),16)
+            section = m.group(4)
+            rest = m.group(5)
+            rest = set( rest.split() )
+            size = end-start
+            if( ignore_empty.value and size == 0 ):
+                continue
+            ret.append( ( start, end, section, rest, sec ) )
+    section_cache["maint"] = ret
+    return ret
+
+# The pid of the inferior if it runs on this machine so that we can look into its /proc directly
+def native_pid( ):
+    if( not use_proc_maps.value ):
+        return None
+    inf = gdb.selected_inferior()
+    if( inf.pid <= 0 ):
+        return None
+    # Older gdb versions can't tell us, then better don't guess
+    conn = getattr(inf,"connection",None)
+    if( conn is None or conn.type != "native" ):
+        return None
+    return inf.pid
+
+# ( start, end, file, perms, line ) for every line of /proc/<pid>/maps, None if that can't be read
+def proc_mappings( pid ):
+    ret = []
+    try:
+        with open(f"/proc/{pid}/maps") as f:
+            for mapping in f:
+                mapping = mapping.strip()
+                parts = mapping.split(maxsplit=5)
+                if( len(parts) < 5 ):
+                    continue
+                start,_,end = parts[0].partition("-")
+                file = parts[5] if len(parts) > 5 else ""
+                ret.append( ( int(start,16), int(end,16), file, parts[1], mapping ) )
+    except (OSError,ValueError):
+        return None
+    return ret
+
+# The same from "info proc mapping", which works for remote targets too but has no permissions (in all versions)
+def info_proc_mappings( ):
+    ret = []
+    info_proc_mapping = gdb.execute("info proc mapping",False,True)
+    mre = re.compile("(0x[0-9a-fA-F]*)\s*(0x[0-9a-fA-F]*)\s*(0x[0-9a-fA-F]*)\s*(0x[0-9a-fA-F]*)\s*(.*)")
+    for mapping in info_proc_mapping.splitlines():
+        mapping=mapping.strip()
+        m = mre.match(mapping)
+#            print("mapping = '%s'" % mapping )
+#            print("m = '%s'" % m )
+        if( m ):
+            start=int(m.group(1),16)
+            end=int(m.group(2),16)
+            file=m.group(5)
+            ret.append( ( start, end, file, None, mapping ) )
+    return ret
+
+# The stack pointer of a stopped thread as the kernel shows it in /proc/<pid>/task/<lwp>/syscall. That is "running" for
+# running threads and otherwise ends with the stack and instruction pointer. This is what the kernel saved when the thread
+# stopped, not what gdb has in its register cache, which is what "set $sp" and inferior calls change. So it is only used
+# for the threads that are not selected, assuming nobody changed their registers from within gdb.
+def proc_stack_pointer( pid, lwp ):
+    try:
+        with open(f"/proc/{pid}/task/{lwp}/syscall") as f:
+            fields = f.read().split()
+        if( len(fields) < 3 ):
+            return None
+        return int(fields[-2],16)
+    except (OSError,ValueError):
+        return None
+
+# ( thread, sp ) for all threads. Natively we get them from /proc, only the threads for which that does not work are
+# switched to to read their sp register. The sp of the selected thread always comes from gdb, it may differ from what
+# the kernel saved (after "set $sp" or while an inferior call is set up).
+def thread_stack_pointers( ):
+    ret = []
+    selected_thread = gdb.selected_thread()
+    if( selected_thread is None ):
+        return ret
+    pid = native_pid()
+    remaining = []
+    for thread in gdb.selected_inferior().threads():
+        sp = None
+        if( pid is not None and thread.ptid != selected_thread.ptid ):
+            sp = proc_stack_pointer( pid, thread.ptid[1] )
+        if( sp is None ):
+            remaining.append(thread)
+        else:
+            ret.append( ( thread, sp ) )
+    if( len(remaining) == 0 ):
+        return ret
+
+    selected_frame = None
+    try:
+        # check if any is a stack
+        selected_frame = gdb.selected_frame()
+        for thread in remaining:
+            thread.switch()
+            f = gdb.newest_frame()
+            sp = f.read_register("sp")
+            ret.append( ( thread, int(sp) ) )
+    except gdb.error:
+#        vdb.print_exc()
+        pass
+    finally:
+        try:
+            # may not run anymore
+            selected_thread.switch()
+        except:
+            pass
+        if( selected_frame is not None ):
+            selected_frame.select()
+    return ret
+
 class memory_map:
 
     def __init__( self ):
@@ -659,6 +1214,8 @@ class memory_map:
         self.parsed_version = 0
         self.needed_version = 1
         self.unknown = memory_region(0,0,None,None)
+        self.timings = []
+        self.last_normal = None
 
     def lazy_parse( self ):
         if( self.needed_version > self.parsed_version ):
@@ -680,6 +1237,27 @@ class memory_map:
         return None
 
 
+    # The ( start, end ) of the biggest region around addr that is known to be ordinary memory, that is a readable
+    # mapping of /proc/<pid>/maps (or info proc mapping) that is not a device, or a readable section of a loaded file.
+    # None if there is no such region, then we know nothing about what reading there does.
+    def normal_span( self, addr ):
+        span = self.last_normal
+        if( span is not None and span[0] <= addr < span[1] and self.needed_version == self.parsed_version ):
+            return span
+        try:
+            self.lazy_parse()
+        except gdb.error:
+            return None
+        ret = None
+        for iv in self.regions[addr]:
+            mm = iv.data
+            if( mm.normal and mm.start <= addr < mm.end ):
+                if( ret is None or mm.end - mm.start > ret[1] - ret[0] ):
+                    ret = ( mm.start, mm.end )
+        if( ret is not None ):
+            self.last_normal = ret
+        return ret
+
     def find( self, addr, mm = None ):
 #        print(f"find(0x{addr:x})")
         if( mm is not None ):
@@ -860,137 +1438,104 @@ class memory_map:
         self.regions[mm.start:mm.end+1] = mm
 
     def parse( self ):
+        # section() and find() below would otherwise start another parse from within this one
+        self.parsed_version = self.needed_version
         self.regions.clear()
-
-        info_files = gdb.execute("info files",False,True)
-        fre = re.compile("(0x[0-9a-fA-F]*) - (0x[0-9a-fA-F]*) is (.*?)(?: in (.*))?$")
-        for info in info_files.splitlines():
-            info=info.strip()
-            m = fre.match(info)
-            if( m ):
-                start=int(m.group(1),16)
-                end=int(m.group(2),16)
-                section=m.group(3)
-                file=m.group(4)
-                size=end-start
-                if( ignore_empty.value and size == 0 ):
-                    continue
-                mr = memory_region( start, end, section, file )
-                mr.fileline = info
-                self.add_region( mr )
+        self.last_normal = None
+        self.timings = []
+        # Cached means neither gdb nor the target are asked about the sections
+        files_cached = " (cached)" if "files" in section_cache and "access" in section_cache else ""
+        maint_cached = " (cached)" if "maint" in section_cache and "access" in section_cache else ""
+
+        t0 = time.time()
+        for start,end,section,file,info in file_sections():
+            mr = section_region( start, end, section, file )
+            mr.fileline = info
+            mr.normal = mr.can_read
+            self.add_region( mr )
         nullr = memory_region( 0, 0x1000, None, None )
         nullr.atype = access_type.ACCESS_INV
         nullr.mtype = memory_type.NULL
         self.add_region(nullr)
 #        self.regions.sort()
-        try:
-            info_proc_mapping = gdb.execute("info proc mapping",False,True)
-            mre = re.compile("(0x[0-9a-fA-F]*)\s*(0x[0-9a-fA-F]*)\s*(0x[0-9a-fA-F]*)\s*(0x[0-9a-fA-F]*)\s*(.*)")
-
+        t1 = time.time()
+        self.timings.append( ( "files" + files_cached, t1-t0 ) )
 
-            for mapping in info_proc_mapping.splitlines():
-                mapping=mapping.strip()
-                m = mre.match(mapping)
-#            print("mapping = '%s'" % mapping )
-#            print("m = '%s'" % m )
-                if( m ):
-                    start=int(m.group(1),16)
-                    end=int(m.group(2),16)
-                    file=m.group(5)
-                    mm = self.section(start,end)
-                    size = end-start
-                    if( ignore_empty.value and size == 0 ):
-                        continue
-                    if( mm is None ):
-                        mm = memory_region( start, end, None, file )
-                        self.add_region(mm)
-                    mm.procline = mapping
-                    if( len(file) > 0 and mm.file is None ):
-                        mm.file = file
-                    if( file.startswith("/SYSV00000000 (deleted)") ):
-                        mm.mtype = memory_type.SHM
-                    elif( file.endswith( "[stack]") ):
-                        mm.mtype = memory_type.FOREIGN_STACK
-                    elif( file.endswith( "[heap]") ):
-                        mm.mtype = memory_type.HEAP
-                    elif( file.endswith( "[vsyscall]") ):
-                        mm.mtype = memory_type.CODE
-                    elif( file.endswith( "[vdso]") ):
-                        mm.mtype = memory_type.CODE
-        except gdb.error as e:
-            print(e)
-
-#        self.regions += map_regions
-#        self.regions.sort()
-        maint_sections = gdb.execute("maint info sections ALLOBJ",False,True)
-        sre = re.compile(".*(0x[0-9a-fA-F]*)->(0x[0-9a-fA-F]*)\s*at\s*(0x[0-9a-fA-F]*):\s*(.*?)\s\s*(.*)")
-#        sec_regions = []
-        for sec in maint_sections.splitlines():
-            sec = sec.strip()
-            m = sre.match(sec)
-            if( m ):
-                start = int(m.group(1),16)
-                # Those are registers and all kinds of other stuff
-                if( start == 0 ):
-                    continue
-                end = int(m.group(2),16)
-                section = m.group(4)
-                rest = m.group(5)
-                rest = set( rest.split() )
+        source = "/proc"
+        try:
+            pid = native_pid()
+            mappings = None
+            if( pid is not None ):
+                mappings = proc_mappings(pid)
+            if( mappings is None ):
+                source = "info proc"
+                mappings = info_proc_mappings()
+
+            for start,end,file,perms,mapping in mappings:
+                mm = self.section(start,end)
                 size = end-start
                 if( ignore_empty.value and size == 0 ):
                     continue
-#                print(f"{start} {end} {section} {rest} {size}")
-                mm = self.section(start,end)
                 if( mm is None ):
-                    mm = memory_region( start, end, section, None )
+                    mm = memory_region( start, end, None, file, perms )
                     self.add_region(mm)
-                else:
-                    if( mm.section is not None and mm.section != section ):
-                        mm.section += f"[{section}]"
-                        print(f"Section mismatch, previous {mm.section}, new {section}")
-                mm.maintline = sec
-#                print("mm = '%s'" % mm )
-#                if( "LOAD" not in rest ):
-#                    print("LOAD mm.mtype = '%s'" % mm.mtype )
-                if( "CODE" in rest ):
-#                    print("CODE mm.mtype = '%s'" % mm.mtype )
-                    if( mm.atype is None and "READONLY" in rest ):
-                        mm.atype = access_type.ACCESS_EX
-                if( ( mm.atype is None or mm.atype == access_type.ACCESS_RW ) and "READONLY" in rest ):
-                    mm.atype = access_type.ACCESS_RO
-#                    mm.mtype = memory_type.HEAP
+                mm.procline = mapping
+                if( mm.can_read and not file.startswith("/dev/") and not file.startswith("[vvar") ):
+                    mm.normal = True
+                if( len(file) > 0 and mm.file is None ):
+                    mm.file = file
+                if( file.startswith("/SYSV00000000 (deleted)") ):
+                    mm.mtype = memory_type.SHM
+                elif( file.endswith( "[stack]") ):
+                    mm.mtype = memory_type.FOREIGN_STACK
+                elif( file.endswith( "[heap]") ):
+                    mm.mtype = memory_type.HEAP
+                elif( file.endswith( "[vsyscall]") ):
+                    mm.mtype = memory_type.CODE
+                elif( file.endswith( "[vdso]") ):
+                    mm.mtype = memory_type.CODE
+        except gdb.error as e:
+            print(e)
+        t2 = time.time()
+        self.timings.append( ( f"mappings ({source})", t2-t1 ) )
+
+#        self.regions += map_regions
+#        self.regions.sort()
+        for start,end,section,rest,sec in maint_sections():
+            mm = self.section(start,end)
+            if( mm is None ):
+                mm = section_region( start, end, section, None )
+                self.add_region(mm)
+            else:
+                if( mm.section is not None and mm.section != section ):
+                    mm.section += f"[{section}]"
+                    print(f"Section mismatch, previous {mm.section}, new {section}")
+            mm.maintline = sec
+#            print("mm = '%s'" % mm )
+#            if( "LOAD" not in rest ):
+#                print("LOAD mm.mtype = '%s'" % mm.mtype )
+            if( "CODE" in rest ):
+#                print("CODE mm.mtype = '%s'" % mm.mtype )
+                if( mm.atype is None and "READONLY" in rest ):
+                    mm.atype = access_type.ACCESS_EX
+            if( ( mm.atype is None or mm.atype == access_type.ACCESS_RW ) and "READONLY" in rest ):
+                mm.atype = access_type.ACCESS_RO
+#                mm.mtype = memory_type.HEAP
 #        print("sec_regions = '%s'" % sec_regions )
 #        self.regions += sec_regions
 #        self.regions.sort()
-        selected_thread = gdb.selected_thread()
-        if( selected_thread is None ):
-            return
-        selected_frame = None
-        try:
-            # check if any is a stack
-            selected_frame = gdb.selected_frame()
-            for thread in gdb.selected_inferior().threads():
-                thread.switch()
-                f = gdb.selected_frame()
-                sp = f.read_register("sp")
-#                mm = self.find(int(sp))
-                mms = self.regions[int(sp)]
-                for mm in mms:
-                    mm = mm[2]
-                    if( mm ):
-                        mm.mtype = memory_type.FOREIGN_STACK
-                        mm.thread = thread
-        except gdb.error:
-#            vdb.print_exc()
-            pass
-        finally:
-            try:
-                # may not run anymore
-                selected_thread.switch()
-            except:
-                pass
-            selected_frame.select()
+        t3 = time.time()
+        self.timings.append( ( "sections" + maint_cached, t3-t2 ) )
+
+        for thread,sp in thread_stack_pointers():
+            mms = self.regions[int(sp)]
+            for mm in mms:
+                mm = mm[2]
+                if( mm ):
+                    mm.mtype = memory_type.FOREIGN_STACK
+                    mm.thread = thread
+        t4 = time.time()
+        self.timings.append( ( "stacks", t4-t3 ) )
 
 
 # XXX This is basically the vmmap implementation, maybe we move parts of it there?
@@ -1038,6 +1583,8 @@ last_run_start = 0
 def run_start():
     global last_run_start
     last_run_start += 1
+    reset_symbol_index()
+    reset_section_cache()
 
 # might be a bottleneck for some situations
 @vdb.event.stop()
@@ -1049,10 +1596,231 @@ def maybe_refresh( _ ):
     t0 = time.time()
     mmap.parse()
     t1 = time.time()
-    print("Automatically refreshed memory map in %.4fs" % (t1-t0) )
+    details = ", ".join( f"{name} {t:.4f}s" for name,t in mmap.timings )
+    print("Automatically refreshed memory map in %.4fs (%s)" % (t1-t0,details) )
     last_refresh_at = last_run_start
 
 
+# ELF symbol types we can annotate memory with: NOTYPE, OBJECT, FUNC, COMMON and GNU_IFUNC
+elf_symbol_types = { 0, 1, 2, 5, 10 }
+
+# Reads the section addresses and the .symtab/.dynsym symbols of an ELF file. Returns ( { section : address }, [ (
+# value, size, name ) ] ) with the addresses as in the file. Raises ValueError for files that are not ELF.
+def read_elf_symbols( filename ):
+    with open(filename,"rb") as f:
+        ident = f.read(64)
+        if( len(ident) < 52 or ident[:4] != b"\x7fELF" ):
+            raise ValueError(f"{filename} is not an ELF file")
+        is64 = ( ident[4] == 2 )
+        e = "<" if ident[5] == 1 else ">"
+        if( is64 ):
+            shoff, = struct.unpack_from(f"{e}Q",ident,0x28)
+            shentsize,shnum,shstrndx = struct.unpack_from(f"{e}HHH",ident,0x3a)
+            shfmt = f"{e}IIQQQQIIQQ"
+        else:
+            shoff, = struct.unpack_from(f"{e}I",ident,0x20)
+            shentsize,shnum,shstrndx = struct.unpack_from(f"{e}HHH",ident,0x2e)
+            shfmt = f"{e}IIIIIIIIII"
+        if( shoff == 0 or shnum == 0 ):
+            return ( {}, [] )
+
+        f.seek(shoff)
+        shdata = f.read(shentsize*shnum)
+        headers = [ struct.unpack_from(shfmt,shdata,i*shentsize) for i in range(shnum) ]
+
+        def section_data( hdr ):
+            f.seek(hdr[4])
+            return f.read(hdr[5])
+
+        shstr = section_data( headers[shstrndx] )
+        sections = {}
+        for hdr in headers:
+            # SHF_ALLOC, the ones that end up in memory
+            if( hdr[2] & 2 ):
+                name = shstr[hdr[0]:shstr.find(b"\0",hdr[0])].decode("utf-8","replace")
+                sections[name] = hdr[3]
+
+        symbols = []
+        for hdr in headers:
+            # SHT_SYMTAB and SHT_DYNSYM
+            if( hdr[1] not in ( 2, 11 ) ):
+                continue
+            data = section_data(hdr)
+            strtab = section_data(headers[hdr[6]])
+            if( is64 ):
+                syms = ( (n,v,sz,i,sh) for n,i,_,sh,v,sz in struct.iter_unpack(f"{e}IBBHQQ",data[:len(data)//24*24]) )
+            else:
+                syms = struct.iter_unpack(f"{e}IIIBBH",data[:len(data)//16*16])
+                syms = ( (n,v,sz,i,sh) for n,v,sz,i,_,sh in syms )
+            for name,value,size,info,shndx in syms:
+                # undefined and absolute symbols don't tell us anything about memory
+                if( shndx == 0 or shndx == 0xfff1 or name == 0 or value == 0 ):
+                    continue
+                if( (info & 0xf) not in elf_symbol_types ):
+                    continue
+                symbols.append( ( value, size, strtab[name:strtab.find(b"\0",name)].decode("utf-8","replace") ) )
+        return ( sections, symbols )
+
+# Symbols of all objfiles, at their runtime addresses and sorted by start address so a lookup is a bisect. Built from the
+# ELF files themselves, the load bias of each is taken from the section addresses of "info files". Symbols without a
+# size cover a single byte. Of aliases with the same start address only the biggest is stored. When symbols are nested
+# the innermost one wins, parents[i] is the index of the symbol enclosing symbol i (or -1) so that lookups for addresses
+# behind the end of an inner symbol find the outer one.
+class symbol_index:
+    def __init__( self ):
+        self.starts = []
+        self.ends = []
+        self.names = []
+        self.parents = []
+        self.files = 0
+        self.demangled = {}
+
+    def build( self, elf_files ):
+        runtime = {}
+        fre = re.compile("(0x[0-9a-fA-F]*) - (0x[0-9a-fA-F]*) is (.*?)(?: in (.*))?$")
+        main = gdb.current_progspace().filename
+        for info in gdb.execute("info files",False,True).splitlines():
+            m = fre.match(info.strip())
+            if( m ):
+                fn = m.group(4) or main
+                runtime.setdefault(fn,[]).append( ( int(m.group(1),16), int(m.group(2),16), m.group(3) ) )
+
+        symbols = {}
+        for fn,secs in runtime.items():
+            ef = elf_files.get(fn)
+            if( ef is None ):
+                continue
+            sections,syms = ef
+            bias = None
+            for start,end,name in secs:
+                if( name in sections ):
+                    bias = start - sections[name]
+                    break
+            if( bias is None ):
+                continue
+            self.files += 1
+            for value,size,name in syms:
+                start = value + bias
+                if( symbols.get(start,(0,))[0] < max(size,1) ):
+                    symbols[start] = ( max(size,1), name )
+
+        enclosing = []
+        for start in sorted(symbols):
+            size,name = symbols[start]
+            while( len(enclosing) and self.ends[enclosing[-1]] <= start ):
+                enclosing.pop()
+            self.parents.append( enclosing[-1] if len(enclosing) else -1 )
+            enclosing.append( len(self.starts) )
+            self.starts.append(start)
+            self.ends.append(start+size)
+            self.names.append(name)
+
+    def name( self, i ):
+        name = self.names[i]
+        if( name.startswith("_Z") ):
+            dname = self.demangled.get(name)
+            if( dname is None ):
+                try:
+                    dname = gdb.execute(f"demangle -l c++ -- {name}",False,True).strip()
+                except gdb.error:
+                    dname = name
+                self.demangled[name] = dname
+            name = dname
+        return name
+
+    # ( start, size, name ) of the symbol at addr or ( None, None, None )
+    def lookup( self, addr ):
+        i = bisect.bisect_right(self.starts,addr)-1
+        while( i >= 0 and addr >= self.ends[i] ):
+            i = self.parents[i]
+        if( i >= 0 ):
+            return ( self.starts[i], self.ends[i]-self.starts[i], self.name(i) )
+        return ( None, None, None )
+
+    # All symbols overlapping [start,end] as ( start, size, name )
+    def overlapping( self, start, end ):
+        ret = []
+        i = bisect.bisect_right(self.starts,start)-1
+        j = i
+        while( j >= 0 ):
+            if( self.ends[j] > start ):
+                ret.append( ( self.starts[j], self.ends[j]-self.starts[j], self.name(j) ) )
+            j = self.parents[j]
+        i += 1
+        while( i < len(self.starts) and self.starts[i] <= end ):
+            ret.append( ( self.starts[i], self.ends[i]-self.starts[i], self.name(i) ) )
+            i += 1
+        return ret
+
+use_symbol_index = vdb.config.parameter("vdb-memory-symbol-index", True )
+
+# filename => ( ( size, mtime ), ( sections, symbols ) ), survives re-runs, the ELF files rarely change
+elf_cache = {}
+current_symbol_index = None
+
+@vdb.event.new_objfile()
+@vdb.event.free_objfile()
+@vdb.event.clear_objfiles()
+def reset_symbol_index( _ = None ):
+    global current_symbol_index
+    current_symbol_index = None
+
+def load_elf( filename ):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    stamp = ( st.st_size, st.st_mtime_ns )
+    ent = elf_cache.get(filename)
+    if( ent is None or ent[0] != stamp ):
+        try:
+            ent = ( stamp, read_elf_symbols(filename) )
+        except (OSError,ValueError,struct.error) as e:
+            vdb.log(f"Could not read symbols of {filename}: {e}",level=3)
+            ent = ( stamp, None )
+        elf_cache[filename] = ent
+    return ent[1]
+
+def get_symbol_index( ):
+    global current_symbol_index
+    if( current_symbol_index is None ):
+        t0 = time.time()
+        elf_files = {}
+        debug_files = {}
+        for objfile in gdb.objfiles():
+            fn = objfile.filename
+            if( fn is None ):
+                continue
+            # Separate debug info (e.g. in /usr/lib/debug) has the .symtab that is stripped from the file it belongs to,
+            # its symbols are at the same addresses as those of its owner
+            if( objfile.owner is not None ):
+                if( objfile.owner.filename is not None ):
+                    debug_files.setdefault(objfile.owner.filename,[]).append(fn)
+                continue
+            ef = load_elf(fn)
+            if( ef is not None ):
+                elf_files[fn] = ef
+        for fn,dfns in debug_files.items():
+            ef = elf_files.get(fn)
+            if( ef is None ):
+                continue
+            sections,syms = ef
+            syms = list(syms)
+            for dfn in dfns:
+                df = load_elf(dfn)
+                if( df is not None ):
+                    syms += df[1]
+            elf_files[fn] = ( sections, syms )
+        idx = symbol_index()
+        try:
+            idx.build( elf_files )
+        except gdb.error:
+            vdb.print_exc()
+        current_symbol_index = idx
+        t1 = time.time()
+        vdb.log(f"Indexed {len(idx.starts)} symbols of {idx.files} objfiles in {t1-t0:.4f}s",level=3)
+    return current_symbol_index
+
 sym_cache = intervaltree.IntervalTree()
 
 symre=re.compile("0x[0-9a-fA-F]* <([^+]*)(\+[0-9]*)*>")
@@ -1075,6 +1843,15 @@ def get_gdb_sym( addr ):
     addr = int(addr)
     if( addr < 2 ): # sometimes garbage collected symbols debug information gets just mapped to 0 instead of removed
         return (None,None,None)
+    if( use_symbol_index.value ):
+        idx = get_symbol_index()
+        if( idx.files > 0 ):
+            return idx.lookup(addr)
+    return probe_gdb_sym(addr)
+
+# The old way to find a symbol by asking gdb about the addresses around it, for when there are no ELF files to read the
+# symbols from
+def probe_gdb_sym( addr ):
     global sym_cache
     xs = sym_cache[addr]
     if( len(xs) > 0 ):
@@ -1134,6 +1911,13 @@ def get_symbols( addr, xlen ):
 #    print(f"{str(addr)=}")
 #    print(f"{str(xlen)=}")
     ret = intervaltree.IntervalTree()
+    if( use_symbol_index.value ):
+        idx = get_symbol_index()
+        if( idx.files > 0 ):
+            for start,size,name in idx.overlapping(int(addr),int(addr)+xlen):
+                ret[start:start+size] = name
+            return ret
+
     xaddr = addr+xlen
 
     recnt = 0
@@ -395,7 +395,7 @@ def hint( argv ):
 #    for i in range(-8,64):
     for i in range(range_start,range_stop):
         pos = f"{stack_base}+({vptype.sizeof}*{i})"
-        mem=vdb.memory.read(pos,vptype.sizeof)
+        mem=vdb.memory.read(pos,vptype.sizeof,consumer="unwind")
         val=gdb.Value(mem,vptype)
 
         at = vdb.memory.mmap.get_atype(val)
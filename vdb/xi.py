@@ -10,6 +10,7 @@ import vdb.pointer
 import vdb.event
 import vdb.register
 import vdb.asm
+import vdb.cache
 
 from itertools import chain
 
@@ -19,6 +20,11 @@ import traceback
 import time
 import datetime
 import re
+import array
+import bisect
+import os
+import pickle
+import zlib
 
 from typing import List
 
@@ -30,25 +36,213 @@ silence = vdb.config.parameter("vdb-xi-silence", True )
 location = vdb.config.parameter("vdb-xi-location", False )
 show_frame = vdb.config.parameter("vdb-xi-frame",False )
 
-# Support showspec like the registers command
-def diff_regs( r0, r1 ):
+vectors = vdb.config.parameter("vdb-xi-vectors", False )
+
+# Which registers we look at after each step. Building a full vdb.register.Registers walks all register groups and
+# reads every register including all the vector ones, so we do that only once per architecture and from then on just
+# read the registers it classified as general purpose and flags (and the vector/fpu ones if enabled)
+class register_layout:
+
+    def __init__( self, registers, with_vectors ):
+        self.descriptors = list(registers.regs.keys())
+        self.flags = list(registers.rflags.keys())
+        self.descriptors += self.flags
+        self.nvectors = 0
+        if( with_vectors ):
+            vecs = list(registers.vecs.keys()) + list(registers.fpus.keys())
+            self.nvectors = len(vecs)
+            self.descriptors += vecs
+        self.names = [ d.name for d in self.descriptors ]
+        self.index = { n : i for i,n in enumerate(self.names) }
+        self.flag_names = set( d.name for d in self.flags )
+        self.flag_types = { d.name : registers.rflags[d][1] for d in self.flags }
+
+    def read( self, frame ):
+        return register_snapshot( self, self.read_values(frame) )
+
+    def read_values( self, frame ):
+        ret = []
+        nints = len(self.descriptors) - self.nvectors
+        for ix,d in enumerate(self.descriptors):
+            v = frame.read_register(d)
+            if( ix < nints ):
+                ret.append( int(v) )
+            else:
+                try:
+                    ret.append( int.from_bytes(v.bytes,"little") )
+                except AttributeError: # older gdb without Value.bytes
+                    ret.append( str(v) )
+        return ret
+
+    # Like the mini format of the registers command, the way gdb itself shows the flags
+    def flag_string( self, name, value ):
+        ft = self.flag_types.get(name,None)
+        if( ft is None or not isinstance(value,int) ):
+            return None
+        try:
+            return str( gdb.Value(value).cast(ft) )
+        except gdb.error:
+            return None
+
+# ( architecture name, vectors ) => register_layout
+register_layouts = {}
+
+def get_layout( registers ):
+    key = ( registers.frame.architecture().name(), vectors.value )
+    ret = register_layouts.get(key,None)
+    if( ret is None ):
+        ret = register_layout( registers, vectors.value )
+        register_layouts[key] = ret
+    return ret
+
+# The register values after one step as a flat list in the order of the layout
+class register_snapshot:
+    __slots__ = ( "layout", "values" )
+
+    def __init__( self, layout, values ):
+        self.layout = layout
+        self.values = values
+
+    # same interface as vdb.register.Registers so the asm flow can fill itself from it
+    def get_value( self, name ):
+        ix = self.layout.index.get(str(name),None)
+        if( ix is None ):
+            return None
+        return ( self.values[ix], None )
+
+    def items( self ):
+        return zip(self.layout.names,self.values)
+
+def diff_regs( r0, r1, pcname ):
     ret = {}
-    for rname,rval0 in chain(r0.regs.items(),r0.rflags.items()):
-        rval1 = r1.get_value(rname)
-#        if( rval0 is None or rval1 is None ):
-#            print(f"diff_regs has no value for {rname} in both frames: {rval0=}, {rval1=}")
-#            continue
-#        print(f"{str(rname)=}")
-#        print(f"{rval1=}")
-        rval0 = int(rval0[0])
-        rval1 = int(rval1[0])
-        if( rval0 != rval1 ):
-            # XXX Make this arch independent
-            if( str(rname) != "rip" ):
-                ret[str(rname)] = rval1
-#                print(f"{rname} => {rval1}")
+    names = r1.layout.names
+    v0 = r0.values
+    v1 = r1.values
+    for ix in range(0,len(v1)):
+        if( v0[ix] != v1[ix] ):
+            if( names[ix] != pcname ):
+                ret[names[ix]] = v1[ix]
     return ret
 
+ring_size = vdb.config.parameter("vdb-xi-ring-size", 1000000 )
+record_memory = vdb.config.parameter("vdb-xi-record-memory", True )
+
+# Every that many steps the ring keeps a full copy of the registers, so getting the registers of any step only needs
+# to replay a few deltas
+checkpoint_interval = 256
+
+class xi_ring:
+    """
+    What xi/r records, the pc and the changed registers (as flat index,value tuple in the order of the layout) per step
+    in a ring of fixed size that drops the oldest steps when full. Steps are numbered from the start of the recording,
+    things that only some steps have (memory, mmapped registers) are kept by that number on the side
+    """
+
+    def __init__( self, layout, values, size ):
+        self.layout = layout
+        self.size = max(size,1)
+        self.pcs = array.array("Q")
+        self.deltas = []
+        self.first = 0
+        self.end = 0
+        self.base = list(values)
+        self.last = list(values)
+        self.checkpoints = {}
+        self.memory = {}
+        self.mmaps = {}
+        self.frames = {}
+        self.missing = set()
+
+    def add( self, pc, delta ):
+        if( self.end - self.first == self.size ):
+            self.drop()
+        if( self.end % checkpoint_interval == 0 ):
+            self.checkpoints[self.end] = list(self.last)
+        if( len(self.pcs) < self.size ):
+            self.pcs.append(pc)
+            self.deltas.append(delta)
+        else:
+            slot = self.end % self.size
+            self.pcs[slot] = pc
+            self.deltas[slot] = delta
+        last = self.last
+        for i in range(0,len(delta),2):
+            last[delta[i]] = delta[i+1]
+        self.end += 1
+        return self.end - 1
+
+    def drop( self ):
+        delta = self.deltas[self.first % self.size]
+        for i in range(0,len(delta),2):
+            self.base[delta[i]] = delta[i+1]
+        self.checkpoints.pop(self.first,None)
+        self.memory.pop(self.first,None)
+        self.mmaps.pop(self.first,None)
+        self.frames.pop(self.first,None)
+        self.missing.discard(self.first)
+        self.first += 1
+
+    def __len__( self ):
+        return self.end - self.first
+
+    def __getitem__( self, ix ):
+        if( ix < 0 ):
+            ix += len(self)
+        if( ix < 0 or ix >= len(self) ):
+            raise IndexError(f"xi ring index {ix} out of range")
+        return recorded_state( self, self.first + ix )
+
+    def __iter__( self ):
+        for step in range(self.first,self.end):
+            yield recorded_state( self, step )
+
+    def pc( self, step ):
+        return self.pcs[step % self.size]
+
+    def delta( self, step ):
+        return self.deltas[step % self.size]
+
+    def values( self, step ):
+        """The register values after step"""
+        cp = step - step % checkpoint_interval
+        if( cp < self.first ):
+            cp = self.first
+            ret = list(self.base)
+        else:
+            ret = list(self.checkpoints[cp])
+        for st in range(cp,step+1):
+            delta = self.delta(st)
+            for i in range(0,len(delta),2):
+                ret[delta[i]] = delta[i+1]
+        return ret
+
+# One step of a recording, created when it is needed for output
+class recorded_state:
+
+    def __init__( self, ring, step ):
+        self.ring = ring
+        self.step = step
+        self.pc = ( ring.pc(step), None )
+        self.asm_string = None
+        self.instruction = None
+        self.current_flags = None
+        self.executed = step not in ring.missing
+        self.frameno = ring.frames.get(step,None)
+        self.time = 0
+        self.si_time = None
+        self.changed_memory = ring.memory.get(step,[])
+        self.mmap_registers = ring.mmaps.get(step,{})
+
+    @property
+    def changed_registers( self ):
+        names = self.ring.layout.names
+        delta = self.ring.delta(self.step)
+        return { names[delta[i]] : delta[i+1] for i in range(0,len(delta),2) }
+
+    @property
+    def final_registers( self ):
+        return register_snapshot( self.ring.layout, self.ring.values(self.step) )
+
 def diff_mmaps( r0, r1 ):
     ret = {}
     for rname,rval0 in r0.items():
@@ -101,40 +295,91 @@ class instruction_state:
 
 
 
-def get_mmaps( mmaps, filter ):
-    if( filter is None ):
-        print(f"Reading {len(mmaps)} values...")
-    else:
-        print(f"Reading up to {len(mmaps)} values...",end="")
+# ( id(mmaps), len(mmaps), filter ) and the registers that pass the filter sorted by address
+mmap_selection = ( None, [] )
+
+def select_mmaps( mmaps, filter ):
+    global mmap_selection
+    key = ( id(mmaps), len(mmaps), filter )
+    if( mmap_selection[0] == key ):
+        return mmap_selection[1]
     if( filter is not None ):
         filter = re.compile(filter)
-    ret = {}
+    ret = []
     for reg,rpos in mmaps.items():
         if( filter is not None ):
             if( filter.search(reg) is None ):
                 continue
         rname,raddr,rbit,rtype = rpos
+        ret.append( ( raddr, (rbit or 0)//8, reg, rtype ) )
+    ret.sort( key = lambda r : r[0] )
+    mmap_selection = ( key, ret )
+    return ret
 
-        if( vdb.register.is_blacklisted( raddr ) ):
+def mmap_ranges( regs ):
+    """
+    Groups the registers (sorted by address) into ranges of adjacent or overlapping ones, never includes bytes that
+    don't belong to any register since reading those could fault or have side effects
+    """
+    ret = []
+    for r in regs:
+        raddr,rsize,_,_ = r
+        if( rsize == 0 ):
             continue
+        if( len(ret) > 0 and raddr <= ret[-1][1] ):
+            rng = ret[-1]
+            rng[1] = max(rng[1],raddr+rsize)
+            rng[2].append(r)
+        else:
+            ret.append( [ raddr, raddr+rsize, [ r ] ] )
+    return ret
+
+def target_byteorder( ):
+    one = gdb.Value( b"\1\0", vdb.arch.uint(16) )
+    if( int(one) == 1 ):
+        return "little"
+    return "big"
 
-        val = vdb.memory.read_uncached(raddr,rbit//8)
-        if( val is not None ):
-            val = gdb.Value(val,rtype)
-            ret[reg] = int(val)
+def get_mmaps( mmaps, filter ):
+    if( filter is None ):
+        print(f"Reading {len(mmaps)} values...")
+    else:
+        print(f"Reading up to {len(mmaps)} values...",end="")
+    regs = select_mmaps( mmaps, filter )
+    regs = [ r for r in regs if not vdb.register.is_blacklisted( r[0] ) ]
+    byteorder = target_byteorder()
+    ret = {}
+    for start,end,members in mmap_ranges(regs):
+        data = vdb.memory.read_uncached(start,end-start)
+        if( isinstance(data,memoryview) ):
+            data = data.tobytes()
+            for raddr,rsize,reg,_ in members:
+                ofs = raddr - start
+                ret[reg] = int.from_bytes( data[ofs:ofs+rsize], byteorder )
+        else:
+            # Not readable as a whole or overlayed, go through them one by one
+            for raddr,rsize,reg,rtype in members:
+                val = vdb.memory.read_uncached(raddr,rsize)
+                if( val is not None ):
+                    val = gdb.Value(val,rtype)
+                    ret[reg] = int(val)
     if( filter is not None ):
         print(f" {len(ret)} matches")
     return ret
 
 
 breakpoint_hit = False
+signal_hit = False
 # XXX For performance reasons register this only during the xi run
 @vdb.event.stop()
 def bp_stop( bpev ):
     global breakpoint_hit
+    global signal_hit
     if( isinstance( bpev, gdb.BreakpointEvent ) ):
 #        print(f"{breakpoint_hit=} => True")
         breakpoint_hit = True
+    elif( isinstance( bpev, gdb.SignalEvent ) and bpev.stop_signal != "SIGTRAP" ):
+        signal_hit = True
 #    print(f"{bpev=}")
 
 # ID, Data
@@ -142,10 +387,18 @@ xi_db = {}
 
 class xi_listing:
 
-    def __init__( self ):
-        self.id = vdb.util.next_id("xi")
+    def __init__( self, ring = None, xid = None ):
+        if( xid is None ):
+            xid = vdb.util.next_id("xi")
+        self.id = xid
         self.time = time.time()
         self.listing = []
+        self.layout = None
+        # registers before the first step
+        self.base = None
+        if( ring is not None ):
+            self.listing = ring
+            self.layout = ring.layout
         self.minframe = 4096
 
     def add( self, xi ):
@@ -160,10 +413,7 @@ class xi_listing:
         return (beg,end)
 
     def get_history( self ):
-        xi_history = {}
-        for ix,i in enumerate(self.listing):
-            xi_history.setdefault(int(i.pc[0]),[]).append( (ix,i) )
-        return xi_history
+        return step_history(self.listing)
 
     def as_table( self ):
         otbl = []
@@ -220,11 +470,16 @@ class xi_listing:
             for cr,cv in i.changed_registers.items():
                 if( cr == pcname ):
                     continue
-                if( cr == "eflags" ):
+                if( cr == "eflags" and i.current_flags is not None ):
                     ff=i.current_flags
                     ff=ff[0][2]
 #                ff= self._flags( filter, self.rflags, flag_info, extended, short, mini, None )
                     line.append(f"eflags={ff}")
+                elif( self.layout is not None and ( ff := self.layout.flag_string(cr,cv) ) is not None ):
+                    # Recorded, the flags are only decoded now
+                    line.append(f"{cr}={ff}")
+                elif( not isinstance(cv,int) ):
+                    line.append(f"{cr}={cv}")
                 else:
                     # XXX Make this depend on the type
                     if( cv < 0 ):
@@ -250,12 +505,414 @@ class xi_listing:
 
 
 
+class history_steps:
+    """
+    The steps of a recording at one address, iterating gives ( index, state ) with the states only created then
+    """
+
+    def __init__( self, listing, steps ):
+        self.listing = listing
+        self.steps = steps
+
+    def __len__( self ):
+        return len(self.steps)
+
+    def __iter__( self ):
+        for ix in self.steps:
+            yield ( ix, self.listing[ix] )
+
+class step_history:
+    """
+    What vdb.asm.xi_history needs, which steps of a recording were at which address. Only the indices of the steps are
+    kept, for a recording from xi/r or on disk the steps are only looked at (and decoded, chunk by chunk) when the asm
+    module asks for the ones of an address. For a recording on disk even the addresses of a chunk are only decoded once
+    an address within its range is asked for
+    """
+
+    def __init__( self, listing ):
+        self.listing = listing
+        self.steps = {}
+        # chunks of a recording on disk whose addresses are not in steps yet
+        self.pending = []
+        if( isinstance(listing,xi_file) ):
+            self.pending = list(range(0,len(listing.chunks)))
+        elif( isinstance(listing,xi_ring) ):
+            for ix in range(0,len(listing)):
+                self.add( listing.pc(listing.first+ix), ix )
+        else:
+            for ix,i in enumerate(listing):
+                self.add( int(i.pc[0]), ix )
+
+    def add( self, pc, ix ):
+        steps = self.steps.get(pc,None)
+        if( steps is None ):
+            steps = array.array("Q")
+            self.steps[pc] = steps
+        steps.append(ix)
+
+    def load( self, pc ):
+        pending = []
+        loaded = set()
+        for cix in self.pending:
+            _,start,_,_,lo,hi = self.listing.chunks[cix]
+            if( lo <= pc <= hi ):
+                for ix,cpc in enumerate(self.listing.pcs(cix)):
+                    self.add( cpc, start+ix )
+                    loaded.add(cpc)
+            else:
+                pending.append(cix)
+        self.pending = pending
+        # chunks get loaded out of order, keep the steps of each address in order
+        for cpc in loaded:
+            self.steps[cpc] = array.array("Q",sorted(self.steps[cpc]))
+
+    def get( self, pc, default = None ):
+        if( len(self.pending) > 0 ):
+            self.load(pc)
+        steps = self.steps.get(pc,None)
+        if( steps is None ):
+            return default
+        return history_steps( self.listing, steps )
+
+store = vdb.config.parameter("vdb-xi-store", True )
+store_threshold = vdb.config.parameter("vdb-xi-store-threshold", 1000 )
+store_bytes = vdb.config.parameter("vdb-xi-store-bytes", 128*1024*1024 )
+
+# On disk a recording is split into chunks of that many steps. Each chunk has the registers before its first step, the
+# pc column and per register one column of the steps (within the chunk) where it changed and one of the new values,
+# everything else like memory is kept in side tables. Each chunk is compressed as a whole.
+store_chunk_size = 4096
+store_magic = b"VDBXI\0\0\1"
+store_version = 3
+
+def encode_column( values ):
+    for tc in ( "Q", "q" ):
+        try:
+            return ( tc, array.array(tc,values).tobytes() )
+        except ( OverflowError, TypeError ):
+            pass
+    return ( "p", list(values) )
+
+def decode_column( col ):
+    tc,data = col
+    if( tc == "p" ):
+        return data
+    ret = array.array(tc)
+    ret.frombytes(data)
+    return ret
+
+class chunk_writer:
+
+    def __init__( self, f, nregs ):
+        self.f = f
+        self.nregs = nregs
+        self.chunks = []
+        self.start = 0
+        self.reset(None)
+
+    def reset( self, values ):
+        self.values = values
+        self.pcs = []
+        self.regs = {}
+        self.memory = {}
+        self.mmaps = {}
+        self.frames = {}
+        self.missing = []
+
+    def add( self, pc, delta, values_before, memory, mmaps, frameno, executed ):
+        if( len(self.pcs) == 0 ):
+            self.values = list(values_before)
+        step = len(self.pcs)
+        self.pcs.append(pc)
+        for i in range(0,len(delta),2):
+            steps,vals = self.regs.setdefault(delta[i],([],[]))
+            steps.append(step)
+            vals.append(delta[i+1])
+        if( memory ):
+            self.memory[step] = memory
+        if( mmaps ):
+            self.mmaps[step] = mmaps
+        if( frameno is not None ):
+            self.frames[step] = frameno
+        if( not executed ):
+            self.missing.append(step)
+        if( len(self.pcs) == store_chunk_size ):
+            self.flush()
+
+    def flush( self ):
+        if( len(self.pcs) == 0 ):
+            return
+        chunk = {
+                "values" : self.values,
+                "pcs" : encode_column(self.pcs),
+                "regs" : { r : ( encode_column(st), encode_column(va) ) for r,(st,va) in self.regs.items() },
+                "memory" : self.memory,
+                "mmaps" : self.mmaps,
+                "frames" : self.frames,
+                "missing" : self.missing,
+                }
+        data = zlib.compress( pickle.dumps(chunk) )
+        self.chunks.append( ( self.f.tell(), self.start, len(self.pcs), len(data), min(self.pcs), max(self.pcs) ) )
+        self.f.write( data )
+        self.start += len(self.pcs)
+        self.reset(None)
+
+def store_dir( ):
+    return vdb.cache.filename("xi")
+
+def save_listing( xilist ):
+    """
+    Writes the recording to the xi cache directory and returns the filename. The recording is either a ring from xi/r
+    or the list of instruction_state objects of a normal xi run
+    """
+    layout = xilist.layout
+    os.makedirs(store_dir(),exist_ok = True)
+    fn = os.path.join( store_dir(), f"{int(xilist.time*1000)}-{os.getpid()}-{xilist.id}.xi" )
+    tmpfn = fn + ".tmp"
+    with open(tmpfn,"wb") as f:
+        f.write(store_magic)
+        f.write(bytes(8))
+        wr = chunk_writer(f,len(layout.names))
+        if( isinstance(xilist.listing,xi_ring) ):
+            ring = xilist.listing
+            values = list(ring.base)
+            for step in range(ring.first,ring.end):
+                delta = ring.delta(step)
+                wr.add( ring.pc(step), delta, values, ring.memory.get(step,None), ring.mmaps.get(step,None), ring.frames.get(step,None), step not in ring.missing )
+                for i in range(0,len(delta),2):
+                    values[delta[i]] = delta[i+1]
+        else:
+            values = list(xilist.base)
+            for ist in xilist.listing:
+                delta = []
+                if( ist.executed ):
+                    for ix,v in enumerate(ist.final_registers.values):
+                        if( v != values[ix] ):
+                            delta.append(ix)
+                            delta.append(v)
+                wr.add( int(ist.pc[0]), delta, values, ist.changed_memory, ist.mmap_registers, ist.frameno, ist.executed )
+                for i in range(0,len(delta),2):
+                    values[delta[i]] = delta[i+1]
+        wr.flush()
+        first,last = (0,0)
+        if( len(xilist.listing) > 0 ):
+            first,last = xilist.addresses()
+        header = {
+                "version" : store_version,
+                "time" : xilist.time,
+                "names" : layout.names,
+                "flags" : sorted(layout.flag_names),
+                "count" : wr.start,
+                "addresses" : ( int(first), int(last) ),
+                "minframe" : xilist.minframe,
+                "chunks" : wr.chunks,
+                "program" : current_program(),
+                }
+        hpos = f.tell()
+        f.write( pickle.dumps(header) )
+        f.seek(len(store_magic))
+        f.write( hpos.to_bytes(8,"little") )
+    os.replace(tmpfn,fn)
+    return fn
+
+def current_program( ):
+    try:
+        return gdb.current_progspace().filename
+    except ( gdb.error, AttributeError ):
+        return None
+
+def read_header( fn ):
+    with open(fn,"rb") as f:
+        if( f.read(len(store_magic)) != store_magic ):
+            return None
+        hpos = int.from_bytes(f.read(8),"little")
+        f.seek(hpos)
+        header = pickle.load(f)
+    if( header.get("version") != store_version ):
+        return None
+    return header
+
+# The layout of a recording loaded from disk, the gdb types for decoding the flags are only looked up when needed
+class stored_layout:
+
+    def __init__( self, names, flags ):
+        self.names = names
+        self.index = { n : i for i,n in enumerate(self.names) }
+        self.flag_names = set(flags)
+        self.flag_types = None
+
+    def flag_string( self, name, value ):
+        if( name not in self.flag_names or not isinstance(value,int) ):
+            return None
+        if( self.flag_types is None ):
+            self.flag_types = {}
+            try:
+                frame = gdb.selected_frame()
+                for fn in self.flag_names:
+                    self.flag_types[fn] = frame.read_register(fn).type
+            except ( gdb.error, ValueError ):
+                pass
+        ft = self.flag_types.get(name,None)
+        if( ft is None ):
+            return None
+        try:
+            return str( gdb.Value(value).cast(ft) )
+        except gdb.error:
+            return None
+
+# ( filename, chunk index ) => the chunk decoded into an xi_ring, only a few are kept so that a recording on disk is
+# never decoded completely in memory
+chunk_cache = vdb.cache.lru_cache("xi_chunks", max_entries = 8)
+
+class xi_file:
+    """
+    A recording on disk, behaves like a list of the steps. Chunks are only decoded (into an xi_ring) when needed and
+    just a few of them are kept, so showing it streams through the file
+    """
+
+    def __init__( self, fn, header ):
+        self.filename = fn
+        self.header = header
+        self.layout = stored_layout( header["names"], header["flags"] )
+        self.chunks = header["chunks"]
+        self.starts = [ c[1] for c in self.chunks ]
+
+    def __len__( self ):
+        return self.header["count"]
+
+    def read_chunk( self, cix ):
+        offset,_,_,length,_,_ = self.chunks[cix]
+        with open(self.filename,"rb") as f:
+            f.seek(offset)
+            return pickle.loads( zlib.decompress( f.read(length) ) )
+
+    # Only the addresses of the steps of a chunk
+    def pcs( self, cix ):
+        ring = chunk_cache.get( ( self.filename, cix ) )
+        if( ring is not None ):
+            return ring.pcs
+        return decode_column( self.read_chunk(cix)["pcs"] )
+
+    def chunk( self, cix ):
+        key = ( self.filename, cix )
+        ring = chunk_cache.get(key)
+        if( ring is not None ):
+            return ring
+        count = self.chunks[cix][2]
+        chunk = self.read_chunk(cix)
+        ring = xi_ring( self.layout, chunk["values"], count )
+        pcs = decode_column(chunk["pcs"])
+        deltas = [ [] for _ in range(count) ]
+        for r,(st,va) in chunk["regs"].items():
+            for s,v in zip(decode_column(st),decode_column(va)):
+                deltas[s].append(r)
+                deltas[s].append(v)
+        for pc,delta in zip(pcs,deltas):
+            ring.add( pc, tuple(delta) )
+        ring.memory = chunk["memory"]
+        ring.mmaps = chunk["mmaps"]
+        ring.frames = chunk["frames"]
+        ring.missing = set(chunk["missing"])
+        chunk_cache[key] = ring
+        return ring
+
+    def __getitem__( self, ix ):
+        if( ix < 0 ):
+            ix += len(self)
+        if( ix < 0 or ix >= len(self) ):
+            raise IndexError(f"xi recording index {ix} out of range")
+        cix = bisect.bisect_right(self.starts,ix) - 1
+        return recorded_state( self.chunk(cix), ix - self.starts[cix] )
+
+    def __iter__( self ):
+        for cix in range(0,len(self.chunks)):
+            ring = self.chunk(cix)
+            for step in range(0,len(ring)):
+                yield recorded_state( ring, step )
+
+# xi recordings on disk that are already in xi_db
+stored_files = {}
+
+def load_stored( ):
+    """
+    Adds the recordings on disk that were made by this gdb or of the program currently loaded, the directory is shared
+    by all sessions
+    """
+    try:
+        files = sorted(os.listdir(store_dir()))
+    except FileNotFoundError:
+        return
+    pid = str(os.getpid())
+    program = current_program()
+    for bfn in files:
+        if( not bfn.endswith(".xi") ):
+            continue
+        fn = os.path.join(store_dir(),bfn)
+        if( fn in stored_files ):
+            continue
+        try:
+            header = read_header(fn)
+        except Exception as e:
+            vdb.log(f"Could not read xi recording {fn}: {e}",level=2)
+            continue
+        if( header is None ):
+            continue
+        fpid = bfn.split("-")[1:2]
+        if( fpid != [pid] and ( program is None or header.get("program") != program ) ):
+            continue
+        add_stored( fn, header )
+
+def add_stored( fn, header, xid = None ):
+    xilist = xi_listing( xi_file(fn,header), xid )
+    xilist.time = header["time"]
+    xilist.minframe = header["minframe"]
+    xi_db[xilist.id] = xilist
+    stored_files[fn] = xilist.id
+    return xilist
+
+# Drops the recordings whose files trim() removed
+def forget_removed( ):
+    for fn,xid in list(stored_files.items()):
+        if( os.path.exists(fn) ):
+            continue
+        del stored_files[fn]
+        xlst = xi_db.pop(xid,None)
+        if( xlst is not None and getattr(vdb.asm.xi_history,"listing",None) is xlst.listing ):
+            vdb.asm.xi_history = {}
+
+def store_listing( xilist ):
+    """
+    Moves the recording to disk if it is big enough, the entry in xi_db keeps its ID. When all recordings together
+    take more than vdb-xi-store-bytes the ones shown least recently are removed
+    """
+    if( not store.value or xilist.size() < store_threshold.value ):
+        return xilist
+    try:
+        fn = save_listing(xilist)
+        limit = store_bytes.value
+        if( limit ):
+            vdb.cache.trim("xi",limit)
+            forget_removed()
+        if( not os.path.exists(fn) ):
+            vdb.log("xi recording is bigger than vdb-xi-store-bytes, keeping it in memory",level=2)
+            return xilist
+        header = read_header(fn)
+    except OSError as e:
+        vdb.log(f"Could not store xi recording: {e}",level=2)
+        return xilist
+    return add_stored( fn, header, xilist.id )
+
 def xi( num, filter, full, events, flow ):
 #    print("############################################")
 #    vdb.util.bark() # print("BARK")
     regs = gdb.execute("registers",False,True)
 
-    oldr = vdb.register.Registers()
+    fullr = vdb.register.Registers()
+    if( fullr.frame is None ):
+        print("No frame selected, nothing to execute")
+        return
+    layout = get_layout(fullr)
+    oldr = layout.read(fullr.frame)
     pcname = vdb.arch.get_pc_name()
 
     global breakpoint_hit
@@ -268,6 +925,8 @@ def xi( num, filter, full, events, flow ):
     filter_warned = False
 
     xilist = xi_listing()
+    xilist.layout = layout
+    xilist.base = oldr.values
     xi_db[xilist.id] = xilist
 
     prog = vdb.util.progress_bar(num_completed = True, spinner = True)
@@ -299,7 +958,7 @@ def xi( num, filter, full, events, flow ):
             pc = oldr.get_value(pcname)
             ist.pc = pc
 
-            mem = vdb.memory.read( ist.pc[0], 2 )
+            mem = vdb.memory.read( ist.pc[0], 2, consumer = "xi" )
             if( mem is None ):
                 print( f"Cannot read address {int(ist.pc[0]):#0x}, refusing to execute it" )
                 break
@@ -324,7 +983,8 @@ def xi( num, filter, full, events, flow ):
             if( debug.value ):
                 ist.si_time = time.time()
 
-            r = vdb.register.Registers()
+            frame = gdb.selected_frame()
+            r = layout.read(frame)
 
             if( show_frame.value ):
                 # ~0.15ms per instruction
@@ -355,11 +1015,13 @@ def xi( num, filter, full, events, flow ):
 #        print(f"{fr_pc=}")
 #        print(f"{r.all=}")
 #        print(f"{r.regs=}")
-            dr = diff_regs(oldr,r)
+            dr = diff_regs(oldr,r,pcname)
             ist.changed_registers = dr
             ist.final_registers = r
             # XXX Needs arch independence. Check for complete list of possible flags from registers.py ?
-            ist.current_flags=r._flags("eflags",r.rflags,vdb.register.flag_info,False,False,True,None)
+            if( "eflags" in dr ):
+                rflags = { d : ( v, v.type ) for d in layout.flags if ( v := frame.read_register(d) ) is not None }
+                ist.current_flags=fullr._flags("eflags",rflags,vdb.register.flag_info,False,False,True,None)
             if( flow ):
                 ist.asm_string,ist.instruction = vdb.asm.get_single_tuple( pc[0], extra_filter="r",do_flow=flow)
             # XXX Doing the whole flow thing is rather expensive, all we need is access to the register values of the
@@ -375,8 +1037,8 @@ def xi( num, filter, full, events, flow ):
                         # Also, here we have an incompatibility between asm and register that seem to do very similar
                         # bookkeeping and surely can benefit from shared code
 
-                        for k,v in r.regs.items():
-                            nr.values[str(k)] = (int(v[0]),None)
+                        for k,v in r.items():
+                            nr.values[k] = (v,None)
 #                print(f"{nr=}")
 #                print(f"{nr.get('rip')=}")
                         val = arg.value( nr )
@@ -403,22 +1065,160 @@ def xi( num, filter, full, events, flow ):
     print(regs)
 
     vdb.util.print_table(xilist.as_table(),use_rich=False)
+    xilist = store_listing(xilist)
     if( vdb.enabled("asm") ):
         vdb.asm.xi_history = xilist.get_history()
 
 
+# The arguments of the instruction at pc that it writes to memory, each address is disassembled only once per run
+def written_operands( pc, cache ):
+    ret = cache.get(pc,None)
+    if( ret is None ):
+        _,ins = vdb.asm.get_single_tuple( pc, extra_filter="r", do_flow=False )
+        ret = []
+        if( ins is not None ):
+            ret = [ arg for arg in ins.arguments if arg.dereference and arg.target ]
+        cache[pc] = ret
+    return ret
+
+def written_memory( args, layout, values, pc ):
+    """
+    The ( value, address ) pairs of what args wrote. The addresses are calculated from the registers before the step,
+    except for the pc which (as in the disassembly) is the one of the next instruction
+    """
+    nr = vdb.asm.register_set()
+    for k,v in zip(layout.names,values):
+        nr.values[k] = (v,None)
+    nr.values[vdb.arch.get_pc_name()] = (pc,None)
+    ret = []
+    for arg in args:
+        val,addr = arg.value( nr )
+        if( addr is not None ):
+            ret.append( (val,addr) )
+    return ret
+
+def xi_record( num, filter, full, events ):
+    """
+    Like xi but only records the pc, the changed registers and the memory written by each step into a ring, everything
+    else like decoding flags is done when the recording is shown
+    """
+    fullr = vdb.register.Registers()
+    if( fullr.frame is None ):
+        print("No frame selected, nothing to execute")
+        return
+    layout = get_layout(fullr)
+    old = layout.read_values(fullr.frame)
+    pcix = layout.index[vdb.arch.get_pc_name()]
+
+    global breakpoint_hit
+    global signal_hit
+    breakpoint_hit = False
+    signal_hit = False
+
+    if( full ):
+        mmaps = vdb.register.mmapped_positions
+        ommaps = get_mmaps(mmaps,filter)
+
+    ring = xi_ring( layout, old, ring_size.value )
+    xilist = xi_listing(ring)
+    xi_db[xilist.id] = xilist
+
+    prog = vdb.util.progress_bar(num_completed = True, spinner = True)
+    pt = prog.add_task(f"Recording {num} single steps", total = num )
+    prog.start()
+    inferior = gdb.selected_inferior()
+    oldpid = inferior.pid
+    next_update = 0
+    nregs = len(old)
+    # pc => arguments writing memory, None when not recording memory at all
+    operands = None
+    if( record_memory.value and vdb.enabled("asm") ):
+        operands = {}
+
+    for ui in range(0,num):
+        now = time.time()
+        if( now > next_update ):
+            next_update = now + 0.1
+            prog.update( pt, completed = ui )
+            prog.refresh()
+        try:
+            if( breakpoint_hit ):
+                print("Breakpoint hit")
+                break
+
+            wargs = None
+            if( operands is not None ):
+                wargs = written_operands( old[pcix], operands )
+
+            with( vdb.util.silence(silence.value) ):
+                gdb.execute("si",False,True)
+            if( oldpid != inferior.pid ):
+                print("Stopping xi, inferior has died")
+                break
+            if( signal_hit ):
+                print("Stopping xi, non trap signal detected")
+                break
+
+            new = layout.read_values(gdb.selected_frame())
+            delta = []
+            for ix in range(0,nregs):
+                if( old[ix] != new[ix] ):
+                    delta.append(ix)
+                    delta.append(new[ix])
+            step = ring.add( old[pcix], tuple(delta) )
+            if( wargs ):
+                mem = written_memory( wargs, layout, old, new[pcix] )
+                if( len(mem) > 0 ):
+                    ring.memory[step] = mem
+            old = new
+
+            if( events ):
+                vdb.event.exec_hook("step")
+
+            if( full ):
+                rmmaps = get_mmaps(mmaps,filter)
+                dm = diff_mmaps( ommaps, rmmaps )
+                ommaps = rmmaps
+                if( len(dm) > 0 ):
+                    ring.mmaps[step] = dm
+        except gdb.error as e:
+            print(f"xi aborted due to gdb error: {e}")
+            break
+        except KeyboardInterrupt:
+            print("Aborting xi")
+            break
+        except:
+            print("Aborting xi")
+            vdb.print_exc()
+            break
+
+    prog.stop()
+    dropped = ring.first
+    if( dropped > 0 ):
+        print(f"Recorded {ring.end} steps, the oldest {dropped} did not fit into the ring of {ring.size}")
+    print(f"Recorded {len(ring)} steps as ID {xilist.id}, use xi show {xilist.id} to see them")
+    xilist = store_listing(xilist)
+    if( vdb.enabled("asm") ):
+        vdb.asm.xi_history = xilist.get_history()
+
 def xi_show( argv ):
     if( len(argv) == 0 ):
         print("Need to specify id to show")
         return
+    load_stored()
     xid = int(argv[0])
     xlst = xi_db.get(xid)
     if( xlst is None ):
         print(f"Cannot find xi listing for id {xid}")
         return
+    if( isinstance(xlst.listing,xi_file) ):
+        vdb.cache.touch( "xi/" + os.path.basename(xlst.listing.filename) )
     vdb.util.print_table(xlst.as_table())
+    if( vdb.enabled("asm") ):
+        vdb.asm.xi_history = xlst.get_history()
 
 def xi_list( ):
+    load_stored()
     xtbl = [ ["ID", "Time", "Size", "Begin", "End" ] ]
     for xid,xlst in xi_db.items():
         line = []
@@ -427,24 +1227,33 @@ def xi_list( ):
         dt = datetime.datetime.fromtimestamp(xlst.time)
         line.append(dt)
         line.append(xlst.size())
-        b,e = xlst.addresses()
+        if( isinstance(xlst.listing,xi_file) ):
+            b,e = xlst.listing.header["addresses"]
+        else:
+            b,e = xlst.addresses()
         line.append(f"{int(b):#0x}")
         line.append(f"{int(e):#0x}")
     vdb.util.print_table(xtbl)
 
 def xi_del( argv ):
+    load_stored()
     xid = int(argv[0])
     try:
-        del xi_db[xid]
+        xlst = xi_db.pop(xid)
+        if( isinstance(xlst.listing,xi_file) ):
+            os.unlink(xlst.listing.filename)
         print(f"Deleted ID {xid} from list")
     except KeyError:
         print(f"Could not find ID {xid}")
+    except OSError as e:
+        print(f"Deleted ID {xid} from list, but could not remove its file: {e}")
 
 class cmd_xi (vdb.command.command):
     """
 eXecute Instructions ( and save data along the way )
 xi/f       full (local variables) info per frame
 xi/e       execute a "step" hook/event on each step for other plugins
+xi/r       only record pc and registers of each step, use xi show to see them
 """
 
     def __init__ (self):
@@ -458,6 +1267,7 @@ xi/e       execute a "step" hook/event on each step for other plugins
             events = False
             filter = None
             flow = False
+            record = False
 
             if( len(argv) ):
                 match argv[0]:
@@ -485,6 +1295,8 @@ xi/e       execute a "step" hook/event on each step for other plugins
 
             if( "f" in flags ):
                 full = True
+            if( "r" in flags ):
+                record = True
             if( "F" in flags ):
                 flow = True
             if( "e" in flags ):
@@ -495,7 +1307,12 @@ xi/e       execute a "step" hook/event on each step for other plugins
 
             if( len(argv) > 0 ):
                 num = int(argv[0])
-            xi(num,filter,full,events,flow)
+            if( record ):
+                if( flow ):
+                    print("WARNING: Flow simulation is not done while recording")
+                xi_record(num,filter,full,events)
+            else:
+                xi(num,filter,full,events,flow)
 #            print (self.__doc__)
         except:
             vdb.print_exc()